@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark transferu z Azure Blob Storage: nowy klient na każde wywołanie vs współdzielony klient.
+
+Mierzy opóźnienie pobierania małych blobów (p50/p95), przepustowość małych blobów przy
+równoległych wątkach oraz przepustowość dużego bloba z domyślnymi i dostrojonymi parametrami
+transferu (max_single_get_size, max_chunk_get_size, max_concurrency). Wymaga dostępu do
+kontenera (connection string z --connect-str lub AZURE_STORAGE_CONNECTION_STRING).
+Wyniki można dopisywać do pliku JSON-lines (--output).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+import azure_clients  # noqa: E402
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def per_call_download(connect_str: str, container_name: str, blob_name: str) -> int:
+    """Dotychczasowe zachowanie skryptów: nowy klient (i nowe połączenie) na każde pobranie."""
+    from azure.storage.blob import BlobServiceClient
+
+    client = BlobServiceClient.from_connection_string(connect_str)
+    blob_client = client.get_blob_client(container=container_name, blob=blob_name)
+    return len(blob_client.download_blob().readall())
+
+
+def shared_download(connect_str: str, container_name: str, blob_name: str) -> int:
+    blob_client = azure_clients.get_blob_service_client(connect_str).get_blob_client(
+        container=container_name, blob=blob_name
+    )
+    return len(azure_clients.download_blob_to_bytes(blob_client))
+
+
+def measure_latency(download, connect_str, container_name, blob_names) -> dict:
+    latencies = []
+    for blob_name in blob_names:
+        started = time.perf_counter()
+        download(connect_str, container_name, blob_name)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+    }
+
+
+def measure_throughput(download, connect_str, container_name, blob_names, workers):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        total_bytes = sum(
+            executor.map(
+                lambda name: download(connect_str, container_name, name), blob_names
+            )
+        )
+    elapsed = time.perf_counter() - started
+    return {
+        "files_per_s": round(len(blob_names) / elapsed, 1),
+        "mb_per_s": round(total_bytes / elapsed / azure_clients.MB, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connect-str", help="Ciąg połączenia Azure (nadpisuje env).")
+    parser.add_argument("--container-name", required=True)
+    parser.add_argument(
+        "--small-prefix",
+        required=True,
+        help="Prefiks, z którego brane są małe bloby (np. folder z obrazami).",
+    )
+    parser.add_argument(
+        "--small-count",
+        type=int,
+        default=100,
+        help="Liczba małych blobów (domyślnie: 100).",
+    )
+    parser.add_argument(
+        "--large-blob", help="(Opcjonalnie) Duży blob (np. archiwum ZIP) do pomiaru."
+    )
+    parser.add_argument(
+        "--output", help="Plik JSON-lines, do którego dopisywany jest wynik."
+    )
+    azure_clients.add_transfer_arguments(parser)
+    args = parser.parse_args()
+    azure_clients.configure_transfer(args)
+
+    connect_str = args.connect_str or os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if not connect_str:
+        sys.exit("Błąd: Brak ciągu połączenia.")
+
+    container_client = azure_clients.get_blob_service_client(
+        connect_str
+    ).get_container_client(args.container_name)
+    small_blobs = []
+    for blob in container_client.list_blobs(name_starts_with=args.small_prefix):
+        small_blobs.append(blob.name)
+        if len(small_blobs) >= args.small_count:
+            break
+    if not small_blobs:
+        sys.exit(f"Błąd: Brak blobów z prefiksem '{args.small_prefix}'.")
+    print(f"Małe bloby: {len(small_blobs)} (prefiks '{args.small_prefix}')")
+
+    # Rozgrzewka współdzielonego klienta (DNS, TLS), aby porównywać stan ustalony
+    shared_download(connect_str, args.container_name, small_blobs[0])
+
+    results = {
+        "small_latency_per_call": measure_latency(
+            per_call_download, connect_str, args.container_name, small_blobs
+        ),
+        "small_latency_shared": measure_latency(
+            shared_download, connect_str, args.container_name, small_blobs
+        ),
+        "small_throughput_per_call": measure_throughput(
+            per_call_download,
+            connect_str,
+            args.container_name,
+            small_blobs,
+            args.download_workers,
+        ),
+        "small_throughput_shared": measure_throughput(
+            shared_download,
+            connect_str,
+            args.container_name,
+            small_blobs,
+            args.download_workers,
+        ),
+    }
+    if args.large_blob:
+        for case_name, download in (
+            ("large_per_call_defaults", per_call_download),
+            ("large_shared_tuned", shared_download),
+        ):
+            started = time.perf_counter()
+            size = download(connect_str, args.container_name, args.large_blob)
+            elapsed = time.perf_counter() - started
+            results[case_name] = {
+                "mb": round(size / azure_clients.MB, 1),
+                "mb_per_s": round(size / elapsed / azure_clients.MB, 2),
+            }
+
+    for case_name, values in results.items():
+        print(
+            f"{case_name:30s} "
+            + "  ".join(f"{key}={value}" for key, value in values.items())
+        )
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "settings": {
+                            "download_workers": args.download_workers,
+                            "max_concurrency": args.max_concurrency,
+                            "max_single_get_size_mb": args.max_single_get_size_mb,
+                            "max_chunk_get_size_mb": args.max_chunk_get_size_mb,
+                        },
+                        "results": results,
+                    }
+                )
+                + "\n"
+            )
+        print(f"Dopisano wynik do {args.output}")
+
+
+if __name__ == "__main__":
+    main()
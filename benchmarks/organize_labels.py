@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark organize_labels: dotychczasowa pętla (relpath, os.path.exists x2 i copy2 na etykietę,
+jeden wątek) vs wyznaczanie kluczy dla całej listy naraz i zapis partiami w puli wątków.
+
+Tworzy syntetyczny dataset (puste obrazy w images/train|valid, etykiety w folderze
+"rozpakowanego archiwum" i mapowanie) dla każdej wielkości z --sizes, mierzy czas obu wersji
+i sprawdza, że dają te same pliki. Uwaga: 1M etykiet to ~2M plików na dysku roboczym.
+
+Osobno (w pamięci, bez dysku) mierzy przemapowanie id klas dla --remap-sizes plików etykiet:
+pętla po liniach (remap_label_content na plik) vs remap_label_contents (numpy, partiami),
+dla przemapowania bez zmiany szerokości id i ze zmianą (np. 9 -> 11), i sprawdza zgodność.
+Wyniki można dopisywać do pliku JSON-lines (--output).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+from organize_yolo_labels import (  # noqa: E402
+    organize_labels,
+    build_stem_index,
+    remap_label_content,
+    remap_label_contents,
+    DEFAULT_LABEL_WORKERS,
+    LABEL_WRITE_BATCH,
+)
+from prepare_yolo_dataset import flatten_azure_path, assign_split  # noqa: E402
+
+ZIP_BASE_STRUCTURE = "obj_train_data"
+IMAGES_PER_FOLDER = 1000
+REMAP_NUM_CLASSES = 12
+REMAP_CASES = {
+    # Zamiana dwóch klas: szerokość id bez zmian (zapis w miejscu)
+    "swap": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 10],
+    # Odwrócona kolejność: id jedno- i dwucyfrowe zamieniają się miejscami
+    "reverse": list(range(REMAP_NUM_CLASSES - 1, -1, -1)),
+}
+
+
+def build_dataset(work_dir: str, count: int) -> tuple[list[str], str, dict[str, str]]:
+    """Tworzy obrazy, etykiety i mapowanie. Zwraca (pliki etykiet, folder archiwum, mapowanie)."""
+    extract_dir = os.path.join(work_dir, "extracted")
+    path_mapping = {}
+    txt_files = []
+    for split in ("train", "valid"):
+        os.makedirs(os.path.join(work_dir, "dataset", "images", split))
+    for index in range(count):
+        folder = f"cam{index // IMAGES_PER_FOLDER:04d}"
+        azure_path = f"{folder}/img{index:07d}.jpeg"
+        flat_filename = flatten_azure_path(azure_path)
+        split = assign_split(azure_path, 0.1, 42)
+        path_mapping[azure_path] = flat_filename
+        open(
+            os.path.join(work_dir, "dataset", "images", split, flat_filename), "wb"
+        ).close()
+        label_dir = os.path.join(extract_dir, ZIP_BASE_STRUCTURE, folder)
+        if index % IMAGES_PER_FOLDER == 0:
+            os.makedirs(label_dir)
+        txt_path = os.path.join(label_dir, f"img{index:07d}.txt")
+        with open(txt_path, "w") as f:
+            f.write("0 0.5 0.5 0.1 0.1\n")
+        txt_files.append(txt_path)
+    return txt_files, extract_dir, path_mapping
+
+
+def organize_labels_legacy(
+    source_txt_files, extract_base_path, dataset_base_dir, path_mapping, image_ext
+) -> int:
+    """Dotychczasowa pętla na etykietę (bez przemapowania klas), do porównania."""
+    from tqdm import tqdm
+
+    copied = 0
+    for txt_path in tqdm(source_txt_files, desc="   legacy", unit="plik"):
+        relative_txt_path = os.path.relpath(txt_path, extract_base_path).replace(
+            "\\", "/"
+        )
+        prefix_to_remove = ZIP_BASE_STRUCTURE + "/"
+        if relative_txt_path.startswith(prefix_to_remove):
+            relative_txt_path = relative_txt_path[len(prefix_to_remove) :]
+        key = f"{os.path.splitext(relative_txt_path)[0]}.{image_ext}"
+        flat_filename = path_mapping.get(key)
+        if not flat_filename:
+            continue
+        for split in ("train", "valid"):
+            if os.path.exists(
+                os.path.join(dataset_base_dir, "images", split, flat_filename)
+            ):
+                labels_dir = os.path.join(dataset_base_dir, "labels", split)
+                os.makedirs(labels_dir, exist_ok=True)
+                shutil.copy2(
+                    txt_path,
+                    os.path.join(
+                        labels_dir, os.path.splitext(flat_filename)[0] + ".txt"
+                    ),
+                )
+                copied += 1
+                break
+    return copied
+
+
+def build_label_contents(count: int, lines_per_label: int) -> list[bytes]:
+    """Syntetyczne treści etykiet YOLO (deterministyczne, różne id klas i współrzędne)."""
+    return [
+        b"".join(
+            b"%d 0.%06d 0.%06d 0.%06d 0.%06d\n"
+            % (
+                (index + line) % REMAP_NUM_CLASSES,
+                index % 999983,
+                (index * 7 + line) % 999983,
+                (index * 13) % 99991,
+                (index * 17 + line) % 99991,
+            )
+            for line in range(lines_per_label)
+        )
+        for index in range(count)
+    ]
+
+
+def run_remap_benchmark(size: int, lines_per_label: int, repeat: int) -> dict:
+    """Przemapowanie id klas w pamięci: pętla po liniach vs remap_label_contents (partie jak przy zapisie)."""
+    contents = build_label_contents(size, lines_per_label)
+    case = {}
+    for case_name, class_remap in REMAP_CASES.items():
+
+        def per_line():
+            return [
+                remap_label_content(content, class_remap)[0] for content in contents
+            ]
+
+        def bulk():
+            results = []
+            for start in range(0, len(contents), LABEL_WRITE_BATCH):
+                results.extend(
+                    remap_label_contents(
+                        contents[start : start + LABEL_WRITE_BATCH], class_remap
+                    )[0]
+                )
+            return results
+
+        best = {}
+        outputs = {}
+        for _ in range(repeat):
+            for name, run in (("per_line", per_line), ("bulk", bulk)):
+                started = time.perf_counter()
+                outputs[name] = run()
+                elapsed = time.perf_counter() - started
+                best[name] = min(best.get(name, elapsed), elapsed)
+        if outputs["per_line"] != outputs["bulk"]:
+            sys.exit(
+                f"Błąd: różne wyniki przemapowania dla {size} etykiet ({case_name})."
+            )
+        case[f"{case_name}_per_line_s"] = round(best["per_line"], 3)
+        case[f"{case_name}_bulk_s"] = round(best["bulk"], 3)
+        case[f"{case_name}_speedup"] = round(best["per_line"] / best["bulk"], 2)
+    return case
+
+
+def list_labels(dataset_dir: str) -> list[str]:
+    return sorted(
+        f"{split}/{name}"
+        for split in ("train", "valid")
+        for name in os.listdir(os.path.join(dataset_dir, "labels", split))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="100000,1000000",
+        help="Liczby etykiet oddzielone przecinkami (domyślnie: 100000,1000000; '' pomija pomiar na dysku).",
+    )
+    parser.add_argument(
+        "--remap-sizes",
+        default="100000,1000000",
+        help="Liczby etykiet dla pomiaru przemapowania id klas w pamięci (domyślnie: 100000,1000000; '' pomija).",
+    )
+    parser.add_argument(
+        "--lines-per-label",
+        type=int,
+        default=3,
+        help="Liczba obiektów (linii) w każdej etykiecie przy pomiarze przemapowania (domyślnie: 3).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_LABEL_WORKERS,
+        help=f"Liczba wątków zapisu w nowej wersji (domyślnie: {DEFAULT_LABEL_WORKERS}).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Liczba powtórzeń każdego wariantu; raportowany jest najlepszy czas (domyślnie: 3).",
+    )
+    parser.add_argument(
+        "--work-dir",
+        help="Folder roboczy (domyślnie: katalog tymczasowy systemu). Warto wskazać docelowy dysk.",
+    )
+    parser.add_argument(
+        "--output", help="Plik JSON-lines, do którego dopisywany jest wynik."
+    )
+    args = parser.parse_args()
+
+    remap_results = {}
+    for size in (int(value) for value in args.remap_sizes.split(",") if value):
+        print(
+            f"Przemapowanie id klas: {size} etykiet po {args.lines_per_label} linie..."
+        )
+        case = run_remap_benchmark(size, args.lines_per_label, args.repeat)
+        remap_results[str(size)] = case
+        print(
+            f"{size:>9d} etykiet: "
+            + "  ".join(f"{key}={value}" for key, value in case.items()),
+            flush=True,
+        )
+
+    results = {}
+    for size in (int(value) for value in args.sizes.split(",") if value):
+        work_dir = tempfile.mkdtemp(prefix="bench_organize_", dir=args.work_dir)
+        try:
+            print(f"Przygotowanie {size} etykiet w {work_dir}...")
+            txt_files, extract_dir, path_mapping = build_dataset(work_dir, size)
+            dataset_dir = os.path.join(work_dir, "dataset")
+            stem_index, _ = build_stem_index(path_mapping, "jpeg")
+
+            variants = {
+                "legacy": lambda: organize_labels_legacy(
+                    txt_files, extract_dir, dataset_dir, path_mapping, "jpeg"
+                )
+            }
+            for workers in sorted({1, args.workers}):
+                variants[f"batched_{workers}w"] = (
+                    lambda workers=workers: organize_labels(
+                        txt_files,
+                        extract_dir,
+                        dataset_dir,
+                        stem_index,
+                        ZIP_BASE_STRUCTURE,
+                        workers=workers,
+                    )
+                )
+            # Zapis z przemapowaniem id klas (odczyt, remap_label_contents na partię, zapis)
+            variants[f"batched_remap_{args.workers}w"] = lambda: organize_labels(
+                txt_files,
+                extract_dir,
+                dataset_dir,
+                stem_index,
+                ZIP_BASE_STRUCTURE,
+                class_remap=REMAP_CASES["reverse"],
+                workers=args.workers,
+            )
+
+            # Warianty na przemian, najlepszy z --repeat czasów (mniejszy wpływ cache i szumu dysku)
+            best = {name: float("inf") for name in variants}
+            legacy_labels = None
+            for _ in range(args.repeat):
+                for name, run in variants.items():
+                    started = time.perf_counter()
+                    run()
+                    best[name] = min(best[name], time.perf_counter() - started)
+                    labels = list_labels(dataset_dir)
+                    if legacy_labels is None:
+                        legacy_labels = labels
+                    elif labels != legacy_labels:
+                        sys.exit(f"Błąd: różne wyniki dla {size} etykiet ({name}).")
+                    shutil.rmtree(os.path.join(dataset_dir, "labels"))
+
+            case = {"legacy_s": round(best["legacy"], 2)}
+            for name in variants:
+                if name != "legacy":
+                    case[f"{name}_s"] = round(best[name], 2)
+                    case[f"speedup_{name}"] = round(best["legacy"] / best[name], 2)
+            results[str(size)] = case
+            print(
+                f"{size:>9d} etykiet: "
+                + "  ".join(f"{key}={value}" for key, value in case.items())
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "workers": args.workers,
+                        "repeat": args.repeat,
+                        "results": results,
+                        "remap_lines_per_label": args.lines_per_label,
+                        "remap_results": remap_results,
+                    }
+                )
+                + "\n"
+            )
+        print(f"Dopisano wynik do {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark czasu startu skryptów (python -X importtime).
+
+Uruchamia każdy skrypt w trybach, które nie powinny ładować ciężkich zależności
+(--help, regeneracja plików konfiguracyjnych), i raportuje łączny czas importów,
+najdroższe moduły oraz to, czy załadowano SDK Azure. Wyniki można dopisywać do
+pliku JSON-lines (--output), aby śledzić je w czasie.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+HEAVY_MODULES = ("azure", "tqdm", "yaml", "dotenv", "aiohttp", "numpy")
+
+
+def parse_importtime(stderr: str) -> tuple[int, dict[str, int]]:
+    """Zwraca (łączny czas importów w us, {moduł_najwyższego_poziomu: czas_skumulowany_us})."""
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        # Moduły zagnieżdżone są wcięte o 2 spacje na poziom
+        if not name[1:].startswith(" "):
+            top_level[name.strip()] = int(cumulative_us)
+    return sum(top_level.values()), top_level
+
+
+def run_case(args: list[str], cwd: str) -> tuple[float, int, dict[str, int]]:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"{' '.join(args)} zakończone kodem {result.returncode}: {result.stderr[-500:]}"
+        )
+    total_us, modules = parse_importtime(result.stderr)
+    return wall, total_us, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Liczba powtórzeń (mediana)."
+    )
+    parser.add_argument(
+        "--output", help="Plik JSON-lines, do którego dopisywany jest wynik."
+    )
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="startup_bench_")
+    try:
+        dataset_dir = os.path.join(work_dir, "ds")
+        for split in ("train", "valid"):
+            os.makedirs(os.path.join(dataset_dir, "images", split))
+        with open(os.path.join(work_dir, "obj.names"), "w", encoding="utf-8") as f:
+            f.write("reklama\n")
+
+        cases = {
+            f"{name} --help": [os.path.join(SCRIPTS_DIR, f"{name}.py"), "--help"]
+            for name in (
+                "find_images_to_train",
+                "prepare_yolo_dataset",
+                "organize_yolo_labels",
+                "pipeline_async",
+                "watch_container",
+            )
+        }
+        cases["organize_yolo_labels --config-only"] = [
+            os.path.join(SCRIPTS_DIR, "organize_yolo_labels.py"),
+            "--dataset-dir",
+            dataset_dir,
+            "--config-only",
+            "--local-class-names",
+            os.path.join(work_dir, "obj.names"),
+        ]
+
+        results = {}
+        for case_name, case_args in cases.items():
+            walls, imports = [], []
+            modules = {}
+            for _ in range(args.repeat):
+                wall, total_us, modules = run_case(case_args, work_dir)
+                walls.append(wall)
+                imports.append(total_us)
+            heavy = sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES)
+            slowest = sorted(modules.items(), key=lambda item: -item[1])[:3]
+            results[case_name] = {
+                "wall_ms": round(statistics.median(walls) * 1000, 1),
+                "imports_ms": round(statistics.median(imports) / 1000, 1),
+                "heavy_modules": heavy,
+            }
+            print(
+                f"{case_name:40s} start={results[case_name]['wall_ms']:7.1f} ms  importy={results[case_name]['imports_ms']:7.1f} ms  "
+                f"najdroższe: {', '.join(f'{m}={us / 1000:.1f}ms' for m, us in slowest)}"
+            )
+            if heavy:
+                print(f"  Załadowane ciężkie zależności: {', '.join(heavy)}")
+            if any(m.split(".")[0] == "azure" for m in heavy):
+                print("  UWAGA: ten tryb nie powinien ładować SDK Azure!")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "results": results,
+                    }
+                )
+                + "\n"
+            )
+        print(f"Dopisano wynik do {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Lokalny cache sparsowanych archiwów z adnotacjami (CVAT XML / YOLO).
+
+Wpisy są kluczowane (etap, kontener, blob, ETag): jeśli archiwum w Azure się nie
+zmieniło, wystarczy jedno zapytanie HEAD zamiast pobierania i parsowania ZIPa.
+Każdy wpis to skompresowany (zlib) JSON w osobnym pliku; najdawniej używane wpisy
+są usuwane po przekroczeniu limitu rozmiaru cache. Wpisy z rekordem na obraz (etap XML) są
+zapisywane i czytane strumieniowo (CachedRecordsWriter / iter_cached_records: nagłówek i rekordy
+jako skompresowane linie JSON), więc pamięć nie rośnie z liczbą obrazów w archiwum.
+"""
+
+import os
+import sys
+import json
+import zlib
+import hashlib
+from typing import Iterator, Optional
+from storage_backends import StorageBackend
+
+CACHE_FILE_SUFFIX = ".json.z"
+RECORDS_FILE_SUFFIX = ".jsonl.z"
+RECORDS_READ_SIZE = 256 * 1024
+DEFAULT_CACHE_DIR = ".annotation_cache"
+DEFAULT_CACHE_MAX_MB = 512
+
+
+def get_blob_etag(
+    storage: StorageBackend, container_name: str, blob_name: str
+) -> Optional[str]:
+    """Zwraca ETag bloba (jedno zapytanie HEAD) lub None, jeśli nie da się go odczytać."""
+    try:
+        return storage.get_properties(container_name, blob_name).etag
+    except Exception as e:
+        print(
+            f"  Ostrzeżenie: Nie można odczytać ETag dla '{blob_name}' (cache pominięty): {e}",
+            file=sys.stderr,
+        )
+        return None
+
+
+def _cache_entry_path(
+    cache_dir: str,
+    stage: str,
+    container_name: str,
+    blob_name: str,
+    etag: str,
+    suffix: str = CACHE_FILE_SUFFIX,
+) -> str:
+    key = "\0".join([stage, container_name, blob_name, etag])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{stage}-{digest}{suffix}")
+
+
+def _encode_line(value) -> bytes:
+    return (json.dumps(value, ensure_ascii=False, separators=(",", ":")) + "\n").encode(
+        "utf-8"
+    )
+
+
+def load_cached_annotations(
+    cache_dir: str,
+    stage: str,
+    container_name: str,
+    blob_name: str,
+    etag: str,
+    touch: bool = True,
+) -> Optional[dict]:
+    """
+    Wczytuje wpis z cache lub zwraca None (brak wpisu / uszkodzony wpis).
+    touch=False nie aktualizuje czasu użycia wpisu (tryby bez zapisu, np. --plan).
+    """
+    entry_path = _cache_entry_path(cache_dir, stage, container_name, blob_name, etag)
+    try:
+        with open(entry_path, "rb") as f:
+            payload = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(
+            f"  Ostrzeżenie: Uszkodzony wpis cache '{entry_path}', zostanie nadpisany: {e}",
+            file=sys.stderr,
+        )
+        return None
+    if touch:
+        try:
+            os.utime(entry_path)  # Aktualizacja czasu użycia (dla usuwania LRU)
+        except OSError:
+            pass
+    print(f"  Użyto cache dla '{blob_name}' (ETag {etag}).")
+    return payload
+
+
+def store_cached_annotations(
+    cache_dir: str,
+    stage: str,
+    container_name: str,
+    blob_name: str,
+    etag: str,
+    payload: dict,
+    max_cache_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024,
+) -> bool:
+    """Zapisuje wpis do cache (atomowo) i usuwa najdawniej używane wpisy ponad limit."""
+    entry_path = _cache_entry_path(cache_dir, stage, container_name, blob_name, etag)
+    tmp_path = entry_path + ".tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        data = zlib.compress(
+            json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(
+                "utf-8"
+            ),
+            6,
+        )
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, entry_path)
+    except Exception as e:
+        print(
+            f"  Ostrzeżenie: Nie można zapisać cache dla '{blob_name}': {e}",
+            file=sys.stderr,
+        )
+        return False
+    evict_cache_entries(cache_dir, max_cache_bytes, keep=entry_path)
+    return True
+
+
+class CachedRecordsWriter:
+    """
+    Strumieniowy zapis wpisu cache: nagłówek (header) i rekordy dopisywane przez append, jak do
+    listy. Wpis staje się widoczny dopiero po commit (atomowo). Błąd zapisu tylko wyłącza cache
+    dla tego archiwum (ostrzeżenie), nie przerywa przetwarzania.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        stage: str,
+        container_name: str,
+        blob_name: str,
+        etag: str,
+        header: dict,
+        max_cache_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.blob_name = blob_name
+        self.max_cache_bytes = max_cache_bytes
+        self.entry_path = _cache_entry_path(
+            cache_dir, stage, container_name, blob_name, etag, RECORDS_FILE_SUFFIX
+        )
+        self.tmp_path = self.entry_path + ".tmp"
+        self.compressor = zlib.compressobj(6)
+        self.file = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.file = open(self.tmp_path, "wb")
+            self.file.write(self.compressor.compress(_encode_line(header)))
+        except OSError as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception):
+        print(
+            f"  Ostrzeżenie: Nie można zapisać cache dla '{self.blob_name}': {error}",
+            file=sys.stderr,
+        )
+        self.abort()
+
+    def append(self, record):
+        if self.file is None:
+            return
+        try:
+            self.file.write(self.compressor.compress(_encode_line(record)))
+        except OSError as e:
+            self._fail(e)
+
+    def commit(self) -> bool:
+        """Zamyka wpis, publikuje go atomowo i usuwa najdawniej używane wpisy ponad limit."""
+        if self.file is None:
+            return False
+        try:
+            self.file.write(self.compressor.flush())
+            self.file.close()
+            self.file = None
+            os.replace(self.tmp_path, self.entry_path)
+        except OSError as e:
+            self._fail(e)
+            return False
+        evict_cache_entries(self.cache_dir, self.max_cache_bytes, keep=self.entry_path)
+        return True
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def iter_cached_records(
+    cache_dir: str,
+    stage: str,
+    container_name: str,
+    blob_name: str,
+    etag: str,
+    touch: bool = True,
+) -> Optional[tuple[dict, Iterator]]:
+    """
+    Otwiera wpis zapisany przez CachedRecordsWriter: (nagłówek, iterator rekordów) lub None (brak
+    wpisu / uszkodzony nagłówek). Rekordy są dekompresowane strumieniowo; uszkodzenie dalszej
+    części wpisu zgłasza ValueError w trakcie iteracji (wpis jest wtedy usuwany).
+    """
+    entry_path = _cache_entry_path(
+        cache_dir, stage, container_name, blob_name, etag, RECORDS_FILE_SUFFIX
+    )
+    try:
+        f = open(entry_path, "rb")
+    except FileNotFoundError:
+        return None
+
+    def iter_lines() -> Iterator[bytes]:
+        decompressor = zlib.decompressobj()
+        pending = b""
+        with f:
+            while True:
+                chunk = f.read(RECORDS_READ_SIZE)
+                if not chunk:
+                    break
+                lines = (pending + decompressor.decompress(chunk)).split(b"\n")
+                pending = lines.pop()
+                yield from lines
+        if pending or not decompressor.eof:
+            raise zlib.error("niekompletny wpis")
+
+    def discard(error: Exception):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        return ValueError(f"uszkodzony wpis cache '{entry_path}': {error}")
+
+    lines = iter_lines()
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, OSError, ValueError, zlib.error) as e:
+        f.close()
+        print(f"  Ostrzeżenie: {discard(e)}, zostanie nadpisany.", file=sys.stderr)
+        return None
+
+    def iter_records():
+        try:
+            for line in lines:
+                yield json.loads(line)
+        except (OSError, ValueError, zlib.error) as e:
+            raise discard(e) from e
+
+    if touch:
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+    print(f"  Użyto cache dla '{blob_name}' (ETag {etag}).")
+    return header, iter_records()
+
+
+def evict_cache_entries(
+    cache_dir: str, max_cache_bytes: int, keep: Optional[str] = None
+) -> int:
+    """Usuwa najdawniej używane wpisy, aż łączny rozmiar cache zmieści się w limicie. Zwraca liczbę usuniętych."""
+    entries = []
+    total_size = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.name.endswith((CACHE_FILE_SUFFIX, RECORDS_FILE_SUFFIX)):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total_size <= max_cache_bytes:
+            break
+        if keep is not None and os.path.samefile(path, keep):
+            continue
+        try:
+            os.remove(path)
+            total_size -= size
+            removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Wspólna fabryka klientów Azure Blob Storage.
+
+Wszystkie skrypty pobierają klienta przez get_blob_service_client: jeden klient na proces
+(i connection string) ze wspólną pulą połączeń HTTP (keep-alive, ponowne użycie sesji TLS),
+rozmiarem puli dopasowanym do liczby wątków pobierania oraz konfigurowalnymi parametrami
+transferu SDK (max_single_get_size, max_chunk_get_size, max_concurrency).
+Klienci zliczają odpowiedzi kwalifikujące się do ponowienia przez politykę SDK (408, 429, 5xx);
+licznik (retryable_response_count) trafia do raportów postępu jako "ponowienia".
+SDK Azure jest importowane leniwie, przy pierwszym użyciu.
+"""
+
+import threading
+from typing import Optional
+
+MB = 1024 * 1024
+DEFAULT_MAX_SINGLE_GET_SIZE_MB = 32  # Domyślne wartości SDK
+DEFAULT_MAX_CHUNK_GET_SIZE_MB = 4
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_DOWNLOAD_WORKERS = 8
+DEFAULT_CONNECTION_TIMEOUT = 20
+DEFAULT_READ_TIMEOUT = 60
+RETRYABLE_STATUS_CODES = frozenset((408, 429, 500, 502, 503, 504))
+
+_settings = {
+    "max_single_get_size": DEFAULT_MAX_SINGLE_GET_SIZE_MB * MB,
+    "max_chunk_get_size": DEFAULT_MAX_CHUNK_GET_SIZE_MB * MB,
+    "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+    "download_workers": DEFAULT_DOWNLOAD_WORKERS,
+}
+_clients = {}
+_clients_lock = threading.Lock()
+_retryable_responses = 0
+
+
+def add_transfer_arguments(
+    parser, default_workers: Optional[int] = DEFAULT_DOWNLOAD_WORKERS
+):
+    """Dodaje do parsera wspólne opcje transferu Azure (default_workers=None - bez --download-workers)."""
+    if default_workers is not None:
+        parser.add_argument(
+            "--download-workers",
+            type=int,
+            default=default_workers,
+            help=f"Liczba równoległych pobrań; pula połączeń HTTP jest do niej dopasowana (domyślnie: {default_workers}).",
+        )
+    parser.add_argument(
+        "--max-single-get-size-mb",
+        type=float,
+        default=DEFAULT_MAX_SINGLE_GET_SIZE_MB,
+        help=f"Bloby do tej wielkości są pobierane jednym żądaniem GET (domyślnie: {DEFAULT_MAX_SINGLE_GET_SIZE_MB} MB).",
+    )
+    parser.add_argument(
+        "--max-chunk-get-size-mb",
+        type=float,
+        default=DEFAULT_MAX_CHUNK_GET_SIZE_MB,
+        help=f"Rozmiar fragmentu przy pobieraniu większych blobów (domyślnie: {DEFAULT_MAX_CHUNK_GET_SIZE_MB} MB).",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help=f"Liczba równoległych fragmentów przy pobieraniu jednego dużego bloba (domyślnie: {DEFAULT_MAX_CONCURRENCY}).",
+    )
+
+
+def configure_transfer(args):
+    """Ustawia parametry transferu z opcji add_transfer_arguments (przed utworzeniem klientów)."""
+    workers = getattr(args, "download_workers", 1)
+    if (
+        workers < 1
+        or args.max_concurrency < 1
+        or args.max_single_get_size_mb <= 0
+        or args.max_chunk_get_size_mb <= 0
+    ):
+        raise ValueError(
+            "--download-workers, --max-concurrency i rozmiary transferu muszą być dodatnie"
+        )
+    _settings["download_workers"] = workers
+    _settings["max_concurrency"] = args.max_concurrency
+    _settings["max_single_get_size"] = int(args.max_single_get_size_mb * MB)
+    _settings["max_chunk_get_size"] = int(args.max_chunk_get_size_mb * MB)
+
+
+def download_workers() -> int:
+    return _settings["download_workers"]
+
+
+def max_concurrency() -> int:
+    return _settings["max_concurrency"]
+
+
+def connection_pool_size() -> int:
+    """Każdy wątek pobierania może używać max_concurrency połączeń naraz (+1 na listowanie/HEAD)."""
+    return _settings["download_workers"] * _settings["max_concurrency"] + 1
+
+
+def retryable_response_count() -> int:
+    """Liczba odpowiedzi 408/429/5xx od startu procesu (błędy połączenia nie są liczone)."""
+    return _retryable_responses
+
+
+def _count_retryable_response(response) -> None:
+    """raw_response_hook klientów: wywoływany po każdej próbie żądania."""
+    global _retryable_responses
+    if response.http_response.status_code in RETRYABLE_STATUS_CODES:
+        with _clients_lock:
+            _retryable_responses += 1
+
+
+def _create_transport(pool_size: int):
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(
+        session=session,
+        session_owner=True,
+        connection_timeout=DEFAULT_CONNECTION_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+    )
+
+
+def get_blob_service_client(connect_str: str):
+    """Zwraca współdzielonego (w obrębie procesu) klienta BlobServiceClient dla connection stringa."""
+    key = (
+        connect_str,
+        _settings["max_single_get_size"],
+        _settings["max_chunk_get_size"],
+        connection_pool_size(),
+    )
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            from azure.storage.blob import BlobServiceClient
+
+            client = BlobServiceClient.from_connection_string(
+                connect_str,
+                transport=_create_transport(connection_pool_size()),
+                max_single_get_size=_settings["max_single_get_size"],
+                max_chunk_get_size=_settings["max_chunk_get_size"],
+                raw_response_hook=_count_retryable_response,
+            )
+            _clients[key] = client
+    return client
+
+
+def create_async_blob_service_client(connect_str: str, pool_size: Optional[int] = None):
+    """
+    Tworzy asynchronicznego klienta z jedną sesją aiohttp (pula pool_size połączeń).
+    Musi być wywołane wewnątrz działającej pętli asyncio; używać jako 'async with'.
+    """
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+    from azure.storage.blob.aio import BlobServiceClient
+
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size or connection_pool_size())
+    )
+    return BlobServiceClient.from_connection_string(
+        connect_str,
+        transport=AioHttpTransport(session=session, session_owner=True),
+        max_single_get_size=_settings["max_single_get_size"],
+        max_chunk_get_size=_settings["max_chunk_get_size"],
+        raw_response_hook=_count_retryable_response,
+    )
+
+
+def download_blob_to_file(blob_client, file_obj) -> tuple[int, Optional[bytes]]:
+    """
+    Pobiera blob strumieniowo do otwartego pliku (bez bufora readall).
+    Zwraca (liczba bajtów, Content-MD5 bloba lub None, jeśli nie jest ustawione).
+    """
+    downloader = blob_client.download_blob(max_concurrency=max_concurrency())
+    size = downloader.readinto(file_obj)
+    content_md5 = downloader.properties.content_settings.content_md5
+    return size, bytes(content_md5) if content_md5 else None
+
+
+def download_blob_to_bytes(blob_client) -> bytes:
+    return blob_client.download_blob(max_concurrency=max_concurrency()).readall()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Indeks datasetu (dataset_index.tsv) i generowanie train.txt / val.txt.
+
+Indeks ma jeden wiersz na obraz: 'obraz<TAB>zbiór<TAB>etykieta(0/1)<TAB>status', posortowany
+po nazwie obrazu. Pliki list są generowane z indeksu jednym strumieniowym zapisem (posortowane,
+bez skanowania katalogów), a przy niewielkiej liczbie zmian aktualizowane przyrostowo:
+każdy zapis indeksu dopisuje zmienione obrazy do dziennika zmian, który jest konsumowany
+przy następnej regeneracji list.
+"""
+
+import os
+import sys
+import heapq
+from typing import Iterable, Optional
+
+INDEX_FILENAME = "dataset_index.tsv"
+INDEX_HEADER = "# image\tsplit\tlabel\tstatus\n"
+PENDING_FILENAME = "dataset_index.pending"
+LISTS_STATE_FILENAME = "dataset_index.lists"
+STATUS_OK = "ok"
+STATUS_QUARANTINED = "quarantined"
+SPLIT_LIST_FILES = {"train": "train.txt", "valid": "val.txt"}
+
+# Wpis indeksu: (zbiór, ma_etykietę, status)
+IndexEntry = tuple[str, bool, str]
+
+
+def read_dataset_index(dataset_dir: str) -> Optional[dict[str, IndexEntry]]:
+    """Wczytuje indeks datasetu lub zwraca None, jeśli go nie ma."""
+    index_path = os.path.join(dataset_dir, INDEX_FILENAME)
+    entries = {}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                image, split, label, status = line.rstrip("\n").split("\t")
+                entries[image] = (split, label == "1", status)
+    except FileNotFoundError:
+        return None
+    return entries
+
+
+def write_dataset_index(
+    dataset_dir: str,
+    entries: dict[str, IndexEntry],
+    changed_images: Optional[set[str]] = None,
+):
+    """Zapisuje indeks (posortowany) atomowo i dopisuje zmienione obrazy do dziennika zmian."""
+    index_path = os.path.join(dataset_dir, INDEX_FILENAME)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(INDEX_HEADER)
+        for image in sorted(entries):
+            split, has_label, status = entries[image]
+            f.write(f"{image}\t{split}\t{int(has_label)}\t{status}\n")
+    if changed_images:
+        with open(
+            os.path.join(dataset_dir, PENDING_FILENAME), "a", encoding="utf-8"
+        ) as f:
+            f.writelines(image + "\n" for image in changed_images)
+    os.replace(tmp_path, index_path)
+
+
+def scan_split_dirs(dataset_dir: str) -> dict[str, IndexEntry]:
+    """Buduje wpisy indeksu ze struktury katalogów (po jednym scandir na katalog, bez stat na plik)."""
+    entries = {}
+    for split in SPLIT_LIST_FILES:
+        label_bases = set()
+        try:
+            with os.scandir(os.path.join(dataset_dir, "labels", split)) as it:
+                label_bases = {
+                    os.path.splitext(e.name)[0] for e in it if e.name.endswith(".txt")
+                }
+        except FileNotFoundError:
+            pass
+        try:
+            with os.scandir(os.path.join(dataset_dir, "images", split)) as it:
+                for e in it:
+                    if e.is_file():
+                        has_label = os.path.splitext(e.name)[0] in label_bases
+                        entries[e.name] = (split, has_label, STATUS_OK)
+        except FileNotFoundError:
+            pass
+    return entries
+
+
+def refresh_label_flags(dataset_dir: str, entries: dict[str, IndexEntry]) -> set[str]:
+    """
+    Aktualizuje w indeksie flagi etykiet na podstawie labels/train i labels/valid.
+    Zwraca zbiór obrazów, których wpis się zmienił.
+    """
+    label_bases = {}
+    for split in SPLIT_LIST_FILES:
+        try:
+            with os.scandir(os.path.join(dataset_dir, "labels", split)) as it:
+                label_bases[split] = {
+                    os.path.splitext(e.name)[0] for e in it if e.name.endswith(".txt")
+                }
+        except FileNotFoundError:
+            label_bases[split] = set()
+    changed = set()
+    for image, (split, has_label, status) in entries.items():
+        now_has_label = os.path.splitext(image)[0] in label_bases.get(split, ())
+        if now_has_label != has_label:
+            entries[image] = (split, now_has_label, status)
+            changed.add(image)
+    return changed
+
+
+def merge_index_entries(
+    previous: Optional[dict[str, IndexEntry]], current: dict[str, IndexEntry]
+) -> tuple[dict[str, IndexEntry], set[str]]:
+    """
+    Nakłada nowe wpisy (np. z mapowania bieżącego przebiegu) na poprzedni indeks, zachowując status
+    (np. kwarantannę) i flagę etykiety obrazów, które nie zmieniły zbioru. Scalanie jest addytywne:
+    current może być tylko częścią datasetu (np. nowe archiwa w trybie watch), a obrazy obecne
+    wyłącznie w previous pozostają bez zmian. Aby usunąć obrazy z indeksu, należy usunąć
+    dataset_index.tsv - zostanie odbudowany ze struktury katalogów (scan_split_dirs).
+    Zwraca (wpisy, zbiór zmienionych obrazów).
+    """
+    merged = dict(previous or {})
+    changed = set()
+    for image, (split, has_label, status) in current.items():
+        old = merged.get(image)
+        if old is not None:
+            if old[0] == split:
+                has_label = has_label or old[1]
+            if old[2] != STATUS_OK:
+                status = old[2]
+        entry = (split, has_label, status)
+        if old != entry:
+            merged[image] = entry
+            changed.add(image)
+    return merged, changed
+
+
+def _list_line(split: str, image: str) -> str:
+    return f"images/{split}/{image}"
+
+
+def _is_listed(
+    entry: IndexEntry, split: str, exclude_unlabeled: bool, exclude_quarantined: bool
+) -> bool:
+    entry_split, has_label, status = entry
+    if entry_split != split:
+        return False
+    if exclude_unlabeled and not has_label:
+        return False
+    if exclude_quarantined and status == STATUS_QUARANTINED:
+        return False
+    return True
+
+
+def _write_lines_atomic(path: str, lines: Iterable[str]) -> int:
+    tmp_path = path + ".tmp"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def _merge_sorted_list_file(
+    path: str, changed_lines: set[str], added_lines: list[str]
+) -> Iterable[str]:
+    """Strumieniowo łączy istniejący posortowany plik listy ze zmianami. Rzuca ValueError, gdy plik nie jest posortowany."""
+
+    def existing_lines():
+        previous = None
+        with open(path, "r", encoding="utf-8") as f:
+            for raw in f:
+                line = raw.rstrip("\n")
+                if not line:
+                    continue
+                if previous is not None and line < previous:
+                    raise ValueError(f"plik '{path}' nie jest posortowany")
+                previous = line
+                if line not in changed_lines:
+                    yield line
+
+    return heapq.merge(existing_lines(), added_lines)
+
+
+def _read_pending_changes(dataset_dir: str) -> set[str]:
+    try:
+        with open(
+            os.path.join(dataset_dir, PENDING_FILENAME), "r", encoding="utf-8"
+        ) as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def write_split_lists(
+    dataset_dir: str,
+    entries: dict[str, IndexEntry],
+    exclude_unlabeled: bool = False,
+    exclude_quarantined: bool = True,
+    rebuild: bool = False,
+) -> dict[str, int]:
+    """
+    Zapisuje train.txt i val.txt z indeksu (posortowane, jeden strumieniowy zapis na plik).
+    Jeśli pliki list istnieją i opcje filtrowania się nie zmieniły, są aktualizowane przyrostowo
+    na podstawie dziennika zmian: istniejący plik jest strumieniowo łączony z posortowanymi
+    zmianami, a przy braku zmian pozostaje nietknięty.
+    Zwraca {zbiór: liczba_wierszy lub -1, jeśli plik pozostawiono bez zmian}.
+    """
+    options = f"exclude_unlabeled={int(exclude_unlabeled)} exclude_quarantined={int(exclude_quarantined)}"
+    state_path = os.path.join(dataset_dir, LISTS_STATE_FILENAME)
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            previous_options = f.read().strip()
+    except FileNotFoundError:
+        previous_options = None
+    incremental = not rebuild and previous_options == options
+    changed_images = _read_pending_changes(dataset_dir) if incremental else set()
+
+    written = {}
+    for split, list_filename in SPLIT_LIST_FILES.items():
+        list_path = os.path.join(dataset_dir, list_filename)
+        if incremental and os.path.isfile(list_path):
+            if not changed_images:
+                written[split] = -1
+                continue
+            changed_lines = {_list_line(split, image) for image in changed_images}
+            added_lines = sorted(
+                _list_line(split, image)
+                for image in changed_images
+                if image in entries
+                and _is_listed(
+                    entries[image], split, exclude_unlabeled, exclude_quarantined
+                )
+            )
+            try:
+                written[split] = _write_lines_atomic(
+                    list_path,
+                    _merge_sorted_list_file(list_path, changed_lines, added_lines),
+                )
+                continue
+            except ValueError as e:
+                print(
+                    f"  Ostrzeżenie: {e} - pełna regeneracja {list_filename}.",
+                    file=sys.stderr,
+                )
+        written[split] = _write_lines_atomic(
+            list_path,
+            (
+                _list_line(split, image)
+                for image in sorted(entries)
+                if _is_listed(
+                    entries[image], split, exclude_unlabeled, exclude_quarantined
+                )
+            ),
+        )
+
+    with open(state_path, "w", encoding="utf-8") as f:
+        f.write(options + "\n")
+    try:
+        os.remove(os.path.join(dataset_dir, PENDING_FILENAME))
+    except FileNotFoundError:
+        pass
+    return written
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest datasetu do szybkiej weryfikacji kopii (np. na węzłach GPU).
+
+dataset_manifest.tsv zawiera wiersz 'ścieżka<TAB>rozmiar<TAB>sha256<TAB>mtime_ns' dla każdego
+obrazu, etykiety i pliku konfiguracyjnego (dataset.yaml, train.txt, val.txt), posortowany po
+ścieżce. mtime_ns służy tylko do przyrostowego odświeżania manifestu (plik o niezmienionym
+rozmiarze i czasie modyfikacji nie jest haszowany ponownie) i nie jest sprawdzany w kopii.
+Jeśli ustawiono zmienną DATASET_MANIFEST_KEY, obok zapisywany jest podpis HMAC-SHA256 całego
+manifestu (dataset_manifest.tsv.sig), więc zmodyfikowanego manifestu nie da się dopasować do
+zmienionych plików bez klucza.
+"""
+
+import os
+import sys
+import hmac
+import hashlib
+from typing import Iterator, NamedTuple, Optional
+
+from parallel import ordered_thread_map
+
+MANIFEST_FILENAME = "dataset_manifest.tsv"
+SIGNATURE_SUFFIX = ".sig"
+MANIFEST_KEY_ENV = "DATASET_MANIFEST_KEY"
+CONFIG_FILES = ("dataset.yaml", "train.txt", "val.txt")
+DATA_DIRS = ("images", "labels")
+DEFAULT_HASH_WORKERS = 8
+HASH_CHUNK_SIZE = 1024 * 1024
+# Wyniki check_manifest_signature
+SIGNATURE_VALID = "valid"
+SIGNATURE_INVALID = "invalid"
+SIGNATURE_MISSING = "missing"  # Brak pliku .sig
+SIGNATURE_NO_KEY = "no_key"  # Jest .sig, ale brak klucza do sprawdzenia
+
+
+class ManifestEntry(NamedTuple):
+    path: str  # Względem folderu datasetu, z '/'
+    size: int
+    sha256: str
+    mtime_ns: int
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def iter_dataset_files(dataset_dir: str) -> Iterator[tuple[str, os.stat_result]]:
+    """Zwraca (ścieżka względna, stat) dla plików objętych manifestem (images/, labels/, konfiguracja)."""
+    for name in CONFIG_FILES:
+        try:
+            yield name, os.stat(os.path.join(dataset_dir, name))
+        except FileNotFoundError:
+            continue
+    stack = list(reversed(DATA_DIRS))
+    while stack:
+        relative_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(dataset_dir, relative_dir)) as it:
+                for entry in it:
+                    relative_path = f"{relative_dir}/{entry.name}"
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(relative_path)
+                    elif not entry.name.endswith(".tmp"):
+                        yield relative_path, entry.stat()
+        except FileNotFoundError:
+            continue
+
+
+def manifest_key(load_env: bool = True) -> Optional[bytes]:
+    """
+    Klucz podpisu ze zmiennej środowiskowej lub (load_env) pliku .env; None, jeśli nie ustawiono.
+    load_env=False pozwala nie ładować dotenv tam, gdzie podpis nie jest potrzebny (--config-only).
+    """
+    key = os.getenv(MANIFEST_KEY_ENV)
+    if key is None and load_env:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        key = os.getenv(MANIFEST_KEY_ENV)
+    return key.encode("utf-8") if key else None
+
+
+def sign_manifest(data: bytes, key: bytes) -> str:
+    return hmac.new(key, data, hashlib.sha256).hexdigest()
+
+
+def read_manifest(dataset_dir: str) -> Optional[dict[str, ManifestEntry]]:
+    """Wczytuje manifest ({ścieżka: wpis}) lub zwraca None, jeśli go brak."""
+    manifest_path = os.path.join(dataset_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            entries = {}
+            for line in f:
+                path, size, sha256, mtime_ns = line.rstrip("\n").split("\t")
+                entries[path] = ManifestEntry(path, int(size), sha256, int(mtime_ns))
+            return entries
+    except FileNotFoundError:
+        return None
+
+
+def check_manifest_signature(dataset_dir: str) -> str:
+    """Zwraca SIGNATURE_VALID, SIGNATURE_INVALID, SIGNATURE_MISSING lub SIGNATURE_NO_KEY."""
+    manifest_path = os.path.join(dataset_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path + SIGNATURE_SUFFIX, "r", encoding="utf-8") as f:
+            signature = f.read().strip()
+    except FileNotFoundError:
+        return SIGNATURE_MISSING
+    key = manifest_key()
+    if key is None:
+        return SIGNATURE_NO_KEY
+    with open(manifest_path, "rb") as f:
+        if hmac.compare_digest(sign_manifest(f.read(), key), signature):
+            return SIGNATURE_VALID
+        return SIGNATURE_INVALID
+
+
+def write_dataset_manifest(
+    dataset_dir: str, workers: int = DEFAULT_HASH_WORKERS
+) -> bool:
+    """
+    Zapisuje (atomowo) manifest i podpis. Haszuje tylko pliki nowe lub zmienione od poprzedniego
+    manifestu, w workers wątkach. Zwraca status powodzenia.
+    """
+    print(f"\n--- Tworzenie manifestu datasetu ({MANIFEST_FILENAME}) ---")
+    manifest_path = os.path.join(dataset_dir, MANIFEST_FILENAME)
+    try:
+        previous = read_manifest(dataset_dir) or {}
+    except (OSError, ValueError) as e:
+        print(
+            f"Ostrzeżenie: Nie można odczytać poprzedniego manifestu ({e}). Wszystkie pliki zostaną przehaszowane.",
+            file=sys.stderr,
+        )
+        previous = {}
+
+    entries = []
+    to_hash = []
+    for relative_path, stat in iter_dataset_files(dataset_dir):
+        old = previous.get(relative_path)
+        if old and old.size == stat.st_size and old.mtime_ns == stat.st_mtime_ns:
+            entries.append(old)
+        else:
+            to_hash.append((relative_path, stat))
+
+    def hash_one(item: tuple[str, os.stat_result]) -> Optional[ManifestEntry]:
+        relative_path, stat = item
+        try:
+            sha256 = file_sha256(os.path.join(dataset_dir, relative_path))
+        except OSError as e:
+            print(f"  Błąd haszowania '{relative_path}': {e}", file=sys.stderr)
+            return None
+        return ManifestEntry(relative_path, stat.st_size, sha256, stat.st_mtime_ns)
+
+    hashed_bytes = 0
+    failed = 0
+    for entry in ordered_thread_map(hash_one, to_hash, workers):
+        if entry is None:
+            failed += 1
+            continue
+        entries.append(entry)
+        hashed_bytes += entry.size
+    if failed:
+        print(
+            f"Błąd: Nie udało się przehaszować {failed} plików. Manifest nie został zapisany.",
+            file=sys.stderr,
+        )
+        return False
+
+    entries.sort()
+    data = "".join(
+        f"{entry.path}\t{entry.size}\t{entry.sha256}\t{entry.mtime_ns}\n"
+        for entry in entries
+    ).encode("utf-8")
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, manifest_path)
+
+    signature_path = manifest_path + SIGNATURE_SUFFIX
+    # .env jest czytany tylko, jeśli dataset był już podpisany (podpis nie może zostać nieaktualny)
+    key = manifest_key(load_env=os.path.exists(signature_path))
+    if key is not None:
+        with open(signature_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(sign_manifest(data, key) + "\n")
+        os.replace(signature_path + ".tmp", signature_path)
+        signature_text = f"podpis: {signature_path}"
+    else:
+        # Stary podpis nie pasowałby do nowego manifestu
+        if os.path.exists(signature_path):
+            os.remove(signature_path)
+        signature_text = f"bez podpisu (brak zmiennej {MANIFEST_KEY_ENV})"
+    print(
+        f"Zapisano manifest {len(entries)} plików do {manifest_path} "
+        f"(przehaszowano {len(to_hash)}, {hashed_bytes / (1024 * 1024):.1f} MB; {signature_text})"
+    )
+    return True
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Sortowanie zewnętrzne z usuwaniem duplikatów dla bardzo dużych list nazw obrazów.
+
+Nazwy są zbierane w buforze o ograniczonym rozmiarze; po przekroczeniu budżetu pamięci bufor
+jest sortowany i zapisywany na dysk jako posortowany przebieg (run). Na końcu przebiegi są
+scalane (heapq.merge) w jeden posortowany plik bez duplikatów, więc zużycie pamięci nie zależy
+od liczby nazw. Wynik jest identyczny z sorted(set(nazwy)).
+"""
+
+import os
+import sys
+import heapq
+import shutil
+import tempfile
+from typing import Iterable, Iterator, Optional
+
+DEFAULT_MEMORY_BUDGET_MB = 256
+# Maksymalna liczba przebiegów scalanych naraz (limit otwartych plików)
+MAX_MERGE_FAN_IN = 64
+_LIST_SLOT_BYTES = 8  # Wskaźnik w liście bufora
+
+
+def _read_run(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def _write_unique(lines: Iterable[str], path: str) -> int:
+    """Zapisuje posortowane linie do pliku, pomijając kolejne powtórzenia. Zwraca liczbę zapisanych."""
+    count = 0
+    previous = None
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            if line == previous:
+                continue
+            f.write(line + "\n")
+            previous = line
+            count += 1
+    return count
+
+
+class ExternalSortWriter:
+    """Zbiera nazwy (add/extend) i zapisuje je posortowane, bez duplikatów (finish) w stałym budżecie pamięci."""
+
+    def __init__(
+        self,
+        memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+        tmp_dir: Optional[str] = None,
+    ):
+        self.memory_budget_bytes = max(1, int(memory_budget_mb * 1024 * 1024))
+        self.work_dir = tempfile.mkdtemp(prefix="external_sort_", dir=tmp_dir)
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.runs = []
+        self.merge_count = 0
+        self.added = 0
+
+    def add(self, line: str):
+        self.buffer.append(line)
+        self.buffer_bytes += sys.getsizeof(line) + _LIST_SLOT_BYTES
+        self.added += 1
+        if self.buffer_bytes >= self.memory_budget_bytes:
+            self._spill()
+
+    def extend(self, lines: Iterable[str]):
+        for line in lines:
+            self.add(line)
+
+    def _new_run_path(self) -> str:
+        return os.path.join(self.work_dir, f"run{len(self.runs):06d}.txt")
+
+    def _spill(self):
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        run_path = self._new_run_path()
+        _write_unique(self.buffer, run_path)
+        self.runs.append(run_path)
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    def _merge_runs(self, run_paths: list[str], output_path: str) -> int:
+        return _write_unique(
+            heapq.merge(*(_read_run(path) for path in run_paths)), output_path
+        )
+
+    def finish(self, output_path: str) -> int:
+        """Scala przebiegi do output_path (atomowo). Zwraca liczbę unikalnych nazw."""
+        try:
+            if not self.runs:
+                self.buffer.sort()
+                tmp_path = output_path + ".tmp"
+                count = _write_unique(self.buffer, tmp_path)
+                os.replace(tmp_path, output_path)
+                return count
+            self._spill()
+            # Scalanie wieloprzebiegowe, gdy przebiegów jest więcej niż MAX_MERGE_FAN_IN
+            while len(self.runs) > MAX_MERGE_FAN_IN:
+                merged_runs = []
+                for start in range(0, len(self.runs), MAX_MERGE_FAN_IN):
+                    batch = self.runs[start : start + MAX_MERGE_FAN_IN]
+                    merged_path = os.path.join(
+                        self.work_dir, f"merge{self.merge_count:06d}.txt"
+                    )
+                    self.merge_count += 1
+                    self._merge_runs(batch, merged_path)
+                    for path in batch:
+                        os.remove(path)
+                    merged_runs.append(merged_path)
+                self.runs = merged_runs
+            tmp_path = output_path + ".tmp"
+            count = self._merge_runs(self.runs, tmp_path)
+            os.replace(tmp_path, output_path)
+            return count
+        finally:
+            self.close()
+
+    def close(self):
+        self.buffer = []
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -1,48 +1,63 @@
 import os
-from typing import Optional
+from typing import Callable, Iterator, Optional, TextIO, Union, BinaryIO
 import zipfile
 import xml.etree.ElementTree as ET
 import argparse
 import sys
 import shutil
-from azure.storage.blob import BlobServiceClient
-from dotenv import load_dotenv
+import tempfile
 import time  # Dodane do tworzenia unikalnych nazw folderów
+from image_selection import (
+    SelectionRule,
+    compile_rules,
+    load_rules,
+    match_rules,
+    rules_cache_stage,
+    tag_labels,
+    WeightedSampler,
+)
+from external_sort import ExternalSortWriter
+from azure_clients import add_transfer_arguments, configure_transfer
+from storage_backends import (
+    StorageBackend,
+    BlobNotFoundError,
+    add_source_arguments,
+    create_storage_backend,
+)
+from annotation_cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CACHE_MAX_MB,
+    get_blob_etag,
+    CachedRecordsWriter,
+    iter_cached_records,
+)
 
 # --- Funkcje pomocnicze (download, unzip, find_xml) - pozostają prawie bez zmian ---
 
 
 def download_blob_sync(
-    connect_str: str, container_name: str, blob_name: str, download_file_path: str
+    storage: StorageBackend,
+    container_name: str,
+    blob_name: str,
+    download_file_path: str,
 ):
-    """Pobiera synchronicznie plik blob z Azure Storage."""
-    if not connect_str:
-        print("Błąd krytyczny: Brak ciągu połączenia Azure Storage.", file=sys.stderr)
-        return False
+    """Pobiera synchronicznie plik blob ze źródła (Azure lub lokalny mirror)."""
     try:
-        print(f"  Łączenie z Azure Storage dla bloba: {blob_name}...")
-        blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name, blob=blob_name
+        print(
+            f"  Pobieranie pliku blob '{blob_name}' ({storage.describe(container_name)}) do '{download_file_path}'..."
         )
-
-        # Sprawdź czy blob istnieje przed próbą pobrania
-        if not blob_client.exists():
-            print(
-                f"  Błąd: Blob '{blob_name}' nie istnieje w kontenerze '{container_name}'.",
-                file=sys.stderr,
-            )
-            return False
-
-        print(f"  Pobieranie pliku blob '{blob_name}' do '{download_file_path}'...")
         os.makedirs(
             os.path.dirname(download_file_path), exist_ok=True
         )  # Utwórz folder downloads, jeśli trzeba
-        with open(download_file_path, "wb") as download_file:
-            download_stream = blob_client.download_blob()
-            download_file.write(download_stream.readall())
+        storage.place_file(container_name, blob_name, download_file_path)
         print(f"  Pobieranie '{blob_name}' zakończone pomyślnie.")
         return True
+    except BlobNotFoundError:
+        print(
+            f"  Błąd: Blob '{blob_name}' nie istnieje w kontenerze '{container_name}'.",
+            file=sys.stderr,
+        )
+        return False
     except ValueError as e:
         print(
             f"  Błąd: Problem z ciągiem połączenia lub nazwą kontenera/bloba '{blob_name}': {e}",
@@ -97,47 +112,108 @@ def find_xml_file(directory: str) -> Optional[str]:
 
 
 # --- Zmodyfikowana funkcja przetwarzania XML ---
-def extract_training_images_from_xml(xml_file_path: str) -> Optional[list[str]]:
+def count_box_labels(image_elem: ET.Element) -> dict[str, int]:
+    """Zlicza boxy elementu <image> według etykiety."""
+    label_counts = {}
+    for box_elem in image_elem.findall("box"):
+        label = box_elem.get("label")
+        if label:
+            label_counts[label] = label_counts.get(label, 0) + 1
+    return label_counts
+
+
+def format_label_stats_line(image_name: str, label_counts: dict[str, int]) -> str:
+    """Tworzy linię statystyk klas obrazu: 'nazwa<TAB>etykieta=liczba<TAB>...' (liczba boxów na etykietę)."""
+    fields = [image_name] + [
+        f"{label}={count}" for label, count in label_counts.items()
+    ]
+    return "\t".join(fields) + "\n"
+
+
+def iter_training_images_from_xml(
+    xml_source: Union[str, BinaryIO],
+    rules: Optional[list[SelectionRule]] = None,
+    rule_errors: Optional[list[int]] = None,
+) -> Iterator[str]:
+    """
+    Strumieniowo (iterparse) zwraca nazwy obrazów do treningu z pliku XML lub strumienia.
+    Obraz jest wybierany, jeśli spełnia którąkolwiek z reguł (domyślnie: BBoxy lub tag 'brak reklam').
+    Przetworzone elementy <image> są zwalniane, więc pamięć nie rośnie z rozmiarem pliku.
+    Błędy obliczenia reguł są liczone w rule_errors (patrz match_rules).
+    """
+    rules = rules or compile_rules(None)
+    for _, elem in ET.iterparse(xml_source, events=("end",)):
+        if elem.tag != "image":
+            continue
+        image_name = elem.get("name")
+        if image_name and match_rules(rules, elem, rule_errors):
+            yield image_name
+        elem.clear()
+
+
+def extract_training_images_from_xml(
+    xml_file_path: str,
+    on_image: Callable[[str, list[int]], None],
+    label_stats_file: Optional[TextIO] = None,
+    image_records=None,
+    rules: Optional[list[SelectionRule]] = None,
+    rule_errors: Optional[list[int]] = None,
+) -> Optional[int]:
     """
-    Przetwarza plik XML, znajduje obrazy do treningu (mające BBoxy LUB tag 'brak reklam')
-    i ZWRACA listę ich nazw. Zwraca None w przypadku błędu.
+    Strumieniowo przetwarza plik XML i dla każdego obrazu do treningu (spełniającego którąkolwiek
+    z reguł, domyślnie: BBoxy LUB tag 'brak reklam') wywołuje on_image(nazwa, indeksy_spełnionych_reguł);
+    nazwy nie są gromadzone w pamięci. Zwraca liczbę wybranych obrazów lub None w przypadku błędu
+    (obrazy przekazane do on_image przed błędem nie są wycofywane - main odkłada je
+    w StagedSelection i dodaje do wyniku dopiero po bezbłędnym przetworzeniu).
+    Jeśli podano label_stats_file, zapisuje do niego histogram klas (z boxów) każdego wybranego obrazu.
+    Jeśli podano image_records (lista lub CachedRecordsWriter), dopisuje do niej [nazwa, liczba_boxów,
+    liczba_tagów, histogram_klas, indeksy_spełnionych_reguł] każdego wybranego obrazu (wpis cache).
+    Błąd obliczenia reguły dotyczy tylko tej reguły i obrazu (liczony w rule_errors, patrz match_rules).
     """
-    images_to_keep = []
+    rules = rules or compile_rules(None)
+    kept_count = 0
     try:
         print(f"  Przetwarzanie pliku XML: {xml_file_path}...")
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
-
-        image_elements = root.findall(".//image")
-        # print(f"  Znaleziono {len(image_elements)} elementów <image> w pliku XML.") # Mniej gadatliwy output
-
-        for i, image_elem in enumerate(image_elements):
+        image_number = 0
+        for _, image_elem in ET.iterparse(xml_file_path, events=("end",)):
+            if image_elem.tag != "image":
+                continue
+            image_number += 1
             image_name = image_elem.get("name")
             if not image_name:
                 print(
-                    f"  Ostrzeżenie: Element <image> nr {i+1} w pliku {os.path.basename(xml_file_path)} nie ma atrybutu 'name'. Pomijanie.",
+                    f"  Ostrzeżenie: Element <image> nr {image_number} w pliku {os.path.basename(xml_file_path)} nie ma atrybutu 'name'. Pomijanie.",
                     file=sys.stderr,
                 )
+                image_elem.clear()
                 continue
 
-            has_bboxes = image_elem.find("box") is not None
-            has_brak_reklam_tag = any(
-                tag_elem.get("label") == "brak reklam"
-                for tag_elem in image_elem.findall("tag")
-            )
-
-            if has_bboxes or has_brak_reklam_tag:
-                images_to_keep.append(image_name)
-                # Opcjonalnie: Można dodać cichsze logowanie znalezionych plików
-                # reason = []
-                # if has_bboxes: reason.append("bbox")
-                # if has_brak_reklam_tag: reason.append("brak_reklam")
-                # print(f"    + {image_name} ({','.join(reason)})")
+            matched_rules = match_rules(rules, image_elem, rule_errors)
+            if matched_rules:
+                on_image(image_name, matched_rules)
+                kept_count += 1
+                if label_stats_file is not None or image_records is not None:
+                    label_counts = count_box_labels(image_elem)
+                    if label_stats_file is not None:
+                        label_stats_file.write(
+                            format_label_stats_line(image_name, label_counts)
+                        )
+                    if image_records is not None:
+                        image_records.append(
+                            [
+                                image_name,
+                                sum(label_counts.values()),
+                                len(tag_labels(image_elem)),
+                                label_counts,
+                                matched_rules,
+                            ]
+                        )
+            image_elem.clear()
 
         print(
-            f"  Zakończono przetwarzanie XML: {os.path.basename(xml_file_path)}. Znaleziono {len(images_to_keep)} pasujących obrazów."
+            f"  Zakończono przetwarzanie XML: {os.path.basename(xml_file_path)}. Znaleziono {kept_count} pasujących obrazów."
         )
-        return images_to_keep
+        return kept_count
 
     except ET.ParseError as e:
         print(
@@ -159,12 +235,73 @@ def extract_training_images_from_xml(xml_file_path: str) -> Optional[list[str]]:
         return None
 
 
+class StagedSelection:
+    """
+    Obrazy wybrane z jednego archiwum, odkładane do plików tymczasowych (nazwa z indeksami reguł
+    oraz linie statystyk klas) zamiast list w pamięci. Do wyniku trafiają dopiero w commit, po
+    bezbłędnym przetworzeniu archiwum - archiwum przerwane w połowie nie zostawia części obrazów.
+    """
+
+    def __init__(self, tmp_dir: str, with_label_stats: bool):
+        self.names_file = tempfile.TemporaryFile(
+            "w+", encoding="utf-8", newline="\n", dir=tmp_dir
+        )
+        self.label_stats_file = (
+            tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n", dir=tmp_dir)
+            if with_label_stats
+            else None
+        )
+        self.count = 0
+
+    def add(self, image_name: str, matched_rules: list[int]):
+        self.names_file.write(
+            ",".join(map(str, matched_rules)) + "\t" + image_name + "\n"
+        )
+        self.count += 1
+
+    def clear(self):
+        """Odrzuca obrazy odłożone do tej pory (np. po błędzie odczytu cache)."""
+        for f in (self.names_file, self.label_stats_file):
+            if f is not None:
+                f.seek(0)
+                f.truncate()
+        self.count = 0
+
+    def commit(
+        self,
+        on_image: Callable[[str, list[int]], None],
+        label_stats_file: Optional[TextIO] = None,
+    ):
+        """Przekazuje odłożone obrazy do on_image i dopisuje ich statystyki do label_stats_file."""
+        self.names_file.seek(0)
+        for line in self.names_file:
+            rules_field, _, image_name = line.rstrip("\n").partition("\t")
+            on_image(image_name, [int(index) for index in rules_field.split(",")])
+        if label_stats_file is not None and self.label_stats_file is not None:
+            self.label_stats_file.seek(0)
+            shutil.copyfileobj(self.label_stats_file, label_stats_file)
+        self.clear()
+
+    def close(self):
+        for f in (self.names_file, self.label_stats_file):
+            if f is not None:
+                f.close()
+
+
+def write_rule_stats(
+    rule_stats_path: str, rules: list[SelectionRule], rule_counts: list[int]
+):
+    """Zapisuje liczbę obrazów spełniających każdą regułę: 'nazwa<TAB>waga<TAB>liczba<TAB>wyrażenie'."""
+    with open(rule_stats_path, "w", encoding="utf-8") as f:
+        f.write("# rule\tweight\tmatched\texpression\n")
+        for rule, count in zip(rules, rule_counts):
+            f.write(f"{rule.name}\t{rule.weight:g}\t{count}\t{rule.expression}\n")
+
+
 # --- Główna funkcja ---
 def main():
-    load_dotenv()
-
     parser = argparse.ArgumentParser(
-        description="Pobiera WIELE plików ZIP z Azure, rozpakowuje je i znajduje obrazy do uczenia (mające BBoxy lub tag 'brak reklam'), zapisując wyniki do JEDNEGO pliku. Używa .env dla danych Azure."
+        description="Pobiera WIELE plików ZIP z Azure, rozpakowuje je i znajduje obrazy do uczenia (domyślnie mające BBoxy lub tag 'brak reklam', albo spełniające reguły --select/--rules-file), zapisując wyniki do JEDNEGO pliku. Używa .env dla danych Azure."
     )
     parser.add_argument(
         "--connect-str",
@@ -185,8 +322,100 @@ def main():
         default="to_train_combined.txt",
         help="Nazwa pliku wyjściowego z połączoną listą obrazów do uczenia (domyślnie: to_train_combined.txt).",
     )
+    parser.add_argument(
+        "--label-stats-file",
+        help="(Opcjonalnie) Plik TSV z histogramem klas (liczbą boxów na etykietę) dla każdego wybranego obrazu. Używany przez prepare_yolo_dataset.py --split-mode stratified.",
+    )
+
+    parser.add_argument(
+        "--select",
+        action="append",
+        metavar="[NAZWA=]WYRAŻENIE",
+        help="Reguła wyboru obrazów (powtarzalna; obraz jest wybierany, jeśli spełnia którąkolwiek), np. 'duze=boxes(\"samochód\", min_area=400, occluded=False) > 0'. Domyślnie: BBoxy lub tag 'brak reklam'. Składnia w image_selection.py.",
+    )
+    parser.add_argument(
+        "--rules-file",
+        help="Plik TSV z regułami: 'nazwa<TAB>[waga<TAB>]wyrażenie' (łączony z --select).",
+    )
+    parser.add_argument(
+        "--rule-stats-file",
+        help="(Opcjonalnie) Plik TSV z liczbą obrazów spełniających każdą regułę.",
+    )
+    parser.add_argument(
+        "--sample-output",
+        help="(Opcjonalnie) Plik z ważoną próbką wybranych obrazów (waga = największa waga spełnionej reguły), losowaną w tym samym przebiegu.",
+    )
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        default=1000,
+        help="Liczność próbki dla --sample-output (domyślnie: 1000).",
+    )
+    parser.add_argument(
+        "--sample-seed",
+        type=int,
+        default=42,
+        help="Ziarno losowania próbki (domyślnie: 42).",
+    )
+
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        help="Włącza sortowanie zewnętrzne listy obrazów: nazwy ponad ten budżet pamięci (MB) są zapisywane na dysk jako posortowane przebiegi i scalane na końcu. Dla bardzo dużych list (dziesiątki milionów ścieżek).",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Folder lokalnego cache sparsowanych archiwów (klucz: kontener, blob, ETag; domyślnie: {DEFAULT_CACHE_DIR}).",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_CACHE_MAX_MB,
+        help=f"Maksymalny rozmiar cache w MB; najdawniej używane wpisy są usuwane (domyślnie: {DEFAULT_CACHE_MAX_MB}).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Wyłącza cache - każde archiwum jest pobierane i parsowane od nowa.",
+    )
+
+    add_source_arguments(parser)
+    add_transfer_arguments(parser, default_workers=None)
 
     args = parser.parse_args()
+    try:
+        configure_transfer(args)
+    except ValueError as e:
+        print(f"Błąd: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.memory_budget_mb is not None and args.memory_budget_mb <= 0:
+        print("Błąd: --memory-budget-mb musi być dodatnie.", file=sys.stderr)
+        sys.exit(1)
+    try:
+        rules = load_rules(args.select, args.rules_file)
+    except (ValueError, OSError) as e:
+        print(f"Błąd: Niepoprawne reguły wyboru: {e}", file=sys.stderr)
+        sys.exit(1)
+    cache_stage = rules_cache_stage(rules)
+    rule_counts = [0] * len(rules)
+    rule_errors = [0] * len(rules)
+    sampler = (
+        WeightedSampler(args.sample_size, args.sample_seed)
+        if args.sample_output
+        else None
+    )
+    print("Reguły wyboru obrazów:")
+    for rule in rules:
+        print(f"  {rule.name} (waga {rule.weight:g}): {rule.expression}")
+
+    # Import leniwy: --help i błędy argumentów nie ładują zależności
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    cache_dir = None if args.no_cache else args.cache_dir
 
     connect_str = (
         args.connect_str
@@ -194,15 +423,12 @@ def main():
         else os.getenv("AZURE_STORAGE_CONNECTION_STRING")
     )
 
-    if not connect_str:
-        print(
-            "Błąd: Ciąg połączenia Azure Storage nie został podany ani jako argument --connect-str, ani w pliku .env jako AZURE_STORAGE_CONNECTION_STRING.",
-            file=sys.stderr,
-        )
-        sys.exit(1)
+    storage = create_storage_backend(args, connect_str)
 
-    # Użyjemy zbioru (set) do przechowywania nazw obrazów, aby automatycznie obsłużyć duplikaty
+    # Użyjemy zbioru (set) do przechowywania nazw obrazów, aby automatycznie obsłużyć duplikaty.
+    # Z --memory-budget-mb nazwy trafiają do sortowania zewnętrznego (stały limit pamięci).
     all_images_to_keep_set = set()
+    external_sorter = None
     total_processed_xml = 0
     total_errors = 0
 
@@ -216,61 +442,160 @@ def main():
     os.makedirs(extract_base_dir, exist_ok=True)
     print(f"Używanie folderu tymczasowego: {temp_base_dir}")
 
+    def keep_image(image_name: str, matched_rules: list[int]):
+        """Zlicza reguły, losuje próbkę i dodaje nazwę do wyniku bez list pośrednich."""
+        for rule_index in matched_rules:
+            rule_counts[rule_index] += 1
+        if sampler is not None:
+            sampler.add(
+                image_name,
+                max(rules[rule_index].weight for rule_index in matched_rules),
+            )
+        if external_sorter is not None:
+            external_sorter.add(image_name)
+        else:
+            all_images_to_keep_set.add(image_name)
+
+    label_stats_file = None
     try:
+        if args.memory_budget_mb:
+            external_sorter = ExternalSortWriter(
+                args.memory_budget_mb, tmp_dir=temp_base_dir
+            )
+            print(
+                f"Sortowanie zewnętrzne listy obrazów (budżet pamięci: {args.memory_budget_mb} MB)."
+            )
+        if args.label_stats_file:
+            label_stats_file = open(args.label_stats_file, "w", encoding="utf-8")
+            print(f"Statystyki klas będą zapisywane do: {args.label_stats_file}")
+
         # Pętla przetwarzająca każdy podany plik blob
         for blob_name in args.blob_names:
             print(f"\n--- Rozpoczynanie przetwarzania bloba: {blob_name} ---")
             error_occurred_for_blob = False
 
-            # Unikalna nazwa dla pobranego pliku i folderu ekstrakcji
-            safe_blob_name = os.path.basename(blob_name)
-            download_path = os.path.join(download_dir, safe_blob_name)
-            # Tworzymy unikalny folder dla każdego ZIPa, np. na podstawie nazwy pliku
-            extract_dir_name = safe_blob_name.replace(".zip", "")
-            extract_path = os.path.join(extract_base_dir, extract_dir_name)
-
-            # Krok 1: Pobierz plik z Azure
-            if not download_blob_sync(
-                connect_str, args.container_name, blob_name, download_path
-            ):
-                print(f"### Błąd pobierania {blob_name}. Pomijanie tego bloba. ###")
-                total_errors += 1
-                continue  # Przejdź do następnego bloba
-
-            # Krok 2: Rozpakuj plik ZIP
-            if not unzip_file(download_path, extract_path):
-                print(f"### Błąd rozpakowywania {blob_name}. Pomijanie tego bloba. ###")
-                total_errors += 1
-                continue  # Przejdź do następnego bloba
-
-            # Krok 3: Znajdź plik XML w folderze ekstrakcji *tego* ZIPa
-            xml_file = find_xml_file(extract_path)
-            if not xml_file:
-                print(
-                    f"### Ostrzeżenie: Nie znaleziono pliku XML w rozpakowanym archiwum dla {blob_name} w '{extract_path}'. Pomijanie tego bloba. ###"
-                )
-                total_errors += 1
-                continue  # Przejdź do następnego bloba
-            print(
-                f"  Znaleziono plik XML: {os.path.relpath(xml_file, temp_base_dir)}"
-            )  # Krótsza ścieżka dla logów
+            before_update_count = (
+                external_sorter.added
+                if external_sorter is not None
+                else len(all_images_to_keep_set)
+            )
 
-            # Krok 4: Przetwórz plik XML i dodaj wyniki do zbioru
-            images_from_this_xml = extract_training_images_from_xml(xml_file)
+            # Krok 0: Sprawdź cache (jedno zapytanie HEAD o ETag)
+            etag = None
+            cached = None
+            if cache_dir:
+                etag = get_blob_etag(storage, args.container_name, blob_name)
+                if etag:
+                    cached = iter_cached_records(
+                        cache_dir, cache_stage, args.container_name, blob_name, etag
+                    )
+
+            # Obrazy archiwum trafiają do wyniku dopiero po bezbłędnym przetworzeniu całości
+            staged = StagedSelection(temp_base_dir, label_stats_file is not None)
+            try:
+                images_from_this_xml = None
+                if cached is not None:
+                    header, records = cached
+                    try:
+                        xml_file = header["xml_name"]
+                        for record in records:
+                            staged.add(record[0], record[4])
+                            if staged.label_stats_file is not None:
+                                staged.label_stats_file.write(
+                                    format_label_stats_line(record[0], record[3])
+                                )
+                        images_from_this_xml = staged.count
+                    except (ValueError, LookupError, TypeError) as e:
+                        # Archiwum zostanie przetworzone od nowa, a wpis cache nadpisany
+                        print(
+                            f"  Błąd odczytu cache: {e}. Archiwum zostanie pobrane ponownie.",
+                            file=sys.stderr,
+                        )
+                        staged.clear()
+                if images_from_this_xml is None:
+                    # Unikalna nazwa dla pobranego pliku i folderu ekstrakcji
+                    safe_blob_name = os.path.basename(blob_name)
+                    download_path = os.path.join(download_dir, safe_blob_name)
+                    # Tworzymy unikalny folder dla każdego ZIPa, np. na podstawie nazwy pliku
+                    extract_dir_name = safe_blob_name.replace(".zip", "")
+                    extract_path = os.path.join(extract_base_dir, extract_dir_name)
+
+                    # Krok 1: Pobierz plik z Azure
+                    if not download_blob_sync(
+                        storage, args.container_name, blob_name, download_path
+                    ):
+                        print(
+                            f"### Błąd pobierania {blob_name}. Pomijanie tego bloba. ###"
+                        )
+                        total_errors += 1
+                        continue  # Przejdź do następnego bloba
+
+                    # Krok 2: Rozpakuj plik ZIP
+                    if not unzip_file(download_path, extract_path):
+                        print(
+                            f"### Błąd rozpakowywania {blob_name}. Pomijanie tego bloba. ###"
+                        )
+                        total_errors += 1
+                        continue  # Przejdź do następnego bloba
+
+                    # Krok 3: Znajdź plik XML w folderze ekstrakcji *tego* ZIPa
+                    xml_file = find_xml_file(extract_path)
+                    if not xml_file:
+                        print(
+                            f"### Ostrzeżenie: Nie znaleziono pliku XML w rozpakowanym archiwum dla {blob_name} w '{extract_path}'. Pomijanie tego bloba. ###"
+                        )
+                        total_errors += 1
+                        continue  # Przejdź do następnego bloba
+                    print(
+                        f"  Znaleziono plik XML: {os.path.relpath(xml_file, temp_base_dir)}"
+                    )  # Krótsza ścieżka dla logów
+
+                    # Krok 4: Przetwórz plik XML; rekordy obrazów powstają tylko dla cache
+                    # (zapisywane strumieniowo, bez listy w pamięci)
+                    records_writer = None
+                    if etag:
+                        records_writer = CachedRecordsWriter(
+                            cache_dir,
+                            cache_stage,
+                            args.container_name,
+                            blob_name,
+                            etag,
+                            {"xml_name": os.path.basename(xml_file)},
+                            args.cache_max_mb * 1024 * 1024,
+                        )
+                    images_from_this_xml = extract_training_images_from_xml(
+                        xml_file,
+                        staged.add,
+                        staged.label_stats_file,
+                        records_writer,
+                        rules,
+                        rule_errors,
+                    )
+                    if records_writer is not None:
+                        if images_from_this_xml is not None:
+                            records_writer.commit()
+                        else:
+                            records_writer.abort()
+
+                if images_from_this_xml is not None:
+                    staged.commit(keep_image, label_stats_file)
+            finally:
+                staged.close()
 
             if images_from_this_xml is not None:
-                before_update_count = len(all_images_to_keep_set)
-                all_images_to_keep_set.update(
-                    images_from_this_xml
-                )  # .update() dodaje elementy ze zwracanej listy do zbioru
-                added_count = len(all_images_to_keep_set) - before_update_count
-                print(
-                    f"  Dodano {added_count} unikalnych nazw obrazów z {os.path.basename(xml_file)}. Łącznie unikalnych: {len(all_images_to_keep_set)}"
-                )
+                if external_sorter is not None:
+                    print(
+                        f"  Dodano {images_from_this_xml} nazw obrazów z {os.path.basename(xml_file)} (duplikaty usuwane przy scalaniu). Łącznie nazw: {external_sorter.added}, przebiegów na dysku: {len(external_sorter.runs)}"
+                    )
+                else:
+                    added_count = len(all_images_to_keep_set) - before_update_count
+                    print(
+                        f"  Dodano {added_count} unikalnych nazw obrazów z {os.path.basename(xml_file)}. Łącznie unikalnych: {len(all_images_to_keep_set)}"
+                    )
                 total_processed_xml += 1
             else:
                 print(
-                    f"### Błąd przetwarzania XML dla {blob_name}. Wyniki z tego pliku nie zostaną dodane. ###"
+                    f"### Błąd przetwarzania XML dla {blob_name}. Obrazy z tego archiwum nie zostały dodane. ###"
                 )
                 total_errors += 1
                 continue  # Przejdź do następnego bloba
@@ -285,24 +610,48 @@ def main():
                 f"Wystąpiło {total_errors} błędów podczas przetwarzania niektórych blobów (szczegóły powyżej)."
             )
 
-        print(
-            f"Łącznie znaleziono {len(all_images_to_keep_set)} unikalnych obrazów do treningu."
-        )
+        if external_sorter is None:
+            print(
+                f"Łącznie znaleziono {len(all_images_to_keep_set)} unikalnych obrazów do treningu."
+            )
+        print("Liczba obrazów spełniających reguły (przed usunięciem duplikatów):")
+        for rule, count, errors in zip(rules, rule_counts, rule_errors):
+            print(
+                f"  {rule.name}: {count}"
+                + (f" (błędy obliczenia reguły: {errors})" if errors else "")
+            )
+        if args.rule_stats_file:
+            write_rule_stats(args.rule_stats_file, rules, rule_counts)
+            print(f"Zapisano statystyki reguł do: {args.rule_stats_file}")
+        if sampler is not None:
+            sample = sampler.result()
+            with open(args.sample_output, "w", encoding="utf-8") as f:
+                for name in sample:
+                    f.write(name + "\n")
+            print(
+                f"Zapisano ważoną próbkę {len(sample)} obrazów do: {args.sample_output}"
+            )
         print(f"Zapisywanie połączonej listy obrazów do pliku: {args.output_file}...")
 
-        # Konwertuj zbiór z powrotem na listę (opcjonalnie sortuj dla spójności)
-        final_image_list = sorted(list(all_images_to_keep_set))
+        if external_sorter is not None:
+            # Scalanie posortowanych przebiegów z dysku (ta sama kolejność co sorted(set(...)))
+            written_count = external_sorter.finish(args.output_file)
+        else:
+            # Konwertuj zbiór z powrotem na listę (opcjonalnie sortuj dla spójności)
+            final_image_list = sorted(list(all_images_to_keep_set))
 
-        with open(args.output_file, "w", encoding="utf-8") as f:
-            for name in final_image_list:
-                f.write(name + "\n")
+            with open(args.output_file, "w", encoding="utf-8") as f:
+                for name in final_image_list:
+                    f.write(name + "\n")
+            written_count = len(final_image_list)
 
-        print(
-            f"Zapisano {len(final_image_list)} nazw obrazów do pliku '{args.output_file}'."
-        )
+        print(f"Zapisano {written_count} nazw obrazów do pliku '{args.output_file}'.")
         print(f"\nOperacja zakończona pomyślnie.")
 
     finally:
+        if label_stats_file is not None:
+            label_stats_file.close()
+
         # Krok 5: Sprzątanie - usuń cały główny folder tymczasowy
         print("\nSprzątanie plików tymczasowych...")
         try:
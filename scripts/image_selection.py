@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+Deklaratywne reguły wyboru obrazów z adnotacji CVAT XML.
+
+Reguła to wyrażenie w składni Pythona (tylko dozwolone węzły AST), kompilowane raz
+do obiektu kodu i obliczane dla każdego elementu <image> podczas strumieniowego parsowania, np.:
+
+    n_boxes > 0 or has_tag("brak reklam")
+    boxes("samochód", min_area=400, occluded=False) >= 2
+    n_boxes == 0 and sample(0.1)
+
+Zmienne: name, width, height, n_boxes, n_tags, n_occluded.
+Funkcje: boxes(etykieta=None, min_area=0, max_area=None, occluded=None) -> liczba boxów,
+has_label(etykieta), has_tag(etykieta), max_box_area(etykieta=None), name_like(wzorzec_fnmatch),
+sample(p) -> deterministyczny wybór ułamka p obrazów (skrót nazwy, niezależny od kolejności).
+Wywołania są sprawdzane przy kompilacji (liczba argumentów i nazwy argumentów kluczowych), a błąd
+obliczenia reguły dla obrazu (np. dzielenie przez zero) dotyczy tylko tej reguły i tego obrazu.
+"""
+
+import ast
+import sys
+import heapq
+import inspect
+import hashlib
+import random
+import fnmatch
+from typing import NamedTuple, Optional
+import xml.etree.ElementTree as ET
+
+DEFAULT_SELECTION = 'n_boxes > 0 or has_tag("brak reklam")'
+DEFAULT_RULE_NAME = "domyslna"
+
+_VARIABLES = {"name", "width", "height", "n_boxes", "n_tags", "n_occluded"}
+_FUNCTIONS = {"boxes", "has_label", "has_tag", "max_box_area", "name_like", "sample"}
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.BinOp,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.Compare,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+    ast.In,
+    ast.NotIn,
+    ast.Call,
+    ast.keyword,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Tuple,
+    ast.List,
+)
+
+
+class SelectionRule(NamedTuple):
+    name: str
+    weight: float
+    expression: str
+    code: object  # Skompilowane wyrażenie (code object)
+
+
+def tag_labels(image_elem: ET.Element) -> set[str]:
+    """Etykiety tagów elementu <image> (n_tags to ich liczba - także w rekordach cache)."""
+    return {tag_elem.get("label") for tag_elem in image_elem.iter("tag")}
+
+
+class ImageFeatures:
+    """Cechy jednego elementu <image> używane przez reguły (boxy jako krotki (etykieta, pole, zasłonięty))."""
+
+    __slots__ = ("name", "width", "height", "box_list", "tags")
+
+    def __init__(self, image_elem: ET.Element):
+        self.name = image_elem.get("name") or ""
+        self.width = float(image_elem.get("width") or 0)
+        self.height = float(image_elem.get("height") or 0)
+        self.box_list = []
+        for box_elem in image_elem.iter("box"):
+            try:
+                area = (float(box_elem.get("xbr")) - float(box_elem.get("xtl"))) * (
+                    float(box_elem.get("ybr")) - float(box_elem.get("ytl"))
+                )
+            except (TypeError, ValueError):
+                area = 0.0
+            self.box_list.append(
+                (box_elem.get("label"), area, box_elem.get("occluded") == "1")
+            )
+        self.tags = tag_labels(image_elem)
+
+    @property
+    def n_boxes(self) -> int:
+        return len(self.box_list)
+
+    @property
+    def n_tags(self) -> int:
+        return len(self.tags)
+
+    @property
+    def n_occluded(self) -> int:
+        return sum(1 for box in self.box_list if box[2])
+
+
+def _label_matches(box_label: str, label) -> bool:
+    if label is None:
+        return True
+    if isinstance(label, (tuple, list)):
+        return box_label in label
+    return box_label == label
+
+
+def _boxes(image, label=None, min_area=0, max_area=None, occluded=None) -> int:
+    return sum(
+        1
+        for box_label, area, box_occluded in image.box_list
+        if _label_matches(box_label, label)
+        and area >= min_area
+        and (max_area is None or area <= max_area)
+        and (occluded is None or box_occluded == occluded)
+    )
+
+
+def _has_label(image, label) -> bool:
+    return any(_label_matches(box[0], label) for box in image.box_list)
+
+
+def _has_tag(image, label) -> bool:
+    if isinstance(label, (tuple, list)):
+        return not image.tags.isdisjoint(label)
+    return label in image.tags
+
+
+def _max_box_area(image, label=None) -> float:
+    return max(
+        (
+            area
+            for box_label, area, _ in image.box_list
+            if _label_matches(box_label, label)
+        ),
+        default=0.0,
+    )
+
+
+def _name_like(image, pattern: str) -> bool:
+    return fnmatch.fnmatchcase(image.name, pattern)
+
+
+def _sample(image, fraction: float) -> bool:
+    digest = hashlib.md5(image.name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < fraction
+
+
+_EVAL_GLOBALS = {
+    "__builtins__": {},
+    "_f_boxes": _boxes,
+    "_f_has_label": _has_label,
+    "_f_has_tag": _has_tag,
+    "_f_max_box_area": _max_box_area,
+    "_f_name_like": _name_like,
+    "_f_sample": _sample,
+}
+
+
+# Sygnatury funkcji reguł bez pierwszego parametru (obrazu) - do sprawdzenia wywołań przy kompilacji
+_SIGNATURES = {
+    name: inspect.signature(_EVAL_GLOBALS[f"_f_{name}"]).replace(
+        parameters=list(
+            inspect.signature(_EVAL_GLOBALS[f"_f_{name}"]).parameters.values()
+        )[1:]
+    )
+    for name in _FUNCTIONS
+}
+
+# Dozwolone typy stałych przekazanych jako argumenty (label może być też krotką/listą napisów)
+_PARAMETER_TYPES = {
+    "label": (str, type(None)),
+    "min_area": (int, float),
+    "max_area": (int, float, type(None)),
+    "occluded": (bool, int, type(None)),
+    "pattern": (str,),
+    "fraction": (int, float),
+}
+
+
+def _check_call(node: ast.Call, expression: str):
+    """
+    Sprawdza wywołanie funkcji reguły: liczbę argumentów, nazwy argumentów kluczowych i typy
+    argumentów podanych jako stałe. Rzuca ValueError.
+    """
+    name = node.func.id
+    if any(keyword.arg is None for keyword in node.keywords):
+        raise ValueError(
+            f"niedozwolone '**' w wywołaniu '{name}' w regule '{expression}'"
+        )
+    try:
+        bound = _SIGNATURES[name].bind(
+            *node.args, **{keyword.arg: keyword.value for keyword in node.keywords}
+        )
+    except TypeError as e:
+        raise ValueError(
+            f"błędne wywołanie {name}{_SIGNATURES[name]} w regule '{expression}': {e}"
+        ) from e
+    for parameter, value in bound.arguments.items():
+        allowed = _PARAMETER_TYPES[parameter]
+        if parameter == "label" and isinstance(value, (ast.Tuple, ast.List)):
+            constants = value.elts
+            allowed = (str,)
+        else:
+            constants = [value]
+        for constant in constants:
+            if isinstance(constant, (ast.Tuple, ast.List)) or (
+                isinstance(constant, ast.Constant)
+                and not isinstance(constant.value, allowed)
+            ):
+                raise ValueError(
+                    f"błędny typ argumentu '{parameter}' w wywołaniu {name}{_SIGNATURES[name]} w regule '{expression}'"
+                )
+
+
+class _BindToImage(ast.NodeTransformer):
+    """Zamienia zmienne na atrybuty '_img', a wywołania f(...) na _f_f(_img, ...)."""
+
+    def visit_Call(self, node: ast.Call):
+        node.args = [self.visit(arg) for arg in node.args]
+        node.keywords = [self.visit(keyword) for keyword in node.keywords]
+        node.args.insert(0, ast.Name(id="_img", ctx=ast.Load()))
+        node.func = ast.Name(id=f"_f_{node.func.id}", ctx=ast.Load())
+        return node
+
+    def visit_Name(self, node: ast.Name):
+        return ast.Attribute(
+            value=ast.Name(id="_img", ctx=ast.Load()), attr=node.id, ctx=ast.Load()
+        )
+
+
+def compile_selection(expression: str):
+    """Waliduje wyrażenie (biała lista węzłów AST, zmiennych i funkcji) i kompiluje je raz. Rzuca ValueError."""
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"błąd składni w regule '{expression}': {e.msg}") from e
+    nodes = list(ast.walk(tree))
+    callees = {id(node.func) for node in nodes if isinstance(node, ast.Call)}
+    for node in nodes:
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(
+                f"niedozwolona konstrukcja '{type(node).__name__}' w regule '{expression}'"
+            )
+        if isinstance(node, ast.Constant) and not isinstance(
+            node.value, (str, int, float, type(None))
+        ):
+            raise ValueError(
+                f"niedozwolona stała {node.value!r} w regule '{expression}'"
+            )
+        if isinstance(node, ast.Call) and (
+            not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS
+        ):
+            raise ValueError(
+                f"nieznana funkcja w regule '{expression}' (dozwolone: {', '.join(sorted(_FUNCTIONS))})"
+            )
+        if isinstance(node, ast.Call):
+            _check_call(node, expression)
+        if (
+            isinstance(node, ast.BinOp)
+            and isinstance(node.op, ast.Div)
+            and isinstance(node.right, ast.Constant)
+            and node.right.value == 0
+        ):
+            raise ValueError(f"dzielenie przez zero w regule '{expression}'")
+        if isinstance(node, ast.Name):
+            if id(node) in callees:
+                continue
+            if node.id in _FUNCTIONS:
+                raise ValueError(
+                    f"funkcja '{node.id}' musi być wywołana w regule '{expression}'"
+                )
+            if node.id not in _VARIABLES:
+                raise ValueError(
+                    f"nieznana zmienna '{node.id}' w regule '{expression}' (dozwolone: {', '.join(sorted(_VARIABLES))})"
+                )
+    tree = ast.fix_missing_locations(_BindToImage().visit(tree))
+    return compile(tree, "<reguła>", "eval")
+
+
+def parse_rule_spec(spec: str, index: int) -> tuple[str, str]:
+    """Rozdziela 'nazwa=wyrażenie' (nazwa opcjonalna) z --select. Zwraca (nazwa, wyrażenie)."""
+    name, sep, expression = spec.partition("=")
+    if sep and name.strip().isidentifier() and not expression.startswith("="):
+        return name.strip(), expression.strip()
+    return f"regula{index}", spec.strip()
+
+
+def read_rules_file(path: str) -> list[tuple[str, float, str]]:
+    """
+    Wczytuje reguły z pliku TSV: 'nazwa<TAB>wyrażenie' lub 'nazwa<TAB>waga<TAB>wyrażenie'
+    (# - komentarz). Rzuca ValueError przy błędnym formacie.
+    """
+    rules = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 2:
+                rules.append((fields[0].strip(), 1.0, fields[1]))
+            elif len(fields) == 3:
+                try:
+                    weight = float(fields[1])
+                except ValueError:
+                    raise ValueError(
+                        f"{path}:{line_number}: waga '{fields[1]}' nie jest liczbą"
+                    )
+                rules.append((fields[0].strip(), weight, fields[2]))
+            else:
+                raise ValueError(
+                    f"{path}:{line_number}: oczekiwano 'nazwa<TAB>[waga<TAB>]wyrażenie'"
+                )
+    return rules
+
+
+def compile_rules(
+    rule_specs: Optional[list[tuple[str, float, str]]],
+) -> list[SelectionRule]:
+    """Kompiluje reguły (nazwa, waga, wyrażenie); bez reguł używa domyślnej (boxy lub tag 'brak reklam')."""
+    if not rule_specs:
+        rule_specs = [(DEFAULT_RULE_NAME, 1.0, DEFAULT_SELECTION)]
+    rules = []
+    for name, weight, expression in rule_specs:
+        if weight < 0:
+            raise ValueError(f"ujemna waga reguły '{name}'")
+        rules.append(
+            SelectionRule(name, weight, expression, compile_selection(expression))
+        )
+    return rules
+
+
+def load_rules(
+    select_specs: Optional[list[str]], rules_file: Optional[str]
+) -> list[SelectionRule]:
+    """Buduje reguły z opcji --select (powtarzalnej) i --rules-file. Rzuca ValueError lub OSError."""
+    rule_specs = []
+    if rules_file:
+        rule_specs.extend(read_rules_file(rules_file))
+    for index, spec in enumerate(select_specs or [], len(rule_specs) + 1):
+        name, expression = parse_rule_spec(spec, index)
+        rule_specs.append((name, 1.0, expression))
+    names = [name for name, _, _ in rule_specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"powtórzone nazwy reguł: {', '.join(names)}")
+    return compile_rules(rule_specs)
+
+
+def rules_cache_stage(rules: list[SelectionRule]) -> str:
+    """Nazwa etapu cache zależna od reguł (wyniki różnych reguł nie mogą się mieszać)."""
+    if len(rules) == 1 and rules[0].expression == DEFAULT_SELECTION:
+        return "cvat"
+    key = "\n".join(f"{rule.name}\t{rule.expression}" for rule in rules)
+    return "cvat-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def match_rules(
+    rules: list[SelectionRule],
+    image_elem: ET.Element,
+    rule_errors: Optional[list[int]] = None,
+) -> list[int]:
+    """
+    Zwraca indeksy reguł spełnionych przez element <image> (pusta lista = obraz odrzucony).
+    Reguła, której obliczenie dla obrazu zgłosi błąd (np. width / height przy height=0), jest dla
+    niego niespełniona; pierwszy błąd reguły jest wypisywany, a wszystkie liczone w
+    rule_errors[indeks_reguły] (jeśli podano), więc błąd nie przerywa przetwarzania pliku XML.
+    """
+    namespace = {"_img": ImageFeatures(image_elem)}
+    matched = []
+    for index, rule in enumerate(rules):
+        try:
+            if eval(rule.code, _EVAL_GLOBALS, namespace):
+                matched.append(index)
+        except Exception as e:
+            first_error = rule_errors is None or not rule_errors[index]
+            if rule_errors is not None:
+                rule_errors[index] += 1
+            if first_error:
+                print(
+                    f"  Ostrzeżenie: błąd reguły '{rule.name}' ({rule.expression}) dla obrazu "
+                    f"'{namespace['_img'].name}': {type(e).__name__}: {e}. Obraz nie spełnia tej reguły.",
+                    file=sys.stderr,
+                )
+    return matched
+
+
+class WeightedSampler:
+    """
+    Ważone losowanie bez zwracania w jednym przebiegu (A-Res, Efraimidis-Spirakis):
+    każdy element dostaje klucz u^(1/waga), zachowywane jest k największych kluczy.
+    Powtórzenie elementu, który jest już w próbce, jest pomijane.
+    """
+
+    def __init__(self, sample_size: int, seed: Optional[int] = None):
+        self.sample_size = sample_size
+        self.random = random.Random(seed)
+        self.heap = []
+        self.members = set()
+
+    def add(self, item: str, weight: float):
+        if weight <= 0 or self.sample_size <= 0 or item in self.members:
+            return
+        key = self.random.random() ** (1.0 / weight)
+        if len(self.heap) < self.sample_size:
+            heapq.heappush(self.heap, (key, item))
+        elif key > self.heap[0][0]:
+            _, evicted = heapq.heapreplace(self.heap, (key, item))
+            self.members.discard(evicted)
+        else:
+            return
+        self.members.add(item)
+
+    def result(self) -> list[str]:
+        return sorted(item for _, item in self.heap)
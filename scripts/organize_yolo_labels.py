@@ -1,42 +1,76 @@
 # -*- coding: utf-8 -*-
 import os
-from typing import Optional
+import io
+from typing import Optional, TextIO
 import zipfile
 import argparse
 import sys
 import shutil
-from azure.storage.blob import BlobServiceClient
-from dotenv import load_dotenv
-from tqdm import tqdm
 import time
 import json
-import yaml  # Potrzebne do zapisu pliku YAML
+from prepare_yolo_dataset import list_local_files, read_label_stats
+from find_images_to_train import format_label_stats_line
+from parallel import ordered_thread_map
+from azure_clients import add_transfer_arguments, configure_transfer
+from storage_backends import (
+    StorageBackend,
+    BlobNotFoundError,
+    add_source_arguments,
+    create_storage_backend,
+)
+from dataset_index import (
+    INDEX_FILENAME,
+    read_dataset_index,
+    write_dataset_index,
+    scan_split_dirs,
+    refresh_label_flags,
+    write_split_lists,
+)
+from dataset_manifest import write_dataset_manifest
+from progress_reporter import (
+    ProgressReporter,
+    add_progress_arguments,
+    configure_progress,
+)
+from annotation_cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CACHE_MAX_MB,
+    get_blob_etag,
+    load_cached_annotations,
+    store_cached_annotations,
+)
+
+# Liczba wątków zapisu etykiet i wielkość partii (jedna partia = jedno zadanie w puli)
+DEFAULT_LABEL_WORKERS = 8
+LABEL_WRITE_BATCH = 512
+# Maksymalna liczba plików etykiet przemapowywanych jednym wywołaniem numpy (ogranicza pamięć)
+LABEL_REMAP_BATCH = 4096
+# Bajt wypełnienia przy zmianie szerokości id klasy (usuwany po przemapowaniu)
+REMAP_FILLER = b"\x00"
+# Kodowanie treści etykiet w cache: latin-1 odwzorowuje każdy bajt na znak, więc zapis jest
+# bezstratny także dla plików, które nie są poprawnym UTF-8 (starsze wpisy: utf-8)
+LABEL_CACHE_ENCODING = "latin-1"
 
 
 # --- Funkcje pomocnicze (download, unzip, find_all_txt_files) - bez zmian ---
 # (Wklej tutaj te funkcje z poprzedniej odpowiedzi)
 def download_blob_sync(
-    connect_str: str, container_name: str, blob_name: str, download_file_path: str
+    storage: StorageBackend,
+    container_name: str,
+    blob_name: str,
+    download_file_path: str,
 ):
-    if not connect_str:
-        print("Błąd: Brak ciągu połączenia.", file=sys.stderr)
-        return False
     try:
-        print(f"  Łączenie z Azure dla {blob_name}...")
-        blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name, blob=blob_name
+        print(
+            f"  Pobieranie {blob_name} ({storage.describe(container_name)}) do {download_file_path}..."
         )
-        if not blob_client.exists():
-            print(f"  Błąd: Blob '{blob_name}' nie istnieje.", file=sys.stderr)
-            return False
-        print(f"  Pobieranie {blob_name} do {download_file_path}...")
         os.makedirs(os.path.dirname(download_file_path), exist_ok=True)
-        with open(download_file_path, "wb") as download_file:
-            download_stream = blob_client.download_blob()
-            download_file.write(download_stream.readall())
+        storage.place_file(container_name, blob_name, download_file_path)
         print(f"  Pobieranie {blob_name} zakończone.")
         return True
+    except BlobNotFoundError:
+        print(f"  Błąd: Blob '{blob_name}' nie istnieje.", file=sys.stderr)
+        return False
     except Exception as e:
         print(f"  Błąd pobierania {blob_name}: {e}", file=sys.stderr)
         return False
@@ -70,96 +104,907 @@ def find_all_txt_files(directory: str) -> list[str]:
     return txt_files
 
 
-# --- Funkcja organize_labels - z poprzedniej odpowiedzi (z poprawnymi nazwami) ---
+def read_label_files(
+    source_txt_files: list[str], extract_base_path: str
+) -> dict[str, bytes]:
+    """Wczytuje treść plików etykiet: {ścieżka_względna_w_archiwum ('/'): treść}."""
+    label_contents = {}
+    for txt_path in source_txt_files:
+        relative_txt_path = os.path.relpath(txt_path, extract_base_path).replace(
+            "\\", "/"
+        )
+        with open(txt_path, "rb") as f:
+            label_contents[relative_txt_path] = f.read()
+    return label_contents
+
+
+def encode_cached_labels(
+    class_names: Optional[list[str]], label_contents: dict[str, bytes]
+) -> dict:
+    """Wpis cache etapu 'yolo': nazwy klas i treści etykiet zapisane bezstratnie (LABEL_CACHE_ENCODING)."""
+    return {
+        "class_names": class_names,
+        "label_encoding": LABEL_CACHE_ENCODING,
+        "labels": {
+            relative_path: content.decode(LABEL_CACHE_ENCODING)
+            for relative_path, content in label_contents.items()
+        },
+    }
+
+
+def decode_cached_labels(cached: dict) -> dict[str, bytes]:
+    """Treści etykiet z wpisu cache etapu 'yolo' (odwrotność encode_cached_labels)."""
+    encoding = cached.get("label_encoding", "utf-8")
+    return {
+        relative_path: content.encode(encoding)
+        for relative_path, content in cached["labels"].items()
+    }
+
+
+# --- Uzgadnianie nazw klas między archiwami ---
+def merge_class_names(
+    unified_names: list[str], archive_names: list[str], archive_label: str
+) -> list[int]:
+    """
+    Dołącza klasy archiwum do wspólnej listy (nowe nazwy trafiają na koniec)
+    i zwraca tablicę przemapowania: lokalne_id -> wspólne_id.
+    Zgłasza zmiany kolejności oraz nazwy różniące się tylko wielkością liter/spacjami.
+    """
+    unified_index = {name: i for i, name in enumerate(unified_names)}
+    normalized_index = {" ".join(name.lower().split()): name for name in unified_names}
+    class_remap = []
+    for local_id, name in enumerate(archive_names):
+        unified_id = unified_index.get(name)
+        if unified_id is None:
+            similar = normalized_index.get(" ".join(name.lower().split()))
+            if similar is not None:
+                print(
+                    f"  Konflikt klas w {archive_label}: '{name}' różni się od '{similar}' tylko zapisem. Traktowane jako osobne klasy.",
+                    file=sys.stderr,
+                )
+            unified_id = len(unified_names)
+            unified_names.append(name)
+            unified_index[name] = unified_id
+            normalized_index.setdefault(" ".join(name.lower().split()), name)
+        class_remap.append(unified_id)
+
+    moved = [
+        f"{local_id}->{unified_id} ({archive_names[local_id]})"
+        for local_id, unified_id in enumerate(class_remap)
+        if local_id != unified_id
+    ]
+    if moved:
+        print(
+            f"  Inna kolejność klas w {archive_label}, przemapowanie id: {', '.join(moved)}"
+        )
+    return class_remap
+
+
+def remap_label_content(data: bytes, class_remap: list[int]) -> tuple[bytes, int]:
+    """
+    Przepisuje id klas (pierwsza kolumna) w treści pliku etykiet YOLO (linia po linii; dla wielu
+    plików szybsze jest remap_label_contents). Linie z id spoza obj.names archiwum są usuwane.
+    Zwraca (nowa_treść, liczba_usuniętych_linii).
+    """
+    out_lines = []
+    invalid_lines = 0
+    num_classes = len(class_remap)
+    for line in data.splitlines():
+        class_token, sep, rest = line.strip().partition(b" ")
+        if not class_token:
+            continue
+        try:
+            local_id = int(class_token)
+        except ValueError:
+            invalid_lines += 1
+            continue
+        if not 0 <= local_id < num_classes:
+            invalid_lines += 1
+            continue
+        out_lines.append(b"%d%s%s" % (class_remap[local_id], sep, rest))
+    content = b"\n".join(out_lines) + b"\n" if out_lines else b""
+    return content, invalid_lines
+
+
+def _remap_token_table(class_remap: list[int]):
+    """Cyfry nowych id klas jako tablica (liczba_klas x maks_szerokość) i ich długości."""
+    import numpy as np
+
+    texts = [b"%d" % unified_id for unified_id in class_remap]
+    table = np.zeros((len(texts), max(map(len, texts))), dtype=np.uint8)
+    for local_id, text in enumerate(texts):
+        table[local_id, : len(text)] = np.frombuffer(text, dtype=np.uint8)
+    return table, np.array([len(text) for text in texts], dtype=np.int64)
+
+
+def remap_label_contents(
+    contents: list[bytes], class_remap: list[int]
+) -> tuple[list[bytes], int]:
+    """
+    Wsadowa wersja remap_label_content dla wielu plików etykiet: treści są łączone w jeden bufor,
+    a kolumna id klas jest odczytywana i przepisywana operacjami numpy (bez pętli po liniach).
+    Przy zmianie szerokości id (np. 9 -> 11) każda linia dostaje stały prefiks wypełnienia
+    (bytes.replace), nowe id są wpisywane w miejscu, a wypełnienie jest usuwane jednym replace.
+    Pliki nietypowe (CR, tabulatory, puste linie, spacje na brzegach linii, id spoza obj.names
+    lub niebędące liczbą) przechodzą przez remap_label_content - wynik jest identyczny.
+    Zwraca (nowe_treści w kolejności contents, liczba_usuniętych_linii).
+    """
+    results = []
+    invalid_total = 0
+    for start in range(0, len(contents), LABEL_REMAP_BATCH):
+        chunk_results, invalid_lines = _remap_label_chunk(
+            contents[start : start + LABEL_REMAP_BATCH], class_remap
+        )
+        results.extend(chunk_results)
+        invalid_total += invalid_lines
+    return results, invalid_total
+
+
+def _remap_label_chunk(
+    contents: list[bytes], class_remap: list[int]
+) -> tuple[list[bytes], int]:
+    import numpy as np
+
+    if not contents:
+        return [], 0
+    data = b"".join(contents)
+    if not class_remap or REMAP_FILLER in data:
+        # Rzadkie: pliki z bajtem wypełnienia (lub brak klas) - pętla po liniach dla tych plików
+        held_out = [
+            position
+            for position, content in enumerate(contents)
+            if not class_remap or REMAP_FILLER in content
+        ]
+        if len(held_out) < len(contents):
+            held_out_set = set(held_out)
+            results, invalid_total = _remap_label_chunk(
+                [c for i, c in enumerate(contents) if i not in held_out_set],
+                class_remap,
+            )
+        else:
+            results, invalid_total = [], 0
+        for position in held_out:
+            content, invalid_lines = remap_label_content(
+                contents[position], class_remap
+            )
+            results.insert(position, content)
+            invalid_total += invalid_lines
+        return results, invalid_total
+
+    # Wartownik: ostatnia linia bufora zawsze kończy się znakiem nowej linii
+    buf = np.frombuffer(data + b"\n", dtype=np.uint8)
+    file_ends = np.cumsum(
+        np.fromiter(map(len, contents), dtype=np.int64, count=len(contents))
+    )
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    # Id klasy: od początku linii do pierwszej spacji (lub końca linii)
+    breaks = np.flatnonzero((buf == ord(" ")) | (buf == ord("\n")))
+    token_ends = breaks[np.searchsorted(breaks, line_starts)]
+    token_len = token_ends - line_starts
+    num_classes = len(class_remap)
+    max_token_len = len(str(num_classes - 1))
+    valid = (
+        (token_len >= 1)
+        & (token_len <= max_token_len)
+        & (buf[line_ends - 1] != ord(" "))
+    )
+    for special in (b"\t", b"\v", b"\f", b"\r"):
+        if special in data:
+            valid[np.searchsorted(line_ends, np.flatnonzero(buf == special[0]))] = False
+    # Plik bez końcowego znaku nowej linii: jego ostatnia linia łączy się z następnym plikiem
+    unterminated_files = np.flatnonzero(
+        (file_ends > np.concatenate(([0], file_ends[:-1])))
+        & (buf[file_ends - 1] != ord("\n"))
+    )
+    valid[np.searchsorted(line_ends, file_ends[unterminated_files])] = False
+    local_ids = np.zeros(len(line_starts), dtype=np.int64)
+    for j in range(max_token_len):
+        in_token = token_len > j
+        digit = buf[np.minimum(line_starts + j, len(buf) - 1)].astype(np.int64) - ord(
+            "0"
+        )
+        valid &= ~in_token | ((digit >= 0) & (digit <= 9))
+        local_ids = np.where(in_token, local_ids * 10 + digit, local_ids)
+    valid &= local_ids < num_classes
+    local_ids = np.where(valid, local_ids, 0)
+
+    table, table_len = _remap_token_table(class_remap)
+    new_len = np.where(valid, table_len[local_ids], token_len)
+    if np.array_equal(new_len, token_len):
+        pad = 0
+        out = buf.copy()
+    else:
+        pad = table.shape[1] - 1
+        out = np.frombuffer(
+            REMAP_FILLER * pad + data.replace(b"\n", b"\n" + REMAP_FILLER * pad),
+            dtype=np.uint8,
+        ).copy()
+    # Nowe id są wyrównane do prawej, do końca starego id (przed nim pad bajtów wypełnienia)
+    token_ends_out = token_ends + pad * np.arange(1, len(token_ends) + 1)
+    for j in range(max_token_len + pad):
+        mask = valid & (token_len + pad > j)
+        out[token_ends_out[mask] - 1 - j] = REMAP_FILLER[0]
+    for j in range(table.shape[1]):
+        mask = valid & (new_len > j)
+        out[token_ends_out[mask] - new_len[mask] + j] = table[local_ids[mask], j]
+    out_data = out.tobytes()
+    if pad:
+        out_data = out_data.replace(REMAP_FILLER, b"")
+
+    # Granice plików w wyniku: przesunięcie o sumę zmian szerokości id w liniach przed końcem pliku
+    out_line_bounds = np.concatenate(
+        ([0], line_ends + 1 + np.cumsum(new_len - token_len))
+    )
+    out_file_ends = out_line_bounds[
+        np.searchsorted(line_ends, file_ends, side="left")
+    ].tolist()
+    results = [
+        out_data[file_start:file_end]
+        for file_start, file_end in zip([0] + out_file_ends[:-1], out_file_ends)
+    ]
+    invalid_total = 0
+    irregular_files = np.union1d(
+        np.searchsorted(file_ends, line_ends[~valid], side="right"),
+        unterminated_files,
+    ).tolist()
+    for position in irregular_files:
+        if position < len(contents):
+            results[position], invalid_lines = remap_label_content(
+                contents[position], class_remap
+            )
+            invalid_total += invalid_lines
+    return results, invalid_total
+
+
+def derive_label_stems(
+    relative_txt_paths: list[str], zip_base_structure: Optional[str]
+) -> list[str]:
+    """
+    Zamienia ścieżki etykiet w archiwum ('/') na ścieżki obrazów Azure bez rozszerzenia - jednym
+    przebiegiem po całej liście (prefiks wyliczony raz, bez os.path na plik).
+    """
+    prefix = zip_base_structure.replace("\\", "/") + "/" if zip_base_structure else ""
+    prefix_len = len(prefix)
+    stems = []
+    for path in relative_txt_paths:
+        if prefix and path.startswith(prefix):
+            path = path[prefix_len:]
+        # Jak os.path.splitext: '.txt' jako cała nazwa pliku to nie rozszerzenie
+        dot = path.rfind(".")
+        if dot > path.rfind("/") + 1:
+            path = path[:dot]
+        stems.append(path)
+    return stems
+
+
+def build_stem_index(
+    path_mapping: dict[str, str], preferred_ext: str
+) -> tuple[dict[str, Optional[str]], dict[str, list[str]]]:
+    """
+    Buduje indeks {ścieżka_azure_bez_rozszerzenia: spłaszczona_nazwa}, więc etykieta trafia do
+    obrazu jednym wyszukaniem niezależnie od jego rozszerzenia (.jpg, .jpeg, .png, .JPG...).
+    Gdy kilka obrazów ma tę samą ścieżkę bez rozszerzenia, wybierany jest ten z preferred_ext
+    (--image-ext, dokładnie, potem bez rozróżniania wielkości liter); jeśli nie da się
+    rozstrzygnąć, wartością jest None. Zwraca (indeks, {niejednoznaczna_ścieżka: ścieżki_azure}).
+    """
+    stem_index = {}
+    ambiguous = {}
+    for azure_path, flat_filename in path_mapping.items():
+        stem = os.path.splitext(azure_path)[0]
+        if stem in ambiguous:
+            ambiguous[stem].append(azure_path)
+        elif stem in stem_index:
+            ambiguous[stem] = [stem_index.pop(stem), azure_path]
+        else:
+            stem_index[stem] = azure_path
+    stem_index = {stem: path_mapping[path] for stem, path in stem_index.items()}
+
+    preferred_ext = "." + preferred_ext.lstrip(".")
+    for stem, azure_paths in ambiguous.items():
+        chosen = None
+        for matches in (
+            lambda ext: ext == preferred_ext,
+            lambda ext: ext.lower() == preferred_ext.lower(),
+        ):
+            candidates = [
+                path for path in azure_paths if matches(os.path.splitext(path)[1])
+            ]
+            if len(candidates) == 1:
+                chosen = path_mapping[candidates[0]]
+                break
+        stem_index[stem] = chosen
+    return stem_index, ambiguous
+
+
+def report_ambiguous_stems(
+    stem_index: dict[str, Optional[str]],
+    ambiguous: dict[str, list[str]],
+    max_examples: int = 5,
+):
+    """Wypisuje ścieżki obrazów różniące się tylko rozszerzeniem i sposób ich rozstrzygnięcia."""
+    if not ambiguous:
+        return
+    unresolved = [stem for stem in ambiguous if stem_index.get(stem) is None]
+    print(
+        f"Ostrzeżenie: {len(ambiguous)} ścieżek obrazów w mapowaniu różni się tylko rozszerzeniem; "
+        f"rozstrzygnięto wg --image-ext: {len(ambiguous) - len(unresolved)}, "
+        f"etykiety pominięte (niejednoznaczne): {len(unresolved)}.",
+        file=sys.stderr,
+    )
+    for stem in sorted(ambiguous)[:max_examples]:
+        print(
+            f"  {stem}: {', '.join(sorted(ambiguous[stem]))} -> {stem_index.get(stem) or 'pominięte'}",
+            file=sys.stderr,
+        )
+
+
+class LabelClaims:
+    """
+    Rozstrzyga, która etykieta trafia do pliku, do którego prowadzi kilka etykiet: duplikaty
+    z prepare_yolo_dataset.py --dedup (wskazują na obraz kanoniczny), ścieżki o tej samej
+    spłaszczonej nazwie albo ten sam obraz w kilku archiwach. Wygrywa pierwsze archiwum
+    w kolejności --annotation-blobs, a w obrębie archiwum ścieżka występująca wcześniej
+    w mapowaniu (obraz kanoniczny przed duplikatami), potem mniejsza ścieżka w archiwum.
+    Pozostałe etykiety są pomijane i raportowane przez report().
+    """
+
+    def __init__(self, stem_index: dict[str, Optional[str]]):
+        references = {}
+        for flat_filename in stem_index.values():
+            if flat_filename:
+                references[flat_filename] = references.get(flat_filename, 0) + 1
+        # Pozycja w mapowaniu - tylko dla ścieżek współdzielących plik obrazu
+        self.rank = {
+            stem: position
+            for position, stem in enumerate(
+                stem
+                for stem, flat_filename in stem_index.items()
+                if flat_filename and references[flat_filename] > 1
+            )
+        }
+        self.owners = {}  # spłaszczona_nazwa -> archiwum, z którego zapisano etykietę
+        self.conflicts = {}  # spłaszczona_nazwa -> ['archiwum: ścieżka' pominiętych]
+
+    def select(
+        self, archive_label: str, candidates: list[tuple[str, str, str]]
+    ) -> list[bool]:
+        """
+        Wybiera etykiety archiwum do zapisu. candidates: [(spłaszczona_nazwa, ścieżka_bez_rozszerzenia,
+        źródło)]. Zwraca listę flag (True - zapisać) i rejestruje wybrane pliki jako zajęte.
+        """
+        keep = [False] * len(candidates)
+        chosen = {}  # spłaszczona_nazwa -> indeks wybranej etykiety
+        no_rank = len(self.rank)
+        for index, (flat_filename, stem, source) in enumerate(candidates):
+            if flat_filename in self.owners:
+                self.conflicts.setdefault(flat_filename, []).append(
+                    f"{archive_label}: {stem}"
+                )
+                continue
+            best = chosen.get(flat_filename)
+            if best is not None:
+                _, best_stem, best_source = candidates[best]
+                loser = index
+                if (self.rank.get(stem, no_rank), source) < (
+                    self.rank.get(best_stem, no_rank),
+                    best_source,
+                ):
+                    chosen[flat_filename] = index
+                    keep[best], keep[index] = False, True
+                    loser = best
+                self.conflicts.setdefault(flat_filename, []).append(
+                    f"{archive_label}: {candidates[loser][1]}"
+                )
+                continue
+            chosen[flat_filename] = index
+            keep[index] = True
+        for flat_filename in chosen:
+            self.owners[flat_filename] = archive_label
+        return keep
+
+    def report(self, max_examples: int = 5):
+        """Wypisuje pliki etykiet, do których prowadziło kilka etykiet, i źródło zapisanej."""
+        if not self.conflicts:
+            return
+        skipped = sum(len(sources) for sources in self.conflicts.values())
+        print(
+            f"Ostrzeżenie: do {len(self.conflicts)} plików etykiet prowadzi kilka etykiet (duplikaty obrazów "
+            f"lub ten sam obraz w kilku archiwach); zapisano etykietę z pierwszego archiwum wg --annotation-blobs, "
+            f"pominięto: {skipped}.",
+            file=sys.stderr,
+        )
+        for flat_filename in sorted(self.conflicts)[:max_examples]:
+            print(
+                f"  {flat_filename}: z {self.owners[flat_filename]}, pominięte: {', '.join(self.conflicts[flat_filename])}",
+                file=sys.stderr,
+            )
+
+
+def relative_label_paths(
+    source_txt_files: list[str], extract_base_path: str
+) -> list[Optional[str]]:
+    """Ścieżki etykiet względem folderu rozpakowania, z '/' (None, jeśli plik leży poza nim)."""
+    base = os.path.join(extract_base_path, "")
+    base_len = len(base)
+    relative_paths = []
+    for txt_path in source_txt_files:
+        if txt_path.startswith(base):
+            relative_path = txt_path[base_len:]
+        else:
+            try:
+                relative_path = os.path.relpath(txt_path, extract_base_path)
+            except ValueError:
+                relative_paths.append(None)
+                continue
+        relative_paths.append(
+            relative_path.replace("\\", "/") if os.sep != "/" else relative_path
+        )
+    return relative_paths
+
+
+def count_label_classes(content: bytes) -> dict[int, int]:
+    """Histogram id klas (pierwsza kolumna) w treści pliku etykiet YOLO: {id: liczba_linii}."""
+    histogram = {}
+    for line in content.splitlines():
+        fields = line.split(None, 1)
+        if fields and fields[0].isdigit():
+            class_id = int(fields[0])
+            histogram[class_id] = histogram.get(class_id, 0) + 1
+    return histogram
+
+
+class WrittenLabelStats:
+    """
+    Statystyki klas liczone z zapisanych etykiet YOLO, czyli po przepisaniu id i usunięciu linii
+    z błędnym id (a nie z boxów w XML CVAT). Histogramy obrazów są strumieniowo zapisywane do
+    stats_file w formacie find_images_to_train.py --label-stats-file (klucz: ścieżka obrazu Azure),
+    więc plik nadaje się do prepare_yolo_dataset.py --split-mode stratified. Jeśli podano
+    xml_stats (wynik read_label_stats), histogramy są uzgadniane ze statystykami z XML.
+    class_names to wspólna lista klas (rośnie w miarę scalania archiwów, id się nie zmieniają).
+    """
+
+    def __init__(
+        self,
+        class_names: list[str],
+        stats_file: Optional[TextIO] = None,
+        xml_stats: Optional[tuple] = None,
+        max_examples: int = 5,
+    ):
+        self.class_names = class_names
+        self.stats_file = stats_file
+        self.xml_stats = xml_stats
+        self.max_examples = max_examples
+        self.split_counts = {True: {}, False: {}}  # czy_train -> {id: liczba}
+        self.valid_images = 0
+        self.compared_images = 0
+        self.images_without_xml_stats = 0
+        self.mismatched_examples = []
+        self.mismatched_images = 0
+        self.xml_counts = {}  # nazwa -> liczba boxów w XML (obrazy porównane)
+        self.written_counts = (
+            {}
+        )  # nazwa -> liczba linii w etykietach (obrazy porównane)
+
+    def class_name(self, class_id: int) -> str:
+        if class_id < len(self.class_names):
+            return self.class_names[class_id]
+        return str(class_id)
+
+    def add(self, image_path: str, histogram: dict[int, int], is_train: bool):
+        """Dolicza etykietę zapisaną dla obrazu image_path (histogram z count_label_classes)."""
+        split_counts = self.split_counts[is_train]
+        named = {}
+        for class_id in sorted(histogram):
+            count = histogram[class_id]
+            split_counts[class_id] = split_counts.get(class_id, 0) + count
+            named[self.class_name(class_id)] = count
+        if not is_train:
+            self.valid_images += 1
+        if self.stats_file is not None:
+            self.stats_file.write(format_label_stats_line(image_path, named))
+        if self.xml_stats is None:
+            return
+        row_of, xml_class_names, offsets, class_ids, counts = self.xml_stats
+        row = row_of.get(image_path)
+        if row is None:
+            self.images_without_xml_stats += 1
+            return
+        xml_named = {
+            xml_class_names[class_ids[k]]: counts[k]
+            for k in range(offsets[row], offsets[row + 1])
+        }
+        self.compared_images += 1
+        for name, count in xml_named.items():
+            self.xml_counts[name] = self.xml_counts.get(name, 0) + count
+        for name, count in named.items():
+            self.written_counts[name] = self.written_counts.get(name, 0) + count
+        if xml_named != named:
+            self.mismatched_images += 1
+            if len(self.mismatched_examples) < self.max_examples:
+                self.mismatched_examples.append((image_path, xml_named, named))
+
+    def report(self):
+        """Wypisuje liczności klas w train/valid oraz (z xml_stats) różnice względem XML."""
+        train_counts, valid_counts = self.split_counts[True], self.split_counts[False]
+        class_ids = sorted(set(train_counts) | set(valid_counts))
+        if class_ids:
+            print("\nStatystyki klas z zapisanych etykiet (liczba boxów):")
+        missing_in_valid = []
+        for class_id in class_ids:
+            in_train = train_counts.get(class_id, 0)
+            in_valid = valid_counts.get(class_id, 0)
+            print(
+                f"  {self.class_name(class_id)}: train={in_train}, valid={in_valid} ({in_valid / (in_train + in_valid) * 100:.1f}%)"
+            )
+            if in_valid == 0:
+                missing_in_valid.append(self.class_name(class_id))
+        if missing_in_valid and self.valid_images:
+            print(
+                f"  Ostrzeżenie: Klasy bez przykładów walidacyjnych: {', '.join(missing_in_valid)}",
+                file=sys.stderr,
+            )
+        if self.xml_stats is None:
+            return
+        print(
+            f"\nUzgodnienie ze statystykami z XML: porównano {self.compared_images} obrazów, "
+            f"różne histogramy: {self.mismatched_images}, brak w statystykach XML: {self.images_without_xml_stats}."
+        )
+        differences = [
+            (name, self.xml_counts.get(name, 0), self.written_counts.get(name, 0))
+            for name in sorted(set(self.xml_counts) | set(self.written_counts))
+            if self.xml_counts.get(name, 0) != self.written_counts.get(name, 0)
+        ]
+        if not differences:
+            return
+        print(
+            "  Ostrzeżenie: Liczba boxów w etykietach różni się od statystyk z XML "
+            "(np. linie usunięte przez błędne id klasy):",
+            file=sys.stderr,
+        )
+        for name, xml_count, written_count in differences:
+            print(
+                f"    {name}: XML={xml_count}, etykiety={written_count} ({written_count - xml_count:+d})",
+                file=sys.stderr,
+            )
+        for image_path, xml_named, named in self.mismatched_examples:
+            print(
+                f"    {image_path}: XML {xml_named or '{}'} != etykiety {named or '{}'}",
+                file=sys.stderr,
+            )
+
+
 def organize_labels(
     source_txt_files: list[str],
     extract_base_path: str,
     dataset_base_dir: str,
-    path_mapping: dict[str, str],
-    image_ext: str,
+    stem_index: dict[str, Optional[str]],
     zip_base_structure: Optional[
         str
     ] = "obj_train_data",  # Typ Optional, bo może być None (jeśli nie podano)  # Nadal potrzebne do relatywnej ścieżki
-) -> tuple[int, int, int]:
+    class_remap: Optional[list[int]] = None,
+    label_contents: Optional[dict[str, bytes]] = None,
+    workers: int = DEFAULT_LABEL_WORKERS,
+    label_stats: Optional[WrittenLabelStats] = None,
+    label_claims: Optional[LabelClaims] = None,
+    archive_label: str = "",
+) -> tuple[int, int, int, int]:
     """
     Kopiuje pliki .txt do odpowiednich folderów labels/train lub labels/valid,
-    zapisując je pod nazwą odpowiadającą SPŁASZCZONEJ nazwie obrazu.
-    Zwraca krotkę: (liczba_skopiowanych_train, liczba_skopiowanych_valid, liczba_pominietych)
+    zapisując je pod nazwą odpowiadającą SPŁASZCZONEJ nazwie obrazu (stem_index
+    z build_stem_index: dopasowanie po ścieżce bez rozszerzenia).
+    Jeśli podano class_remap (lokalne_id -> wspólne_id), id klas są przepisywane
+    w locie podczas zapisu (bez kopiowania i ponownego odczytu pliku), a linie z id spoza
+    obj.names archiwum są usuwane - także przy identycznej kolejności klas.
+    Jeśli podano label_contents ({ścieżka_w_archiwum: treść}, np. z cache), etykiety
+    są zapisywane z pamięci, a source_txt_files i extract_base_path są ignorowane.
+    Klucze i foldery docelowe są wyznaczane dla całej listy naraz (obrazy z jednego skanowania
+    folderów zamiast os.path.exists na etykietę), a zapis idzie partiami w puli workers wątków;
+    postęp (zadanie 'organize_labels') jest raportowany raz na partię.
+    Jeśli podano label_stats, każda zapisana etykieta jest do niego doliczana (histogram klas
+    z treści po przepisaniu id; zamiast copyfile plik jest wtedy czytany i zapisywany).
+    Jeśli podano label_claims (wspólne dla archiwów przetwarzanych kolejno), z etykiet
+    prowadzących do tego samego pliku zapisywana jest jedna (LabelClaims.select, archive_label
+    to nazwa archiwum); pozostałe są liczone jako pominięte.
+    Zwraca krotkę: (liczba_skopiowanych_train, liczba_skopiowanych_valid, liczba_pominietych,
+    liczba_usunietych_linii_z_blednym_id)
     """
     train_labels_dir = os.path.join(dataset_base_dir, "labels", "train")
     valid_labels_dir = os.path.join(dataset_base_dir, "labels", "valid")
-    train_images_dir = os.path.join(dataset_base_dir, "images", "train")
-    valid_images_dir = os.path.join(dataset_base_dir, "images", "valid")
+    train_images = list_local_files(os.path.join(dataset_base_dir, "images", "train"))
+    valid_images = list_local_files(os.path.join(dataset_base_dir, "images", "valid"))
 
     os.makedirs(train_labels_dir, exist_ok=True)
     os.makedirs(valid_labels_dir, exist_ok=True)
 
-    copied_train_count, copied_valid_count, skipped_count, map_key_not_found = (
-        0,
-        0,
-        0,
-        0,
+    if label_contents is not None:
+        label_sources = list(label_contents)
+        relative_paths = label_sources
+    else:
+        label_sources = source_txt_files
+        relative_paths = relative_label_paths(source_txt_files, extract_base_path)
+    sources = [
+        source
+        for source, relative_path in zip(label_sources, relative_paths)
+        if relative_path is not None
+    ]
+    stems = derive_label_stems(
+        [path for path in relative_paths if path is not None], zip_base_structure
     )
+    skipped_count = len(label_sources) - len(sources)
+    map_key_not_found = 0
+    ambiguous_count = 0
 
-    for txt_path in tqdm(source_txt_files, desc="   Organizowanie .txt", unit="plik"):
-        try:
-            relative_txt_path_full = os.path.relpath(txt_path, extract_base_path)
-        except ValueError:
-            skipped_count += 1
-            continue
-
-        relative_txt_path = relative_txt_path_full.replace("\\", "/")
-        if zip_base_structure:
-            prefix_to_remove = zip_base_structure.replace("\\", "/") + "/"
-            if relative_txt_path.startswith(prefix_to_remove):
-                relative_txt_path = relative_txt_path[len(prefix_to_remove) :]
-
-        key_base = os.path.splitext(relative_txt_path)[0]
-        original_azure_key = f"{key_base}.{image_ext.lstrip('.')}"
-        flattened_image_filename = path_mapping.get(original_azure_key)
-
+    # Zadania zapisu: (źródło, ścieżka docelowa, czy train, ścieżka obrazu Azure)
+    jobs = []
+    # (spłaszczona_nazwa, ścieżka, źródło) zadań - dla label_claims
+    claim_candidates = []
+    for source, stem in zip(sources, stems):
+        flattened_image_filename = stem_index.get(stem)
         if not flattened_image_filename:
-            map_key_not_found += 1
+            if stem in stem_index:
+                ambiguous_count += 1
+            else:
+                map_key_not_found += 1
             skipped_count += 1
             continue
-
-        expected_train_image_path = os.path.join(
-            train_images_dir, flattened_image_filename
-        )
-        expected_valid_image_path = os.path.join(
-            valid_images_dir, flattened_image_filename
-        )
-
-        target_labels_dir = None
-        target_set = None
-        if os.path.exists(expected_train_image_path):
-            target_labels_dir = train_labels_dir
-            target_set = "train"
-        elif os.path.exists(expected_valid_image_path):
-            target_labels_dir = valid_labels_dir
-            target_set = "valid"
+        if flattened_image_filename in train_images:
+            target_labels_dir, is_train = train_labels_dir, True
+        elif flattened_image_filename in valid_images:
+            target_labels_dir, is_train = valid_labels_dir, False
         else:
             skipped_count += 1
             continue
+        flattened_label_filename = (
+            os.path.splitext(flattened_image_filename)[0] + ".txt"
+        )
+        jobs.append(
+            (
+                source,
+                os.path.join(target_labels_dir, flattened_label_filename),
+                is_train,
+                stem + os.path.splitext(flattened_image_filename)[1],
+            )
+        )
+        if label_claims is not None:
+            claim_candidates.append((flattened_image_filename, stem, source))
+    conflict_count = 0
+    if label_claims is not None:
+        keep = label_claims.select(archive_label, claim_candidates)
+        claim_candidates = None
+        conflict_count = len(jobs) - sum(keep)
+        skipped_count += conflict_count
+        jobs = [job for job, kept in zip(jobs, keep) if kept]
 
-        flattened_label_base = os.path.splitext(flattened_image_filename)[0]
-        flattened_label_filename = f"{flattened_label_base}.txt"
-        destination_path = os.path.join(target_labels_dir, flattened_label_filename)
+    def write_batch(
+        batch: list[tuple[str, str, bool, str]],
+    ) -> tuple[int, int, int, int, list[tuple[str, dict[int, int], bool]]]:
+        """
+        Zapisuje partię etykiet. Zwraca (train, valid, błędy, usunięte_linie, histogramy), gdzie
+        histogramy to [(ścieżka_obrazu, {id: liczba}, czy_train)] (puste bez label_stats).
+        """
+        train_count = valid_count = failed_count = invalid_count = 0
+        histograms = []
+        remapped = None
+        if class_remap is not None:
+            # Id klas całej partii są przepisywane jednym wywołaniem (remap_label_contents)
+            contents = []
+            for source, _, _, _ in batch:
+                try:
+                    if label_contents is not None:
+                        contents.append(label_contents[source])
+                    else:
+                        with open(source, "rb") as src:
+                            contents.append(src.read())
+                except Exception:
+                    contents.append(None)
+            new_contents, invalid_count = remap_label_contents(
+                [content for content in contents if content is not None], class_remap
+            )
+            new_contents = iter(new_contents)
+            remapped = [
+                next(new_contents) if content is not None else None
+                for content in contents
+            ]
+        for index, (source, destination_path, is_train, image_path) in enumerate(batch):
+            try:
+                if remapped is not None:
+                    if remapped[index] is None:
+                        raise OSError(f"nie można odczytać '{source}'")
+                    content = remapped[index]
+                elif label_contents is not None:
+                    content = label_contents[source]
+                elif label_stats is not None:
+                    with open(source, "rb") as src:
+                        content = src.read()
+                else:
+                    # copyfile zamiast copy2: bez kopiowania metadanych (mniej wywołań systemowych)
+                    shutil.copyfile(source, destination_path)
+                    content = None
+                if content is not None:
+                    with open(destination_path, "wb") as dst:
+                        dst.write(content)
+            except Exception:
+                failed_count += 1
+                continue
+            if is_train:
+                train_count += 1
+            else:
+                valid_count += 1
+            if label_stats is not None:
+                histograms.append((image_path, count_label_classes(content), is_train))
+        return train_count, valid_count, failed_count, invalid_count, histograms
 
-        try:
-            shutil.copy2(txt_path, destination_path)
-            if target_set == "train":
-                copied_train_count += 1
-            elif target_set == "valid":
-                copied_valid_count += 1
-        except Exception:
-            skipped_count += 1
+    copied_train_count = copied_valid_count = invalid_lines_total = 0
+    batches = (
+        jobs[start : start + LABEL_WRITE_BATCH]
+        for start in range(0, len(jobs), LABEL_WRITE_BATCH)
+    )
+    with ProgressReporter(
+        "organize_labels", "   Organizowanie .txt", total=len(jobs)
+    ) as progress:
+        for batch_size, (
+            train_count,
+            valid_count,
+            failed_count,
+            invalid_count,
+            histograms,
+        ) in ordered_thread_map(
+            lambda batch: (len(batch), write_batch(batch)), batches, workers
+        ):
+            copied_train_count += train_count
+            copied_valid_count += valid_count
+            skipped_count += failed_count
+            invalid_lines_total += invalid_count
+            for image_path, histogram, is_train in histograms:
+                label_stats.add(image_path, histogram, is_train)
+            progress.update(batch_size, errors=failed_count)
 
     # Podsumowanie dla tego archiwum (mniej gadatliwe)
     print(
         f"  Wynik org. etykiet: train={copied_train_count}, valid={copied_valid_count}, pominięte={skipped_count}, brak_mapy={map_key_not_found}"
+        + (f", niejednoznaczne={ambiguous_count}" if ambiguous_count else "")
+        + (f", konflikty={conflict_count}" if conflict_count else "")
+    )
+    if invalid_lines_total:
+        print(
+            f"  Ostrzeżenie: Usunięto {invalid_lines_total} linii etykiet z id klasy spoza obj.names archiwum.",
+            file=sys.stderr,
+        )
+    return copied_train_count, copied_valid_count, skipped_count, invalid_lines_total
+
+
+def download_blob_bytes(
+    storage: StorageBackend, container_name: str, blob_name: str
+) -> Optional[bytes]:
+    """Pobiera blob do pamięci (bez zapisu na dysk). Zwraca None w przypadku błędu."""
+    try:
+        return storage.read_bytes(container_name, blob_name)
+    except Exception as e:
+        print(f"  Błąd pobierania {blob_name}: {e}", file=sys.stderr)
+        return None
+
+
+def read_archive_label_sizes(
+    zip_bytes: bytes, class_names_file: str
+) -> tuple[Optional[list[str]], dict[str, int]]:
+    """Odczytuje z archiwum w pamięci nazwy klas i rozmiary etykiet {ścieżka_w_archiwum: bajty}, bez rozpakowywania."""
+    class_names = None
+    label_sizes = {}
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_ref:
+        for info in zip_ref.infolist():
+            relative_path = info.filename.replace("\\", "/")
+            if relative_path == class_names_file:
+                text = zip_ref.read(info).decode("utf-8")
+                class_names = [
+                    line.strip() for line in text.splitlines() if line.strip()
+                ] or None
+                continue
+            file_name = os.path.basename(relative_path).lower()
+            if file_name.endswith(".txt") and file_name not in ["train.txt", "val.txt"]:
+                label_sizes[relative_path] = info.file_size
+    return class_names, label_sizes
+
+
+def print_organize_plan(
+    storage: StorageBackend,
+    container_name: str,
+    annotation_blobs: list[str],
+    dataset_base_dir: str,
+    path_mapping: dict[str, str],
+    stem_index: dict[str, Optional[str]],
+    zip_base_structure: Optional[str],
+    class_names_file: str,
+    cache_dir: Optional[str],
+):
+    """
+    Wypisuje plan organizacji etykiet (tryb --plan): pokrycie obrazów z mapowania etykietami,
+    etykiety bez mapowania/obrazu, uzgodnienie klas i wymagane miejsce. Niczego nie zapisuje -
+    archiwa są czytane w pamięci albo z cache.
+    """
+    train_images = list_local_files(os.path.join(dataset_base_dir, "images", "train"))
+    valid_images = list_local_files(os.path.join(dataset_base_dir, "images", "valid"))
+    class_names = []
+    labeled_images = set()
+    counts = {"train": 0, "valid": 0, "no_map": 0, "ambiguous": 0, "no_image": 0}
+    label_bytes = 0
+    archive_bytes = 0
+
+    for blob_name in annotation_blobs:
+        print(f"\n--- Plan dla archiwum: {blob_name} ---")
+        cached = None
+        if cache_dir:
+            etag = get_blob_etag(storage, container_name, blob_name)
+            if etag:
+                cached = load_cached_annotations(
+                    cache_dir, "yolo", container_name, blob_name, etag, touch=False
+                )
+        if cached is not None:
+            archive_class_names = cached["class_names"]
+            label_sizes = {
+                relative_path: len(content)
+                for relative_path, content in decode_cached_labels(cached).items()
+            }
+        else:
+            zip_bytes = download_blob_bytes(storage, container_name, blob_name)
+            if zip_bytes is None:
+                continue
+            archive_bytes += len(zip_bytes)
+            try:
+                archive_class_names, label_sizes = read_archive_label_sizes(
+                    zip_bytes, class_names_file
+                )
+            except zipfile.BadZipFile:
+                print(f"  Błąd: '{blob_name}' nie jest poprawnym plikiem ZIP.")
+                continue
+
+        if archive_class_names:
+            merge_class_names(class_names, archive_class_names, blob_name)
+        else:
+            print(f"  Konflikt klas: brak '{class_names_file}' w {blob_name}.")
+
+        stems = derive_label_stems(list(label_sizes), zip_base_structure)
+        for size, stem in zip(label_sizes.values(), stems):
+            flat_filename = stem_index.get(stem)
+            if not flat_filename:
+                counts["ambiguous" if stem in stem_index else "no_map"] += 1
+                continue
+            if flat_filename in train_images:
+                counts["train"] += 1
+            elif flat_filename in valid_images:
+                counts["valid"] += 1
+            else:
+                counts["no_image"] += 1
+                continue
+            labeled_images.add(flat_filename)
+            label_bytes += size
+        print(f"  Etykiet w archiwum: {len(label_sizes)}")
+
+    mapped_images = set(path_mapping.values())
+    coverage = len(labeled_images) / len(mapped_images) * 100 if mapped_images else 0.0
+    free_bytes = shutil.disk_usage(os.path.abspath(dataset_base_dir)).free
+    kb = 1024
+    print("\n=== Plan organizacji etykiet (bez zapisu) ===")
+    print(f"  Etykiety do labels/train: {counts['train']}")
+    print(f"  Etykiety do labels/valid: {counts['valid']}")
+    print(f"  Etykiety bez wpisu w mapowaniu: {counts['no_map']}")
+    if counts["ambiguous"]:
+        print(
+            f"  Etykiety niejednoznaczne (kilka obrazów o tej samej ścieżce bez rozszerzenia): {counts['ambiguous']}"
+        )
+    print(f"  Etykiety bez lokalnego obrazu: {counts['no_image']}")
+    print(
+        f"  Pokrycie mapowania etykietami: {len(labeled_images)}/{len(mapped_images)} obrazów ({coverage:.1f}%)"
+    )
+    print(f"  Obrazy bez etykiety: {len(mapped_images - labeled_images)}")
+    if class_names:
+        print(f"  Wspólna lista {len(class_names)} klas: {', '.join(class_names)}")
+    print(f"  Pobrano do pamięci archiwów: {archive_bytes / (kb * kb):.1f} MB")
+    print(
+        f"  Wymagane miejsce na dysku (etykiety): {label_bytes / (kb * kb):.1f} MB (wolne: {free_bytes / (kb * kb):.1f} MB)"
     )
-    return copied_train_count, copied_valid_count, skipped_count
 
 
 # --- NOWA Funkcja do odczytu klas z obj.names ---
@@ -194,10 +1039,21 @@ def read_class_names_from_obj_names(obj_names_path: str) -> Optional[list[str]]:
         return None
 
 
-# --- Funkcja create_yolo_config_files - bez zmian w logice, tylko przyjmuje class_names ---
-def create_yolo_config_files(dataset_base_dir: str, class_names: list[str]):
-    """Tworzy pliki train.txt, val.txt i dataset.yaml."""
-    # (Skopiuj tę funkcję z poprzedniej odpowiedzi - działa poprawnie)
+# --- Funkcja create_yolo_config_files - listy generowane z indeksu datasetu ---
+def create_yolo_config_files(
+    dataset_base_dir: str,
+    class_names: list[str],
+    exclude_unlabeled: bool = False,
+    exclude_quarantined: bool = True,
+    rebuild_lists: bool = False,
+    write_manifest: bool = True,
+):
+    """
+    Tworzy pliki train.txt, val.txt i dataset.yaml, a na końcu manifest datasetu
+    (rozmiary i SHA-256 plików do weryfikacji kopii, jeśli write_manifest).
+    Listy są generowane z dataset_index.tsv (tworzonego ze struktury katalogów, jeśli go brak)
+    i aktualizowane przyrostowo, gdy od ostatniej regeneracji zmieniło się niewiele wpisów.
+    """
     print("\n--- Tworzenie plików konfiguracyjnych YOLO ---")
     train_img_dir = os.path.join(dataset_base_dir, "images", "train")
     valid_img_dir = os.path.join(dataset_base_dir, "images", "valid")
@@ -212,38 +1068,44 @@ def create_yolo_config_files(dataset_base_dir: str, class_names: list[str]):
         print(f"Ostrzeżenie: Brak '{valid_img_dir}'.", file=sys.stderr)
         return False
 
-    try:  # Generuj train.txt
-        print(f"Generowanie {train_txt_path}...")
-        train_image_files = [
-            os.path.join("images", "train", f).replace("\\", "/")
-            for f in os.listdir(train_img_dir)
-            if os.path.isfile(os.path.join(train_img_dir, f))
-        ]
-        with open(train_txt_path, "w", encoding="utf-8") as f:
-            f.write("\n".join(train_image_files) + "\n")
-        print(f"Zapisano {len(train_image_files)} ścieżek do {train_txt_path}")
-    except Exception as e:
-        print(f"Błąd generowania {train_txt_path}: {e}", file=sys.stderr)
-        return False
-
-    try:  # Generuj val.txt
-        print(f"Generowanie {valid_txt_path}...")
-        valid_image_files = [
-            os.path.join("images", "valid", f).replace("\\", "/")
-            for f in os.listdir(valid_img_dir)
-            if os.path.isfile(os.path.join(valid_img_dir, f))
-        ]
-        with open(valid_txt_path, "w", encoding="utf-8") as f:
-            f.write("\n".join(valid_image_files) + "\n")
-        print(f"Zapisano {len(valid_image_files)} ścieżek do {valid_txt_path}")
+    try:  # Generuj train.txt i val.txt z indeksu datasetu
+        entries = read_dataset_index(dataset_base_dir)
+        if entries is None:
+            print(
+                f"Brak {INDEX_FILENAME} - budowanie indeksu ze struktury katalogów..."
+            )
+            entries = scan_split_dirs(dataset_base_dir)
+            write_dataset_index(dataset_base_dir, entries)
+            rebuild_lists = True
+        else:
+            changed_images = refresh_label_flags(dataset_base_dir, entries)
+            if changed_images:
+                write_dataset_index(dataset_base_dir, entries, changed_images)
+        written = write_split_lists(
+            dataset_base_dir,
+            entries,
+            exclude_unlabeled=exclude_unlabeled,
+            exclude_quarantined=exclude_quarantined,
+            rebuild=rebuild_lists,
+        )
+        for split, list_path in (("train", train_txt_path), ("valid", valid_txt_path)):
+            if written[split] < 0:
+                print(f"{list_path} jest aktualny (brak zmian w indeksie).")
+            else:
+                print(f"Zapisano {written[split]} ścieżek do {list_path}")
     except Exception as e:
-        print(f"Błąd generowania {valid_txt_path}: {e}", file=sys.stderr)
+        print(
+            f"Błąd generowania {train_txt_path} / {valid_txt_path}: {e}",
+            file=sys.stderr,
+        )
         return False
 
     if not class_names:
         print("Błąd: Brak nazw klas dla dataset.yaml.", file=sys.stderr)
         return False
 
+    import yaml  # Potrzebne do zapisu pliku YAML
+
     yaml_data = {  # Generuj dataset.yaml
         "path": os.path.abspath(dataset_base_dir).replace("\\", "/"),
         "train": "train.txt",
@@ -253,7 +1115,9 @@ def create_yolo_config_files(dataset_base_dir: str, class_names: list[str]):
     }
     try:
         print(f"Generowanie {yaml_path}...")
-        with open(yaml_path, "w", encoding="utf-8") as f:
+        # Zapis atomowy: trening czytający dataset.yaml nigdy nie widzi połowy pliku
+        tmp_path = yaml_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             yaml.dump(
                 yaml_data,
                 f,
@@ -261,31 +1125,73 @@ def create_yolo_config_files(dataset_base_dir: str, class_names: list[str]):
                 default_flow_style=None,
                 allow_unicode=True,
             )
+        os.replace(tmp_path, yaml_path)
         print(f"Zapisano konfigurację do {yaml_path}")
     except Exception as e:
         print(f"Błąd generowania {yaml_path}: {e}", file=sys.stderr)
         return False
+    if write_manifest and not write_dataset_manifest(dataset_base_dir):
+        return False
 
     print("--- Zakończono tworzenie plików konfiguracyjnych ---")
     return True
 
 
+def read_class_names_from_dataset_yaml(yaml_path: str) -> Optional[list[str]]:
+    """Odczytuje listę 'names' z istniejącego pliku dataset.yaml."""
+    import yaml
+
+    try:
+        with open(yaml_path, "r", encoding="utf-8") as f:
+            names = (yaml.safe_load(f) or {}).get("names")
+    except FileNotFoundError:
+        print(f"  Ostrzeżenie: Brak pliku '{yaml_path}'.", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"  Błąd odczytu '{yaml_path}': {e}", file=sys.stderr)
+        return None
+    if isinstance(names, dict):  # Format {id: nazwa}
+        names = [names[key] for key in sorted(names)]
+    return [str(name) for name in names] if names else None
+
+
+def regenerate_config_files(args) -> bool:
+    """Tryb --config-only: regeneruje pliki konfiguracyjne YOLO wyłącznie z danych lokalnych."""
+    if args.local_class_names:
+        class_names = read_class_names_from_obj_names(args.local_class_names)
+    else:
+        class_names = read_class_names_from_dataset_yaml(
+            os.path.join(args.dataset_dir, "dataset.yaml")
+        )
+    if not class_names:
+        print(
+            "Błąd: Brak nazw klas (podaj --local-class-names lub utwórz dataset.yaml).",
+            file=sys.stderr,
+        )
+        return False
+    return create_yolo_config_files(
+        args.dataset_dir,
+        class_names,
+        exclude_unlabeled=args.exclude_unlabeled,
+        exclude_quarantined=not args.include_quarantined,
+        rebuild_lists=args.rebuild_lists,
+        write_manifest=not args.no_manifest,
+    )
+
+
 # --- Główna funkcja main() - zmodyfikowana logika pobierania klas ---
 def main():
-    load_dotenv()
-
     parser = argparse.ArgumentParser(
         description="Pobiera ZIPy YOLO, organizuje etykiety (z poprawnymi nazwami), tworzy pliki konfiguracyjne (używając obj.names)."
     )
     parser.add_argument("--connect-str", help="Ciąg połączenia Azure (nadpisuje .env).")
     parser.add_argument(
-        "--container-name", required=True, help="Nazwa kontenera Azure."
+        "--container-name", help="Nazwa kontenera Azure (wymagane poza --config-only)."
     )
     parser.add_argument(
         "--annotation-blobs",
-        required=True,
         nargs="+",
-        help="Nazwy plików ZIP z adnotacjami YOLO.",
+        help="Nazwy plików ZIP z adnotacjami YOLO (wymagane poza --config-only).",
     )
     parser.add_argument(
         "--dataset-dir",
@@ -293,12 +1199,32 @@ def main():
         help="Ścieżka do folderu datasetu (z images/ i mapowaniem).",
     )
     parser.add_argument(
-        "--mapping-file", required=True, help="Ścieżka do pliku JSON z mapowaniem nazw."
+        "--mapping-file",
+        help="Ścieżka do pliku JSON z mapowaniem nazw (wymagane poza --config-only).",
     )
     parser.add_argument(
         "--image-ext",
         default="jpeg",
-        help="Rozszerzenie obrazów (bez kropki, domyślnie: 'jpeg').",
+        help="Etykiety są dopasowywane do obrazów niezależnie od rozszerzenia; to rozszerzenie (bez kropki, domyślnie: 'jpeg') rozstrzyga, gdy w mapowaniu jest kilka obrazów o tej samej ścieżce bez rozszerzenia.",
+    )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="Nie twórz manifestu datasetu (dataset_manifest.tsv z rozmiarami i SHA-256 plików do weryfikacji kopii).",
+    )
+    parser.add_argument(
+        "--label-workers",
+        type=int,
+        default=DEFAULT_LABEL_WORKERS,
+        help=f"Liczba wątków zapisujących etykiety (domyślnie: {DEFAULT_LABEL_WORKERS}).",
+    )
+    parser.add_argument(
+        "--label-stats-file",
+        help="Zapisuje histogramy klas z zapisanych etykiet (po przepisaniu id i usunięciu linii z błędnym id) do pliku TSV w formacie find_images_to_train.py --label-stats-file (np. dla prepare_yolo_dataset.py --split-mode stratified).",
+    )
+    parser.add_argument(
+        "--label-stats",
+        help="Plik TSV z histogramami klas z XML (find_images_to_train.py --label-stats-file) do uzgodnienia z zapisanymi etykietami; różnice są raportowane.",
     )
     parser.add_argument(
         "--zip-base-structure",
@@ -312,7 +1238,89 @@ def main():
         help="Nazwa pliku wewnątrz archiwum ZIP, z którego mają być odczytane nazwy klas (domyślnie: obj.names).",
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Folder lokalnego cache sparsowanych archiwów (klucz: kontener, blob, ETag; domyślnie: {DEFAULT_CACHE_DIR}).",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_CACHE_MAX_MB,
+        help=f"Maksymalny rozmiar cache w MB; najdawniej używane wpisy są usuwane (domyślnie: {DEFAULT_CACHE_MAX_MB}).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Wyłącza cache - każde archiwum jest pobierane i parsowane od nowa.",
+    )
+
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Tryb planowania: czyta archiwa w pamięci (lub z cache) i wypisuje pokrycie mapowania etykietami, konflikty klas i wymagane miejsce. Niczego nie zapisuje.",
+    )
+
+    parser.add_argument(
+        "--config-only",
+        action="store_true",
+        help="Tylko lokalnie regeneruje train.txt, val.txt i dataset.yaml (bez Azure). Nazwy klas z --local-class-names lub z istniejącego dataset.yaml.",
+    )
+    parser.add_argument(
+        "--local-class-names",
+        help="(Tryb --config-only) Lokalny plik z nazwami klas, np. obj.names.",
+    )
+    parser.add_argument(
+        "--exclude-unlabeled",
+        action="store_true",
+        help="Pomija w train.txt/val.txt obrazy bez pliku etykiet.",
+    )
+    parser.add_argument(
+        "--include-quarantined",
+        action="store_true",
+        help="Uwzględnia w train.txt/val.txt obrazy ze statusem 'quarantined' w dataset_index.tsv.",
+    )
+    parser.add_argument(
+        "--rebuild-lists",
+        action="store_true",
+        help="Wymusza pełną regenerację train.txt/val.txt z indeksu (np. po ręcznej edycji dataset_index.tsv).",
+    )
+
+    add_source_arguments(parser)
+    add_transfer_arguments(parser, default_workers=None)
+    add_progress_arguments(parser)
+
     args = parser.parse_args()
+    try:
+        configure_transfer(args)
+        configure_progress(args)
+    except (ValueError, OSError) as e:
+        print(f"Błąd: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.label_workers < 1:
+        print("Błąd: --label-workers musi być dodatnie.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.config_only:
+        # Tryb czysto lokalny - nie ładuje SDK Azure ani dotenv
+        sys.exit(0 if regenerate_config_files(args) else 1)
+    missing_args = [
+        option
+        for option, value in (
+            ("--container-name", args.container_name),
+            ("--annotation-blobs", args.annotation_blobs),
+            ("--mapping-file", args.mapping_file),
+        )
+        if not value
+    ]
+    if missing_args:
+        parser.error(f"wymagane argumenty: {', '.join(missing_args)}")
+
+    # Import leniwy: --help i błędy argumentów nie ładują zależności
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    cache_dir = None if args.no_cache else args.cache_dir
 
     # Wczytanie connection string i mapowania (bez zmian)
     connect_str = (
@@ -320,8 +1328,7 @@ def main():
         if args.connect_str
         else os.getenv("AZURE_STORAGE_CONNECTION_STRING")
     )
-    if not connect_str:
-        sys.exit("Błąd: Brak ciągu połączenia.")
+    storage = create_storage_backend(args, connect_str)
     if not os.path.isdir(args.dataset_dir):
         sys.exit(f"Błąd: Folder '{args.dataset_dir}' nie istnieje.")
     if not os.path.isdir(
@@ -335,12 +1342,38 @@ def main():
             full_path_map = json.load(f)
     except Exception as e:
         sys.exit(f"Błąd wczytywania mapowania '{args.mapping_file}': {e}")
+    xml_label_stats = read_label_stats(args.label_stats) if args.label_stats else None
+    stem_index, ambiguous_stems = build_stem_index(full_path_map, args.image_ext)
+    report_ambiguous_stems(stem_index, ambiguous_stems)
+
+    if args.plan:
+        print_organize_plan(
+            storage,
+            args.container_name,
+            args.annotation_blobs,
+            args.dataset_dir,
+            full_path_map,
+            stem_index,
+            args.zip_base_structure if args.zip_base_structure else None,
+            args.class_names_file,
+            cache_dir,
+        )
+        return
 
     # Zmienne do śledzenia
     total_copied_train, total_copied_valid, total_skipped = 0, 0, 0
     total_processed_zip, total_errors_zip = 0, 0
-    class_names = None  # Lista klas odczytana z pliku
-    class_names_source_file = None  # Zapamiętamy, skąd wzięliśmy klasy
+    total_invalid_lines = 0
+    class_names = []  # Wspólna lista klas uzgodniona ze wszystkich archiwów
+    class_names_source_files = []  # Zapamiętamy, skąd wzięliśmy klasy
+    label_stats_file = None
+    if args.label_stats_file:
+        try:
+            label_stats_file = open(args.label_stats_file, "w", encoding="utf-8")
+        except OSError as e:
+            sys.exit(f"Błąd tworzenia pliku statystyk '{args.label_stats_file}': {e}")
+    label_stats = WrittenLabelStats(class_names, label_stats_file, xml_label_stats)
+    label_claims = LabelClaims(stem_index)
 
     # Folder tymczasowy
     timestamp = time.strftime("%Y%m%d-%H%M%S")
@@ -355,54 +1388,100 @@ def main():
     try:
         for blob_name in args.annotation_blobs:
             print(f"\n--- Przetwarzanie archiwum: {blob_name} ---")
-            safe_blob_name = os.path.basename(blob_name)
-            download_path = os.path.join(download_dir, safe_blob_name)
-            extract_dir_name = safe_blob_name.replace(".zip", "")
-            extract_path = os.path.join(
-                extract_base_dir, extract_dir_name
-            )  # Unikalny folder
-
-            if not download_blob_sync(
-                connect_str, args.container_name, blob_name, download_path
-            ):
-                total_errors_zip += 1
-                continue
-            if not unzip_file(download_path, extract_path):
-                total_errors_zip += 1
-                continue
+            # Sprawdź cache (jedno zapytanie HEAD o ETag)
+            etag = None
+            cached = None
+            if cache_dir:
+                etag = get_blob_etag(storage, args.container_name, blob_name)
+                if etag:
+                    cached = load_cached_annotations(
+                        cache_dir, "yolo", args.container_name, blob_name, etag
+                    )
+
+            source_txt_files, extract_path, label_contents = [], "", None
+            if cached is not None:
+                archive_class_names = cached["class_names"]
+                label_contents = decode_cached_labels(cached)
+            else:
+                safe_blob_name = os.path.basename(blob_name)
+                download_path = os.path.join(download_dir, safe_blob_name)
+                extract_dir_name = safe_blob_name.replace(".zip", "")
+                extract_path = os.path.join(
+                    extract_base_dir, extract_dir_name
+                )  # Unikalny folder
+
+                if not download_blob_sync(
+                    storage, args.container_name, blob_name, download_path
+                ):
+                    total_errors_zip += 1
+                    continue
+                if not unzip_file(download_path, extract_path):
+                    total_errors_zip += 1
+                    continue
 
-            # --- Odczyt nazw klas (tylko raz, z pierwszego udanego pliku obj.names) ---
-            if class_names is None:
                 # Szukamy pliku np. obj.names w głównym folderze rozpakowanego ZIPa
                 obj_names_path_in_zip = os.path.join(
                     extract_path, args.class_names_file
                 )
-                class_names = read_class_names_from_obj_names(obj_names_path_in_zip)
-                if class_names:
-                    class_names_source_file = f"{blob_name}/{args.class_names_file}"
-                # else: # Komunikat o braku pliku jest już w read_class_names_from_obj_names
-
-            # Znajdź i zorganizuj pliki .txt (etykiety)
-            source_txt_files = find_all_txt_files(extract_path)
-            if not source_txt_files:
-                print(
-                    f"  Ostrzeżenie: Nie znaleziono plików etykiet .txt w {blob_name}."
+                archive_class_names = read_class_names_from_obj_names(
+                    obj_names_path_in_zip
                 )
+                source_txt_files = find_all_txt_files(extract_path)
+                if etag:
+                    # Treść etykiet trafia do cache i od razu jest używana do organizacji
+                    label_contents = read_label_files(source_txt_files, extract_path)
+                    store_cached_annotations(
+                        cache_dir,
+                        "yolo",
+                        args.container_name,
+                        blob_name,
+                        etag,
+                        encode_cached_labels(archive_class_names, label_contents),
+                        args.cache_max_mb * 1024 * 1024,
+                    )
+
+            # --- Uzgodnienie nazw klas archiwum ze wspólną listą ---
+            class_remap = None
+            if archive_class_names:
+                class_remap = merge_class_names(
+                    class_names, archive_class_names, blob_name
+                )
+                class_names_source_files.append(f"{blob_name}/{args.class_names_file}")
             else:
                 print(
-                    f"  Znaleziono {len(source_txt_files)} plików .txt do organizacji."
+                    f"  Konflikt klas: brak '{args.class_names_file}' w {blob_name}. Id klas w etykietach tego archiwum zostaną skopiowane bez zmian.",
+                    file=sys.stderr,
                 )
-                copied_train, copied_valid, skipped = organize_labels(
+
+            # Zorganizuj pliki .txt (etykiety)
+            label_count = (
+                len(label_contents)
+                if label_contents is not None
+                else len(source_txt_files)
+            )
+            if not label_count:
+                print(
+                    f"  Ostrzeżenie: Nie znaleziono plików etykiet .txt w {blob_name}."
+                )
+            else:
+                print(f"  Znaleziono {label_count} plików .txt do organizacji.")
+                copied_train, copied_valid, skipped, invalid_lines = organize_labels(
                     source_txt_files,
                     extract_path,
                     args.dataset_dir,
-                    full_path_map,
-                    args.image_ext,
+                    stem_index,
                     args.zip_base_structure if args.zip_base_structure else None,
+                    class_remap,
+                    label_contents,
+                    args.label_workers,
+                    label_stats,
+                    label_claims,
+                    blob_name,
                 )
                 total_copied_train += copied_train
                 total_copied_valid += copied_valid
                 total_skipped += skipped
+                total_invalid_lines += invalid_lines
 
             total_processed_zip += 1
             print(f"--- Zakończono przetwarzanie archiwum: {blob_name} ---")
@@ -416,10 +1495,26 @@ def main():
         print(f"  Skopiowano do labels/train: {total_copied_train}")
         print(f"  Skopiowano do labels/valid: {total_copied_valid}")
         print(f"  Pominięto etykiet: {total_skipped}")
+        if total_invalid_lines:
+            print(f"  Usunięto linii z błędnym id klasy: {total_invalid_lines}")
+        label_claims.report()
+        label_stats.report()
+        if label_stats_file is not None:
+            print(f"Statystyki klas zapisanych etykiet: {args.label_stats_file}")
 
         if class_names:
-            print(f"\nNazwy klas zostały odczytane z pliku: {class_names_source_file}")
-            config_success = create_yolo_config_files(args.dataset_dir, class_names)
+            print(
+                f"\nNazwy klas zostały uzgodnione z plików: {', '.join(class_names_source_files)}"
+            )
+            print(f"Wspólna lista {len(class_names)} klas: {', '.join(class_names)}")
+            config_success = create_yolo_config_files(
+                args.dataset_dir,
+                class_names,
+                exclude_unlabeled=args.exclude_unlabeled,
+                exclude_quarantined=not args.include_quarantined,
+                rebuild_lists=args.rebuild_lists,
+                write_manifest=not args.no_manifest,
+            )
             if config_success:
                 print(
                     f"\nDataset w '{args.dataset_dir}' jest gotowy do użycia w treningu YOLO."
@@ -440,6 +1535,8 @@ def main():
             )
 
     finally:
+        if label_stats_file is not None:
+            label_stats_file.close()
         # Sprzątanie
         print("\nSprzątanie plików tymczasowych...")
         try:
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""Wspólne narzędzia do przetwarzania w puli wątków (bez zależności od skryptów CLI)."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+
+def ordered_thread_map(fn, items: Iterable, workers: int) -> Iterator:
+    """Jak ThreadPoolExecutor.map, ale z ograniczonym oknem zadań (nie konsumuje całego iteratora z góry)."""
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    window = workers * 4
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
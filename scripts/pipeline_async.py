@@ -0,0 +1,708 @@
+# -*- coding: utf-8 -*-
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import zipfile
+import argparse
+import tempfile
+from typing import Optional
+from find_images_to_train import iter_training_images_from_xml
+from image_selection import load_rules
+from azure_clients import add_transfer_arguments, configure_transfer
+from storage_backends import (
+    StorageBackend,
+    BlobNotFoundError,
+    ChecksumMismatchError,
+    add_source_arguments,
+    create_storage_backend,
+    write_file_atomic,
+)
+from dataset_index import (
+    STATUS_OK,
+    IndexEntry,
+    read_dataset_index,
+    write_dataset_index,
+    merge_index_entries,
+)
+from prepare_yolo_dataset import flatten_azure_path, assign_split
+from organize_yolo_labels import (
+    merge_class_names,
+    remap_label_contents,
+    create_yolo_config_files,
+)
+
+# Znacznik końca strumienia w kolejkach
+END_OF_STREAM = None
+DEFAULT_LABEL_MEMORY_MB = 64
+
+
+class PipelineStats:
+    """Liczniki i czasy etapów potoku (do podsumowania)."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_sample_at = None
+        self.names_produced = 0
+        self.downloaded = 0
+        self.already_present = 0
+        self.not_found = 0
+        self.download_errors = 0
+        self.checksum_errors = 0
+        self.bytes_downloaded = 0
+        self.placed_with_label = 0
+        self.placed_without_label = 0
+        self.verify_failed = 0
+        self.invalid_label_lines = 0
+        # Etykiety pominięte, bo obraz ma już etykietę z wcześniejszego archiwum (+ przykłady)
+        self.label_conflicts = 0
+        self.label_conflict_examples = []
+        self.labels_spilled = 0
+        self.failed_archives = []
+        self.stage_busy = {"xml": 0.0, "labels": 0.0, "download": 0.0, "place": 0.0}
+
+
+def load_yolo_archive(
+    zip_bytes: bytes, class_names_file: str, zip_base_structure: Optional[str]
+) -> tuple[Optional[list[str]], dict[str, bytes]]:
+    """
+    Odczytuje archiwum YOLO z pamięci: (nazwy klas, {ścieżka_azure_bez_rozszerzenia: treść_etykiety}).
+    """
+    prefix_to_remove = (
+        zip_base_structure.replace("\\", "/").strip("/") + "/"
+        if zip_base_structure
+        else ""
+    )
+    class_names = None
+    labels = {}
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_ref:
+        for member in zip_ref.namelist():
+            relative_path = member.replace("\\", "/")
+            if relative_path == class_names_file:
+                text = zip_ref.read(member).decode("utf-8")
+                class_names = [
+                    line.strip() for line in text.splitlines() if line.strip()
+                ] or None
+                continue
+            base_name = os.path.basename(relative_path).lower()
+            if not base_name.endswith(".txt") or base_name in ("train.txt", "val.txt"):
+                continue
+            if prefix_to_remove and relative_path.startswith(prefix_to_remove):
+                relative_path = relative_path[len(prefix_to_remove) :]
+            labels[os.path.splitext(relative_path)[0]] = zip_ref.read(member)
+    return class_names, labels
+
+
+class LabelStore:
+    """
+    Etykiety czekające na swoje obrazy ({ścieżka_azure_bez_rozszerzenia: treść}). Treści są trzymane
+    w pamięci do budżetu memory_budget_bytes, nadmiar trafia do pliku tymczasowego (w pamięci
+    zostaje tylko offset). pop zwalnia wpis, więc rozmiar zależy od etykiet jeszcze nieużytych.
+    """
+
+    def __init__(self, memory_budget_bytes: int, tmp_dir: Optional[str] = None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.tmp_dir = tmp_dir
+        self.in_memory = {}
+        self.memory_bytes = 0
+        self.spilled = {}
+        self.spill_file = None
+        self.spilled_count = 0
+
+    def __len__(self) -> int:
+        return len(self.in_memory) + len(self.spilled)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.in_memory or key in self.spilled
+
+    def put(self, key: str, content: bytes):
+        """Zapamiętuje etykietę (nadpisuje wcześniejszą o tym samym kluczu)."""
+        old = self.in_memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= len(old)
+        self.spilled.pop(key, None)
+        if self.memory_bytes + len(content) <= self.memory_budget_bytes:
+            self.in_memory[key] = content
+            self.memory_bytes += len(content)
+            return
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="labels_", dir=self.tmp_dir)
+        offset = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(content)
+        self.spilled[key] = (offset, len(content))
+        self.spilled_count += 1
+
+    def pop(self, key: str) -> Optional[bytes]:
+        """Zwraca i usuwa etykietę lub None, jeśli jej nie ma."""
+        content = self.in_memory.pop(key, None)
+        if content is not None:
+            self.memory_bytes -= len(content)
+            return content
+        location = self.spilled.pop(key, None)
+        if location is None:
+            return None
+        offset, length = location
+        self.spill_file.seek(offset)
+        return self.spill_file.read(length)
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+def label_path_for(args, split: str, flat_filename: str) -> str:
+    return os.path.join(
+        args.dataset_name,
+        "labels",
+        split,
+        os.path.splitext(flat_filename)[0] + ".txt",
+    )
+
+
+def mark_sample_ready(stats: PipelineStats, flat_filename: str):
+    if stats.first_sample_at is None:
+        stats.first_sample_at = time.monotonic()
+        print(
+            f"  Pierwsza gotowa próbka po {stats.first_sample_at - stats.started:.2f} s: {flat_filename}"
+        )
+
+
+async def load_labels(
+    storage: StorageBackend,
+    args,
+    class_names: list[str],
+    label_store: LabelStore,
+    label_lock: asyncio.Lock,
+    placed: dict[str, tuple[str, str]],
+    labels_loaded: asyncio.Event,
+    index_entries: dict[str, IndexEntry],
+    stats: PipelineStats,
+):
+    """
+    Etap etykiet: pobiera archiwa YOLO i uzgadnia klasy. Po wczytaniu każdego archiwum etykiety
+    obrazów już umieszczonych (placed) są od razu zapisywane, a pozostałe trafiają do label_store,
+    skąd odbiera je etap umieszczania - obraz czeka tylko na archiwum ze swoją etykietą.
+    Przy etykiecie obecnej w kilku archiwach wygrywa pierwsze archiwum z --yolo-blobs (kolejne
+    są pomijane i liczone w stats.label_conflicts).
+    """
+
+    def write_labels(targets: list[tuple[str, str, bytes]]):
+        for split, flat_filename, content in targets:
+            write_file_atomic(label_path_for(args, split, flat_filename), content)
+
+    try:
+        for blob_name in args.yolo_blobs:
+            started = time.monotonic()
+            try:
+                zip_bytes = await storage.read_bytes_async(
+                    args.container_name, blob_name
+                )
+                archive_class_names, labels = await asyncio.to_thread(
+                    load_yolo_archive,
+                    zip_bytes,
+                    args.class_names_file,
+                    args.zip_base_structure or None,
+                )
+            except Exception as e:
+                print(
+                    f"  Błąd wczytywania archiwum YOLO '{blob_name}': {e}",
+                    file=sys.stderr,
+                )
+                stats.failed_archives.append(blob_name)
+                continue
+            if archive_class_names:
+                class_remap = merge_class_names(
+                    class_names, archive_class_names, blob_name
+                )
+                # Także przy identycznej kolejności klas: usuwa linie z id spoza obj.names
+                new_contents, invalid_lines = await asyncio.to_thread(
+                    remap_label_contents, list(labels.values()), class_remap
+                )
+                labels = dict(zip(labels, new_contents))
+                stats.invalid_label_lines += invalid_lines
+            else:
+                print(
+                    f"  Konflikt klas: brak '{args.class_names_file}' w {blob_name}. Id klas skopiowane bez zmian.",
+                    file=sys.stderr,
+                )
+            async with label_lock:
+                # Ten sam obraz w kilku archiwach: wygrywa pierwsze archiwum z --yolo-blobs
+                targets = []
+                for key, content in labels.items():
+                    target = placed.get(key)
+                    if target is not None and not index_entries[target[1]][1]:
+                        targets.append((*target, content))
+                    elif target is not None or key in label_store:
+                        stats.label_conflicts += 1
+                        if len(stats.label_conflict_examples) < 5:
+                            stats.label_conflict_examples.append((blob_name, key))
+                    else:
+                        label_store.put(key, content)
+                labels = None
+                try:
+                    await asyncio.to_thread(write_labels, targets)
+                except OSError as e:
+                    print(
+                        f"\n  Błąd zapisu etykiet z archiwum '{blob_name}': {e}",
+                        file=sys.stderr,
+                    )
+                    targets = []
+                for split, flat_filename, _ in targets:
+                    if not index_entries[flat_filename][1]:
+                        index_entries[flat_filename] = (split, True, STATUS_OK)
+                        stats.placed_with_label += 1
+                        mark_sample_ready(stats, flat_filename)
+            stats.labels_spilled = label_store.spilled_count
+            stats.stage_busy["labels"] += time.monotonic() - started
+            print(
+                f"  Wczytano etykiety z archiwum '{blob_name}': {len(targets)} dla już pobranych obrazów, oczekujących: {len(label_store)}."
+            )
+    finally:
+        labels_loaded.set()
+        placed.clear()
+
+
+async def produce_image_names(
+    storage: StorageBackend,
+    args,
+    download_queue: asyncio.Queue,
+    stats: PipelineStats,
+):
+    """
+    Etap XML: strumieniowo parsuje archiwa CVAT i wrzuca unikalne nazwy obrazów do kolejki (z backpressure).
+    Ograniczenie: zbiór już widzianych nazw (seen) rośnie liniowo z liczbą obrazów - deduplikacja
+    przez sortowanie zewnętrzne wstrzymałaby pierwsze pobranie do końca parsowania wszystkich XML.
+    """
+    loop = asyncio.get_running_loop()
+    seen = set()
+    rule_errors = [0] * len(args.rules)
+
+    def parse_into_queue(zip_bytes: bytes, blob_name: str):
+        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_ref:
+            xml_members = [m for m in zip_ref.namelist() if m.lower().endswith(".xml")]
+            if not xml_members:
+                print(
+                    f"  Ostrzeżenie: Brak pliku XML w '{blob_name}'.", file=sys.stderr
+                )
+                return
+            with zip_ref.open(xml_members[0]) as xml_stream:
+                for image_name in iter_training_images_from_xml(
+                    xml_stream, args.rules, rule_errors
+                ):
+                    if image_name in seen:
+                        continue
+                    seen.add(image_name)
+                    stats.names_produced += 1
+                    # Blokuje wątek parsera, gdy kolejka pobierania jest pełna
+                    asyncio.run_coroutine_threadsafe(
+                        download_queue.put(image_name), loop
+                    ).result()
+
+    for blob_name in args.xml_blobs:
+        started = time.monotonic()
+        try:
+            zip_bytes = await storage.read_bytes_async(args.container_name, blob_name)
+            await asyncio.to_thread(parse_into_queue, zip_bytes, blob_name)
+        except Exception as e:
+            print(
+                f"  Błąd przetwarzania archiwum XML '{blob_name}': {e}", file=sys.stderr
+            )
+            stats.failed_archives.append(blob_name)
+        stats.stage_busy["xml"] += time.monotonic() - started
+    if any(rule_errors):
+        print(
+            "  Ostrzeżenie: błędy obliczenia reguł (obraz nie spełnia wtedy reguły): "
+            + ", ".join(
+                f"{rule.name}={errors}"
+                for rule, errors in zip(args.rules, rule_errors)
+                if errors
+            ),
+            file=sys.stderr,
+        )
+
+
+async def download_worker(
+    storage: StorageBackend,
+    args,
+    download_queue: asyncio.Queue,
+    place_queue: asyncio.Queue,
+    stats: PipelineStats,
+):
+    """Etap pobierania: pobiera obraz (lokalny mirror: hardlink) i przekazuje go do umieszczenia etykiety."""
+    while True:
+        azure_path = await download_queue.get()
+        if azure_path is END_OF_STREAM:
+            return
+        started = time.monotonic()
+        split = assign_split(azure_path, args.valid_split, args.random_seed)
+        flat_filename = flatten_azure_path(azure_path)
+        local_path = os.path.join(args.dataset_name, "images", split, flat_filename)
+        try:
+            if os.path.exists(local_path):
+                stats.already_present += 1
+            else:
+                stats.bytes_downloaded += await storage.place_file_async(
+                    args.container_name, azure_path, local_path
+                )
+                stats.downloaded += 1
+        except BlobNotFoundError:
+            print(
+                f"\n  Ostrzeżenie: Blob '{azure_path}' nie został znaleziony. Pomijanie.",
+                file=sys.stderr,
+            )
+            stats.not_found += 1
+            continue
+        except ChecksumMismatchError as e:
+            print(f"\n  Błąd sumy kontrolnej: {e}. Pomijanie.", file=sys.stderr)
+            stats.checksum_errors += 1
+            continue
+        except Exception as e:
+            print(
+                f"\n  Błąd podczas pobierania bloba '{azure_path}': {e}",
+                file=sys.stderr,
+            )
+            stats.download_errors += 1
+            continue
+        finally:
+            stats.stage_busy["download"] += time.monotonic() - started
+        await place_queue.put((azure_path, split, flat_filename))
+
+
+async def place_labels(
+    args,
+    place_queue: asyncio.Queue,
+    label_store: LabelStore,
+    label_lock: asyncio.Lock,
+    placed: dict[str, tuple[str, str]],
+    labels_loaded: asyncio.Event,
+    path_mapping: dict[str, str],
+    index_entries: dict[str, IndexEntry],
+    stats: PipelineStats,
+):
+    """
+    Etap etykiet i weryfikacji: sprawdza pobrany obraz i zapisuje jego etykietę, jeśli jej archiwum
+    jest już wczytane. Obrazy umieszczane przed wczytaniem wszystkich archiwów są zapamiętywane
+    w placed - ich etykiety zapisuje load_labels, gdy dotrze do właściwego archiwum.
+    """
+    while True:
+        item = await place_queue.get()
+        if item is END_OF_STREAM:
+            return
+        started = time.monotonic()
+        azure_path, split, flat_filename = item
+        image_path = os.path.join(args.dataset_name, "images", split, flat_filename)
+        key = os.path.splitext(azure_path)[0]
+        try:
+            if os.path.getsize(image_path) == 0:
+                raise OSError("pusty plik obrazu")
+            async with label_lock:
+                label_content = label_store.pop(key)
+                if not labels_loaded.is_set():
+                    placed[key] = (split, flat_filename)
+                if label_content is not None:
+                    await asyncio.to_thread(
+                        write_file_atomic,
+                        label_path_for(args, split, flat_filename),
+                        label_content,
+                    )
+        except OSError as e:
+            placed.pop(key, None)
+            print(
+                f"\n  Weryfikacja '{flat_filename}' nie powiodła się: {e}",
+                file=sys.stderr,
+            )
+            stats.verify_failed += 1
+            continue
+        finally:
+            stats.stage_busy["place"] += time.monotonic() - started
+
+        path_mapping[azure_path] = flat_filename
+        index_entries[flat_filename] = (split, label_content is not None, STATUS_OK)
+        if label_content is not None:
+            stats.placed_with_label += 1
+        if label_content is not None or labels_loaded.is_set():
+            mark_sample_ready(stats, flat_filename)
+
+
+def read_path_mapping(mapping_filepath: str) -> dict[str, str]:
+    """Wczytuje istniejące mapowanie ścieżek (pusty słownik, jeśli go brak)."""
+    try:
+        with open(mapping_filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(
+            f"  Ostrzeżenie: Nie można odczytać '{mapping_filepath}' ({e}). Zostanie zapisane od nowa.",
+            file=sys.stderr,
+        )
+        return {}
+
+
+async def run_pipeline(
+    args, storage: StorageBackend, class_names: Optional[list[str]] = None
+) -> PipelineStats:
+    """
+    Przetwarza archiwa args.xml_blobs / args.yolo_blobs. class_names - klasy istniejącego
+    datasetu (kolejne archiwa są do nich mapowane); mapowanie i indeks są scalane z istniejącymi.
+    Pamięć: etykiety czekające na obrazy mieszczą się w --label-memory-mb, natomiast nazwy obrazów
+    (deduplikacja), mapowanie ścieżek i wpisy indeksu są trzymane w pamięci - O(liczba obrazów),
+    bo mapowanie JSON i indeks są i tak zapisywane w całości na końcu przebiegu.
+    """
+    stats = PipelineStats()
+    for kind in ("images", "labels"):
+        for split in ("train", "valid"):
+            os.makedirs(os.path.join(args.dataset_name, kind, split), exist_ok=True)
+
+    download_queue = asyncio.Queue(maxsize=args.queue_size)
+    place_queue = asyncio.Queue(maxsize=args.queue_size)
+    labels_loaded = asyncio.Event()
+    label_lock = asyncio.Lock()
+    class_names = list(class_names or [])
+    label_store = LabelStore(int(args.label_memory_mb * 1024 * 1024), args.dataset_name)
+    placed = {}
+    path_mapping = {}
+    index_entries = {}
+
+    # Jeden współdzielony klient (dla Azure: asynchroniczny, wspólna pula połączeń) dla wszystkich etapów
+    async with storage:
+        labels_task = asyncio.create_task(
+            load_labels(
+                storage,
+                args,
+                class_names,
+                label_store,
+                label_lock,
+                placed,
+                labels_loaded,
+                index_entries,
+                stats,
+            )
+        )
+        place_task = asyncio.create_task(
+            place_labels(
+                args,
+                place_queue,
+                label_store,
+                label_lock,
+                placed,
+                labels_loaded,
+                path_mapping,
+                index_entries,
+                stats,
+            )
+        )
+        workers = [
+            asyncio.create_task(
+                download_worker(storage, args, download_queue, place_queue, stats)
+            )
+            for _ in range(args.download_workers)
+        ]
+
+        await produce_image_names(storage, args, download_queue, stats)
+        for _ in workers:
+            await download_queue.put(END_OF_STREAM)
+        await asyncio.gather(*workers)
+        await labels_task
+        await place_queue.put(END_OF_STREAM)
+        await place_task
+    label_store.close()
+    stats.placed_without_label = len(index_entries) - stats.placed_with_label
+
+    mapping_filepath = os.path.join(args.dataset_name, args.mapping_file)
+    full_mapping = read_path_mapping(mapping_filepath)
+    full_mapping.update(path_mapping)
+    tmp_path = mapping_filepath + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(full_mapping, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, mapping_filepath)
+    print(
+        f"\nZapisano mapowanie {len(path_mapping)} ścieżek (łącznie {len(full_mapping)}) do: {mapping_filepath}"
+    )
+    index_entries, changed_images = merge_index_entries(
+        read_dataset_index(args.dataset_name), index_entries
+    )
+    write_dataset_index(args.dataset_name, index_entries, changed_images)
+
+    if class_names:
+        create_yolo_config_files(
+            args.dataset_name, class_names, write_manifest=not args.no_manifest
+        )
+    else:
+        print(
+            f"\nBŁĄD: Nie udało się odczytać nazw klas z pliku '{args.class_names_file}' z żadnego archiwum. Nie utworzono dataset.yaml.",
+            file=sys.stderr,
+        )
+    return stats
+
+
+def print_summary(stats: PipelineStats):
+    wall_time = time.monotonic() - stats.started
+    print("\n--- Podsumowanie potoku asynchronicznego ---")
+    print(f"  Obrazów z XML: {stats.names_produced}")
+    print(
+        f"  Pobrano: {stats.downloaded} ({stats.bytes_downloaded / (1024 * 1024):.1f} MB), istniejących: {stats.already_present}"
+    )
+    print(
+        f"  Nie znaleziono w źródle: {stats.not_found}, błędy pobierania: {stats.download_errors}, niezgodne MD5: {stats.checksum_errors}"
+    )
+    print(
+        f"  Gotowe próbki: z etykietą {stats.placed_with_label}, bez etykiety {stats.placed_without_label}, błędy weryfikacji {stats.verify_failed}"
+    )
+    if stats.labels_spilled:
+        print(
+            f"  Etykiet odłożonych do pliku tymczasowego (ponad --label-memory-mb): {stats.labels_spilled}"
+        )
+    if stats.invalid_label_lines:
+        print(
+            f"  Usunięto linii etykiet z błędnym id klasy: {stats.invalid_label_lines}"
+        )
+    if stats.label_conflicts:
+        print(
+            f"  Ostrzeżenie: {stats.label_conflicts} etykiet pominięto - ich obrazy mają już etykietę "
+            f"z wcześniejszego archiwum wg --yolo-blobs.",
+            file=sys.stderr,
+        )
+        for blob_name, key in stats.label_conflict_examples:
+            print(f"    {blob_name}: {key}", file=sys.stderr)
+    if stats.first_sample_at is not None:
+        print(
+            f"  Czas do pierwszej gotowej próbki: {stats.first_sample_at - stats.started:.2f} s"
+        )
+    print(f"  Czas całkowity: {wall_time:.2f} s")
+    busy = ", ".join(
+        f"{name}={seconds:.1f} s" for name, seconds in stats.stage_busy.items()
+    )
+    print(f"  Czas pracy etapów (suma po workerach): {busy}")
+
+
+def add_pipeline_arguments(parser):
+    """Opcje potoku wspólne dla pipeline_async.py i watch_container.py (bez list archiwów)."""
+    parser.add_argument("--connect-str", help="Ciąg połączenia Azure (nadpisuje .env).")
+    parser.add_argument(
+        "--container-name", required=True, help="Nazwa kontenera Azure."
+    )
+    parser.add_argument(
+        "--dataset-name",
+        default="yolo_dataset",
+        help="Nazwa folderu głównego dla tworzonego datasetu (domyślnie: yolo_dataset).",
+    )
+    parser.add_argument(
+        "--mapping-file",
+        default="azure_to_local_map.json",
+        help="Nazwa pliku JSON z mapowaniem nazw (w folderze datasetu).",
+    )
+    parser.add_argument(
+        "--valid-split",
+        type=float,
+        default=0.1,
+        help="Procent danych na zbiór walidacyjny (0.0-1.0, domyślnie: 0.1). Podział jest deterministyczny (skrót ścieżki).",
+    )
+    parser.add_argument(
+        "--random-seed", type=int, default=42, help="Ziarno podziału train/valid."
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=256,
+        help="Maksymalna liczba elementów w każdej kolejce między etapami (domyślnie: 256).",
+    )
+    parser.add_argument(
+        "--label-memory-mb",
+        type=float,
+        default=DEFAULT_LABEL_MEMORY_MB,
+        help=f"Budżet pamięci (MB) na etykiety YOLO czekające na swoje obrazy; nadmiar jest odkładany do pliku tymczasowego w folderze datasetu (domyślnie: {DEFAULT_LABEL_MEMORY_MB}). Nie obejmuje nazw obrazów, mapowania ani indeksu (rosną z liczbą obrazów).",
+    )
+    parser.add_argument(
+        "--zip-base-structure",
+        default="obj_train_data",
+        help="Folder bazowy w ZIP YOLO do pominięcia (domyślnie: 'obj_train_data', '' jeśli brak).",
+    )
+    parser.add_argument(
+        "--class-names-file",
+        default="obj.names",
+        help="Nazwa pliku z nazwami klas w archiwach YOLO (domyślnie: obj.names).",
+    )
+    parser.add_argument(
+        "--select",
+        action="append",
+        metavar="[NAZWA=]WYRAŻENIE",
+        help="Reguła wyboru obrazów z XML (powtarzalna, jak w find_images_to_train.py). Domyślnie: BBoxy lub tag 'brak reklam'.",
+    )
+    parser.add_argument(
+        "--rules-file",
+        help="Plik TSV z regułami: 'nazwa<TAB>[waga<TAB>]wyrażenie'.",
+    )
+
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="Nie twórz manifestu datasetu (dataset_manifest.tsv z rozmiarami i SHA-256 plików do weryfikacji kopii).",
+    )
+
+    add_source_arguments(parser)
+    add_transfer_arguments(parser, default_workers=16)
+
+
+def setup_pipeline(args) -> StorageBackend:
+    """Waliduje opcje add_pipeline_arguments, wczytuje reguły i tworzy backend. Kończy program przy błędzie."""
+    try:
+        configure_transfer(args)
+    except ValueError as e:
+        sys.exit(f"Błąd: {e}")
+    try:
+        args.rules = load_rules(args.select, args.rules_file)
+    except (ValueError, OSError) as e:
+        sys.exit(f"Błąd: Niepoprawne reguły wyboru: {e}")
+
+    # Import leniwy: --help i błędy argumentów nie ładują zależności
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    if not 0.0 <= args.valid_split <= 1.0:
+        sys.exit(
+            "Błąd: Współczynnik podziału walidacyjnego musi być pomiędzy 0.0 a 1.0."
+        )
+    if args.download_workers < 1 or args.queue_size < 1:
+        sys.exit("Błąd: --download-workers i --queue-size muszą być dodatnie.")
+    if args.label_memory_mb < 0:
+        sys.exit("Błąd: --label-memory-mb nie może być ujemne.")
+    connect_str = (
+        args.connect_str
+        if args.connect_str
+        else os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    )
+    return create_storage_backend(args, connect_str)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Asynchroniczny potok end-to-end: nazwy obrazów z XML CVAT są strumieniowo przekazywane do pobierania, a pobrane obrazy od razu otrzymują etykiety YOLO. Kolejki o ograniczonym rozmiarze utrzymują stałe zużycie pamięci."
+    )
+    parser.add_argument(
+        "--xml-blobs",
+        required=True,
+        nargs="+",
+        help="Nazwy plików ZIP z adnotacjami CVAT (XML).",
+    )
+    parser.add_argument(
+        "--yolo-blobs",
+        required=True,
+        nargs="+",
+        help="Nazwy plików ZIP z adnotacjami YOLO.",
+    )
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    storage = setup_pipeline(args)
+
+    stats = asyncio.run(run_pipeline(args, storage))
+    print_summary(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,40 @@ import random
 import math
 import argparse
 import sys
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import BlobServiceClient
-from dotenv import load_dotenv
-from tqdm import tqdm
 import re  # Do zamiany wielu myślników
 import json  # Do zapisania mapowania
+import time
+import shutil
+import hashlib
+import itertools
+from typing import Iterable, Iterator, Optional
+from array import array  # Zwarte histogramy klas dla podziału warstwowego
+from parallel import ordered_thread_map
+from azure_clients import (
+    add_transfer_arguments,
+    configure_transfer,
+    download_workers,
+    retryable_response_count,
+)
+from storage_backends import (
+    StorageBackend,
+    BlobNotFoundError,
+    ChecksumMismatchError,
+    add_source_arguments,
+    create_storage_backend,
+)
+from progress_reporter import (
+    ProgressReporter,
+    add_progress_arguments,
+    configure_progress,
+)
+from dataset_index import (
+    INDEX_FILENAME,
+    STATUS_OK,
+    read_dataset_index,
+    write_dataset_index,
+    merge_index_entries,
+)
 
 
 def read_image_list(file_path: str) -> list[str]:
@@ -30,6 +58,45 @@ def read_image_list(file_path: str) -> list[str]:
         sys.exit(1)
 
 
+def iter_image_list(file_path: str) -> Iterator[str]:
+    """
+    Strumieniowo zwraca ścieżki obrazów z pliku tekstowego (bez wczytywania całej listy).
+    Błąd otwarcia pliku kończy program, tak jak w read_image_list.
+    """
+    try:
+        f = open(file_path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        print(
+            f"Błąd: Plik wejściowy '{file_path}' nie został znaleziony.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    except Exception as e:
+        print(f"Błąd podczas odczytu pliku '{file_path}': {e}", file=sys.stderr)
+        sys.exit(1)
+    with f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def assign_split(azure_path: str, valid_split_ratio: float, seed: int) -> str:
+    """Deterministyczny podział train/valid na podstawie skrótu ścieżki (nie wymaga całej listy)."""
+    digest = hashlib.md5(f"{seed}:{azure_path}".encode("utf-8")).digest()
+    fraction = int.from_bytes(digest[:8], "big") / 2**64
+    return "valid" if fraction < valid_split_ratio else "train"
+
+
+def iter_split_paths(
+    file_path: str, set_name: str, valid_split_ratio: float, seed: int
+) -> Iterator[str]:
+    """Strumieniowo zwraca ścieżki z pliku, które podział skrótem przydziela do zbioru set_name."""
+    for azure_path in iter_image_list(file_path):
+        if assign_split(azure_path, valid_split_ratio, seed) == set_name:
+            yield azure_path
+
+
 def split_data(
     image_paths: list[str], valid_split_ratio: float
 ) -> tuple[list[str], list[str]]:
@@ -53,6 +120,172 @@ def split_data(
     return train_files, valid_files
 
 
+def read_label_stats(
+    file_path: str,
+) -> tuple[dict[str, int], list[str], array, array, array]:
+    """
+    Wczytuje histogramy klas obrazów z pliku TSV ('ścieżka<TAB>klasa=liczba<TAB>...').
+    Histogramy są przechowywane w tablicach (format CSR), a nie w słownikach per obraz:
+    wiersz r zajmuje pozycje offsets[r]..offsets[r+1] w tablicach class_ids i counts.
+    Zwraca: ({ścieżka: wiersz}, nazwy_klas, offsets, class_ids, counts).
+    Przy powtórzonej ścieżce brany jest pierwszy wiersz.
+    """
+    row_of = {}
+    class_index = {}
+    class_names = []
+    offsets = array("Q", [0])
+    class_ids = array("I")
+    counts = array("I")
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                image_path = fields[0].strip()
+                if not image_path or image_path in row_of:
+                    continue
+                for field in fields[1:]:
+                    class_name, _, count = field.rpartition("=")
+                    if not class_name or not count.isdigit():
+                        continue
+                    class_id = class_index.get(class_name)
+                    if class_id is None:
+                        class_id = class_index[class_name] = len(class_names)
+                        class_names.append(class_name)
+                    class_ids.append(class_id)
+                    counts.append(int(count))
+                row_of[image_path] = len(offsets) - 1
+                offsets.append(len(class_ids))
+    except FileNotFoundError:
+        print(
+            f"Błąd: Plik statystyk klas '{file_path}' nie został znaleziony.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    except Exception as e:
+        print(f"Błąd podczas odczytu pliku '{file_path}': {e}", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"Odczytano histogramy klas dla {len(row_of)} obrazów ({len(class_names)} klas) z pliku '{file_path}'."
+    )
+    return row_of, class_names, offsets, class_ids, counts
+
+
+def split_data_stratified(
+    image_paths: list[str],
+    valid_split_ratio: float,
+    label_stats: tuple[dict[str, int], list[str], array, array, array],
+) -> tuple[list[str], list[str]]:
+    """
+    Dzieli listę obrazów na train/valid, równoważąc częstości klas (iteracyjna stratyfikacja).
+    Obrazy są przetwarzane od zawierających najrzadszą klasę; każdy trafia do zbioru,
+    który ma największe niezaspokojone zapotrzebowanie na tę klasę. Rozmiary zbiorów
+    są takie same jak w split_data.
+    """
+    if not 0.0 <= valid_split_ratio <= 1.0:
+        print(
+            "Błąd: Współczynnik podziału walidacyjnego musi być pomiędzy 0.0 a 1.0.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    row_of, class_names, offsets, class_ids, counts = label_stats
+    num_classes = len(class_names)
+
+    random.shuffle(image_paths)  # Losowe rozstrzyganie remisów
+    num_total = len(image_paths)
+    rows = array("q", [row_of.get(p, -1) for p in image_paths])
+
+    totals = array("Q", bytes(8 * num_classes))
+    for row in rows:
+        if row < 0:
+            continue
+        for k in range(offsets[row], offsets[row + 1]):
+            totals[class_ids[k]] += counts[k]
+
+    # Klucz sortowania: liczność najrzadszej klasy obrazu (obrazy bez klas na końcu)
+    no_class_key = max(totals, default=0) + 1
+    rarest_key = array("Q", bytes(8 * num_total))
+    rarest_class = array("q", [-1]) * num_total
+    for i, row in enumerate(rows):
+        if row < 0:
+            rarest_key[i] = no_class_key
+            continue
+        key, rarest = no_class_key, -1
+        for k in range(offsets[row], offsets[row + 1]):
+            class_total = totals[class_ids[k]]
+            if class_total < key:
+                key, rarest = class_total, class_ids[k]
+        rarest_key[i] = key
+        rarest_class[i] = rarest
+    order = sorted(range(num_total), key=rarest_key.__getitem__)
+
+    need_valid = array("d", [t * valid_split_ratio for t in totals])
+    need_train = array("d", [t * (1.0 - valid_split_ratio) for t in totals])
+    capacity_valid = math.ceil(num_total * valid_split_ratio)
+    capacity_train = num_total - capacity_valid
+    is_valid = bytearray(num_total)
+    valid_class_counts = array("Q", bytes(8 * num_classes))
+
+    for i in order:
+        rarest = rarest_class[i]
+        if capacity_valid == 0:
+            to_valid = False
+        elif capacity_train == 0:
+            to_valid = True
+        elif rarest < 0:
+            # Brak klas: uzupełniamy zbiory proporcjonalnie do pozostałej pojemności
+            to_valid = capacity_valid * (1.0 - valid_split_ratio) >= (
+                capacity_train * valid_split_ratio
+            )
+        elif need_valid[rarest] != need_train[rarest]:
+            to_valid = need_valid[rarest] > need_train[rarest]
+        else:
+            row = rows[i]
+            span = range(offsets[row], offsets[row + 1])
+            desire_valid = sum(need_valid[class_ids[k]] for k in span)
+            desire_train = sum(need_train[class_ids[k]] for k in span)
+            if desire_valid != desire_train:
+                to_valid = desire_valid > desire_train
+            else:
+                to_valid = capacity_valid > capacity_train
+
+        if to_valid:
+            is_valid[i] = 1
+            capacity_valid -= 1
+        else:
+            capacity_train -= 1
+        if rarest < 0:
+            continue
+        row = rows[i]
+        need = need_valid if to_valid else need_train
+        for k in range(offsets[row], offsets[row + 1]):
+            need[class_ids[k]] -= counts[k]
+            if to_valid:
+                valid_class_counts[class_ids[k]] += counts[k]
+
+    valid_files = [p for p, v in zip(image_paths, is_valid) if v]
+    train_files = [p for p, v in zip(image_paths, is_valid) if not v]
+    print(
+        f"Podział warstwowy: {len(train_files)} obrazów treningowych, {len(valid_files)} obrazów walidacyjnych ({valid_split_ratio*100:.1f}%)."
+    )
+    missing_in_valid = []
+    for class_id, class_name in enumerate(class_names):
+        total = totals[class_id]
+        if total == 0:
+            continue
+        in_valid = valid_class_counts[class_id]
+        print(
+            f"  {class_name}: train={total - in_valid}, valid={in_valid} ({in_valid / total * 100:.1f}%)"
+        )
+        if in_valid == 0 and valid_split_ratio > 0:
+            missing_in_valid.append(class_name)
+    if missing_in_valid:
+        print(
+            f"  Ostrzeżenie: Klasy bez przykładów walidacyjnych: {', '.join(missing_in_valid)}",
+            file=sys.stderr,
+        )
+    return train_files, valid_files
+
+
 def create_yolo_dirs(base_dir: str):
     """Tworzy strukturę folderów dla YOLO (images/train, images/valid)."""
     # (Bez zmian w stosunku do poprzedniej wersji)
@@ -80,87 +313,316 @@ def flatten_azure_path(azure_path: str) -> str:
     return flat_path
 
 
+def list_blob_properties(
+    storage: StorageBackend, container_name: str, image_paths: list[str]
+) -> dict[str, tuple[Optional[str], int]]:
+    """
+    Listuje kontener (bez pobierania) i zwraca {ścieżka_azure: (content_md5_hex lub None, rozmiar)}
+    dla blobów z listy. Obrazów nieobecnych w kontenerze nie ma w wyniku.
+    Lokalny mirror nie zna Content-MD5 (None).
+    """
+    wanted = set(image_paths)
+    properties = {}
+    if not wanted:
+        return properties
+    # Wspólny prefiks ogranicza listowanie do fragmentu kontenera
+    prefix = os.path.commonprefix([min(wanted), max(wanted)])
+
+    print(f"Listowanie: {storage.describe(container_name)} (prefiks: '{prefix}')...")
+    for blob in storage.list_blobs(container_name, prefix):
+        if blob.name not in wanted:
+            continue
+        properties[blob.name] = (blob.content_md5, blob.size)
+    print(f"Znaleziono w kontenerze {len(properties)} z {len(wanted)} obrazów z listy.")
+    return properties
+
+
+def fingerprints_from_properties(
+    properties: dict[str, tuple[Optional[str], int]],
+) -> dict[str, tuple[str, int]]:
+    """Wybiera z wyniku listowania bloby, które mają Content-MD5."""
+    return {path: props for path, props in properties.items() if props[0]}
+
+
+def group_duplicate_images(
+    image_paths: list[str], fingerprints: dict[str, tuple[str, int]]
+) -> tuple[list[str], dict[str, list[str]], int]:
+    """
+    Grupuje obrazy o identycznej treści (MD5 + rozmiar).
+    Zwraca: (lista unikalnych obrazów, {obraz_kanoniczny: [duplikaty]}, zaoszczędzone bajty).
+    Obrazem kanonicznym jest pierwsze wystąpienie w liście; obrazy bez sumy MD5 są traktowane jako unikalne.
+    """
+    canonical_by_content = {}
+    unique_paths = []
+    duplicates = {}
+    saved_bytes = 0
+
+    for azure_path in image_paths:
+        fingerprint = fingerprints.get(azure_path)
+        if fingerprint is None:
+            unique_paths.append(azure_path)
+            continue
+        canonical = canonical_by_content.get(fingerprint)
+        if canonical is None:
+            canonical_by_content[fingerprint] = azure_path
+            unique_paths.append(azure_path)
+        elif canonical != azure_path:
+            duplicates.setdefault(canonical, []).append(azure_path)
+            saved_bytes += fingerprint[1]
+
+    return unique_paths, duplicates, saved_bytes
+
+
+def expand_mapping_with_duplicates(
+    path_mapping: dict[str, str], duplicates: dict[str, list[str]]
+) -> int:
+    """
+    Dopisuje do mapowania duplikaty, wskazując na plik obrazu kanonicznego.
+    Dzięki temu etykiety duplikatów trafiają do tego samego pliku (i tego samego zbioru);
+    organize_yolo_labels.py zapisuje z nich jedną (z pierwszego archiwum wg --annotation-blobs,
+    a w nim obrazu kanonicznego) i raportuje pozostałe.
+    Zwraca liczbę dopisanych ścieżek.
+    """
+    added = 0
+    for canonical, duplicate_paths in duplicates.items():
+        flat_filename = path_mapping.get(canonical)
+        if flat_filename is None:
+            continue  # Obraz kanoniczny nie został pobrany
+        for azure_path in duplicate_paths:
+            path_mapping[azure_path] = flat_filename
+            added += 1
+    return added
+
+
+def list_local_files(directory: str) -> set[str]:
+    """Zwraca nazwy plików w folderze (jedno skanowanie, bez stat na plik) lub pusty zbiór."""
+    try:
+        with os.scandir(directory) as it:
+            return {entry.name for entry in it}
+    except FileNotFoundError:
+        return set()
+
+
+def measure_download_bandwidth(
+    storage: StorageBackend, container_name: str, sample_paths: list[str]
+) -> Optional[float]:
+    """
+    Mierzy przepustowość (bajty/s), pobierając do pamięci (bez zapisu na dysk) kilka blobów
+    tą samą liczbą wątków co download_images. Zwraca None, jeśli pomiar się nie powiódł.
+    """
+
+    def sample_size(azure_path: str) -> int:
+        try:
+            return len(storage.read_bytes(container_name, azure_path))
+        except Exception as e:
+            print(
+                f"  Ostrzeżenie: Pomiar przepustowości na '{azure_path}' nieudany: {e}",
+                file=sys.stderr,
+            )
+            return 0
+
+    started = time.perf_counter()
+    total_bytes = sum(ordered_thread_map(sample_size, sample_paths, download_workers()))
+    elapsed = time.perf_counter() - started
+    if total_bytes == 0 or elapsed <= 0:
+        return None
+    return total_bytes / elapsed
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def print_prepare_plan(
+    storage: StorageBackend,
+    container_name: str,
+    dataset_dir: str,
+    train_files: list[str],
+    valid_files: list[str],
+    blob_properties: dict[str, tuple[Optional[str], int]],
+    duplicates: dict[str, list[str]],
+    bandwidth_mbps: Optional[float],
+    bandwidth_sample_size: int,
+):
+    """
+    Wypisuje plan pobierania (tryb --plan): liczba obrazów i bajtów do pobrania, obrazy już
+    obecne lokalnie, szacowany czas i wymagane miejsce. Niczego nie zapisuje.
+    """
+    to_fetch = []
+    present_count = {}
+    missing_count = 0
+    for set_name, file_list in (("train", train_files), ("valid", valid_files)):
+        local_files = list_local_files(os.path.join(dataset_dir, "images", set_name))
+        present_count[set_name] = 0
+        for azure_path in file_list:
+            if flatten_azure_path(azure_path) in local_files:
+                present_count[set_name] += 1
+            elif azure_path in blob_properties:
+                to_fetch.append(azure_path)
+            else:
+                missing_count += 1
+    bytes_to_fetch = sum(blob_properties[path][1] for path in to_fetch)
+
+    if bandwidth_mbps:
+        bytes_per_second = bandwidth_mbps * 1024 * 1024
+        bandwidth_source = "podana"
+    else:
+        sample = random.sample(to_fetch, min(bandwidth_sample_size, len(to_fetch)))
+        bytes_per_second = (
+            measure_download_bandwidth(storage, container_name, sample)
+            if sample
+            else None
+        )
+        bandwidth_source = f"zmierzona na {len(sample)} blobach"
+
+    # Mapowanie: ścieżka Azure + spłaszczona nazwa + formatowanie JSON na wpis
+    mapping_bytes = sum(
+        2 * len(path) + 12 for path in itertools.chain(train_files, valid_files)
+    ) + sum(2 * len(path) + 12 for paths in duplicates.values() for path in paths)
+    required_bytes = bytes_to_fetch + mapping_bytes
+    existing_parent = os.path.abspath(dataset_dir)
+    while not os.path.exists(existing_parent):
+        existing_parent = os.path.dirname(existing_parent)
+    free_bytes = shutil.disk_usage(existing_parent).free
+
+    mb = 1024 * 1024
+    print("\n=== Plan przygotowania datasetu (bez zapisu) ===")
+    print(f"  Podział: train={len(train_files)}, valid={len(valid_files)}")
+    if duplicates:
+        print(
+            f"  Duplikaty pominięte dzięki --dedup: {sum(len(p) for p in duplicates.values())}"
+        )
+    print(
+        f"  Już obecne lokalnie: train={present_count['train']}, valid={present_count['valid']}"
+    )
+    print(f"  Do pobrania: {len(to_fetch)} obrazów ({bytes_to_fetch / mb:.1f} MB)")
+    if missing_count:
+        print(f"  Brak w kontenerze: {missing_count}")
+    if bytes_per_second:
+        print(f"  Przepustowość: {bytes_per_second / mb:.2f} MB/s ({bandwidth_source})")
+        print(
+            f"  Szacowany czas pobierania: {format_duration(bytes_to_fetch / bytes_per_second)}"
+        )
+    else:
+        print("  Przepustowość: nieznana (podaj --plan-bandwidth-mbps)")
+    print(
+        f"  Wymagane miejsce na dysku: {required_bytes / mb:.1f} MB (wolne: {free_bytes / mb:.1f} MB)"
+    )
+    if required_bytes > free_bytes:
+        print("  UWAGA: Za mało wolnego miejsca na dysku!", file=sys.stderr)
+
+
+def _download_image(
+    storage: StorageBackend, container_name: str, azure_path: str, destination_dir: str
+) -> tuple[str, int]:
+    """
+    Pobiera jeden obraz pod spłaszczoną nazwą (lokalny mirror: hardlink). Zwraca (status, przesłane
+    bajty); status to 'ok', 'not_found', 'checksum' (MD5 niezgodne z Content-MD5) lub 'error'
+    (komunikaty o błędach wypisuje sam).
+    """
+    new_flat_filename = flatten_azure_path(azure_path)
+    local_path = os.path.join(destination_dir, new_flat_filename)
+    try:
+        # Sprawdź czy plik docelowy (z nową nazwą) już istnieje
+        if os.path.exists(local_path):
+            # Mimo pominięcia pobierania, nadal dodajemy do mapowania, bo plik istnieje
+            return "ok", 0
+
+        return "ok", storage.place_file(container_name, azure_path, local_path)
+
+    except BlobNotFoundError:
+        print(
+            f"\n  Ostrzeżenie: Blob '{azure_path}' nie został znaleziony w kontenerze. Pomijanie.",
+            file=sys.stderr,
+        )
+        if os.path.exists(local_path) and os.path.getsize(local_path) == 0:
+            os.remove(local_path)
+        return "not_found", 0
+    except ChecksumMismatchError as e:
+        print(f"\n  Błąd sumy kontrolnej: {e}. Pomijanie.", file=sys.stderr)
+        return "checksum", 0
+    except Exception as e:
+        print(
+            f"\n  Błąd podczas pobierania bloba '{azure_path}': {e}",
+            file=sys.stderr,
+        )
+        if os.path.exists(local_path):
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+        return "error", 0
+
+
 def download_images(
-    connect_str: str,
+    storage: StorageBackend,
     container_name: str,
-    file_list: list[str],
+    file_list: Iterable[str],
     destination_dir: str,
     set_name: str,
 ) -> tuple[dict[str, str], bool]:
     """
-    Pobiera listę obrazów z Azure do wskazanego folderu lokalnego,
+    Pobiera listę obrazów ze źródła (Azure lub lokalny mirror) do wskazanego folderu lokalnego,
     ZMIENIAJĄC nazwy plików na spłaszczone ścieżki Azure.
+    Pobieranie odbywa się w download_workers() wątkach przez współdzielonego klienta (wspólna pula połączeń);
+    kolejność wpisów w mapowaniu odpowiada kolejności listy. Postęp raportuje ProgressReporter
+    (zadanie 'download_<set_name>').
     Zwraca mapowanie {oryginalna_sciezka_azure: nowa_spłaszczona_nazwa_pliku} oraz status powodzenia.
     """
-    if not connect_str:
-        print("Błąd krytyczny: Brak ciągu połączenia Azure Storage.", file=sys.stderr)
-        return {}, False  # Zwracamy pusty słownik i False
-
     path_mapping = {}  # Słownik do przechowywania mapowania
     success_count = 0
     error_count = 0
     not_found_count = 0
+    checksum_count = 0
 
     try:
+        count_text = (
+            f"{len(file_list)} obrazów" if hasattr(file_list, "__len__") else "obrazów"
+        )
         print(
-            f"\nRozpoczynanie pobierania i zmiany nazw {len(file_list)} obrazów dla zbioru '{set_name}' do '{destination_dir}'..."
+            f"\nRozpoczynanie pobierania i zmiany nazw {count_text} dla zbioru '{set_name}' do '{destination_dir}' (wątki: {download_workers()})..."
         )
-        blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-        container_client = blob_service_client.get_container_client(container_name)
-
-        for azure_path in tqdm(file_list, desc=f"Pobieranie ({set_name})", unit="plik"):
-            # Generuj NOWĄ, spłaszczoną nazwę pliku
-            new_flat_filename = flatten_azure_path(azure_path)
-            local_path = os.path.join(destination_dir, new_flat_filename)
 
-            try:
-                blob_client = container_client.get_blob_client(blob=azure_path)
-
-                # Sprawdź czy plik docelowy (z nową nazwą) już istnieje
-                if os.path.exists(local_path):
-                    # print(f"  Plik '{new_flat_filename}' już istnieje lokalnie. Pomijanie.")
-                    # Mimo pominięcia pobierania, nadal dodajemy do mapowania, bo plik istnieje
-                    path_mapping[azure_path] = new_flat_filename
+        def download_one(azure_path: str) -> tuple[str, str, int]:
+            return azure_path, *_download_image(
+                storage, container_name, azure_path, destination_dir
+            )
+
+        results = ordered_thread_map(download_one, file_list, download_workers())
+        total = len(file_list) if hasattr(file_list, "__len__") else None
+        with ProgressReporter(
+            f"download_{set_name}",
+            f"Pobieranie ({set_name})",
+            total=total,
+            retry_counter=retryable_response_count,
+        ) as progress:
+            for azure_path, status, size in results:
+                if status == "ok":
+                    path_mapping[azure_path] = flatten_azure_path(azure_path)
                     success_count += 1
-                    continue
-
-                with open(local_path, "wb") as download_file:
-                    download_stream = blob_client.download_blob()
-                    download_file.write(download_stream.readall())
-
-                # Pobieranie udane, dodaj do mapowania
-                path_mapping[azure_path] = new_flat_filename
-                success_count += 1
-
-            except ResourceNotFoundError:
-                print(
-                    f"\n  Ostrzeżenie: Blob '{azure_path}' nie został znaleziony w kontenerze '{container_name}'. Pomijanie.",
-                    file=sys.stderr,
-                )
-                not_found_count += 1
-                if os.path.exists(local_path) and os.path.getsize(local_path) == 0:
-                    os.remove(local_path)
-            except Exception as e:
-                print(
-                    f"\n  Błąd podczas pobierania bloba '{azure_path}': {e}",
-                    file=sys.stderr,
-                )
-                error_count += 1
-                if os.path.exists(local_path):
-                    try:
-                        os.remove(local_path)
-                    except OSError:
-                        pass
+                elif status == "not_found":
+                    not_found_count += 1
+                elif status == "checksum":
+                    checksum_count += 1
+                else:
+                    error_count += 1
+                progress.update(1, size, status != "ok")
 
         print(f"\nZakończono pobieranie dla zbioru '{set_name}'.")
         print(f"  Pobranych/istniejących pomyślnie: {success_count}")
         if not_found_count > 0:
-            print(f"  Nie znaleziono w Azure: {not_found_count}")
+            print(f"  Nie znaleziono w źródle: {not_found_count}")
         if error_count > 0:
             print(f"  Błędy pobierania: {error_count}")
+        if checksum_count > 0:
+            print(f"  Niezgodne sumy MD5 (pliki usunięte): {checksum_count}")
 
         # Zwróć mapowanie i ogólny status powodzenia (true jeśli bez błędów i braków)
-        return path_mapping, error_count == 0 and not_found_count == 0
+        return (
+            path_mapping,
+            error_count == 0 and not_found_count == 0 and checksum_count == 0,
+        )
 
     except Exception as e:
         print(
@@ -171,8 +633,6 @@ def download_images(
 
 
 def main():
-    load_dotenv()
-
     parser = argparse.ArgumentParser(
         description="Przygotowuje strukturę datasetu YOLOv9, pobierając obrazy z Azure, ZMIENIAJĄC ich nazwy na spłaszczone ścieżki, dzieląc na train/valid i zapisując mapowanie nazw."
     )
@@ -198,7 +658,7 @@ def main():
         "--valid-split",
         type=float,
         default=0.1,
-        help="Procent danych do przeznaczenia na zbiór walidacyjny (od 0.0 do 1.0, domyślnie: 0.1 czyli 10%).",
+        help="Procent danych do przeznaczenia na zbiór walidacyjny (od 0.0 do 1.0, domyślnie: 0.1 czyli 10%%).",
     )
     parser.add_argument(
         "--random-seed",
@@ -212,8 +672,54 @@ def main():
         default="azure_to_local_map.json",
         help="Nazwa pliku JSON do zapisania mapowania oryginalnych ścieżek Azure na nowe lokalne nazwy (domyślnie: azure_to_local_map.json w folderze datasetu).",
     )
+    parser.add_argument(
+        "--split-mode",
+        choices=["random", "stratified", "hash"],
+        default="random",
+        help="Sposób podziału train/valid: 'random' (losowy, domyślnie), 'stratified' (równoważenie częstości klas, wymaga --label-stats) lub 'hash' (deterministyczny skrót ścieżki; bez --dedup/--plan lista wejściowa jest czytana strumieniowo, bez wczytywania do pamięci; mapowanie nazw i indeks datasetu nadal są budowane w pamięci, proporcjonalnie do liczby obrazów).",
+    )
+    parser.add_argument(
+        "--label-stats",
+        help="Plik TSV z histogramami klas obrazów (tworzony przez find_images_to_train.py --label-stats-file).",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Przed pobieraniem grupuje obrazy o identycznej treści (Content-MD5 + rozmiar z listingu kontenera) i pobiera każdy unikalny obraz tylko raz. Duplikaty trafiają do tego samego zbioru co obraz kanoniczny.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Tryb planowania: na podstawie listingu kontenera i stanu lokalnego wypisuje liczbę obrazów i bajtów do pobrania, szacowany czas, podział i wymagane miejsce. Niczego nie zapisuje.",
+    )
+    parser.add_argument(
+        "--plan-bandwidth-mbps",
+        type=float,
+        help="(Tryb --plan) Przepustowość w MB/s do oszacowania czasu. Domyślnie mierzona na kilku blobach.",
+    )
+    parser.add_argument(
+        "--plan-sample-size",
+        type=int,
+        default=3,
+        help="(Tryb --plan) Liczba blobów pobieranych do pamięci w celu pomiaru przepustowości (domyślnie: 3).",
+    )
+
+    add_source_arguments(parser)
+    add_transfer_arguments(parser)
+    add_progress_arguments(parser)
 
     args = parser.parse_args()
+    try:
+        configure_transfer(args)
+        configure_progress(args)
+    except (ValueError, OSError) as e:
+        print(f"Błąd: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # Import leniwy: --help i błędy argumentów nie ładują zależności
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
     random.seed(args.random_seed)
     print(f"Użyto ziarna losowości: {args.random_seed}")
@@ -223,32 +729,121 @@ def main():
         if args.connect_str
         else os.getenv("AZURE_STORAGE_CONNECTION_STRING")
     )
-    if not connect_str:
-        print("Błąd: Ciąg połączenia Azure Storage nie został podany.", file=sys.stderr)
-        sys.exit(1)
+    storage = create_storage_backend(args, connect_str)
 
-    all_image_paths = read_image_list(args.input_file)
-    if not all_image_paths:
-        print("Lista obrazów jest pusta. Przerywanie.", file=sys.stderr)
+    # Tryb strumieniowy: podział skrótem bez --dedup/--plan nie wymaga listy wejściowej w pamięci.
+    # Mapowanie (jeden obiekt JSON) i indeks (zapisywany posortowany w całości) pozostają O(liczba obrazów).
+    streaming = args.split_mode == "hash" and not (args.dedup or args.plan)
+    if args.split_mode == "hash" and not 0.0 <= args.valid_split <= 1.0:
+        print(
+            "Błąd: Współczynnik podziału walidacyjnego musi być pomiędzy 0.0 a 1.0.",
+            file=sys.stderr,
+        )
         sys.exit(1)
+    if streaming:
+        if next(iter_image_list(args.input_file), None) is None:
+            print("Lista obrazów jest pusta. Przerywanie.", file=sys.stderr)
+            sys.exit(1)
+        print(
+            f"Podział skrótem ścieżki (strumieniowo z '{args.input_file}', {args.valid_split*100:.1f}% walidacyjnych)."
+        )
+        all_image_paths = []
+    else:
+        all_image_paths = read_image_list(args.input_file)
+        if not all_image_paths:
+            print("Lista obrazów jest pusta. Przerywanie.", file=sys.stderr)
+            sys.exit(1)
+
+    duplicates = {}
+    blob_properties = {}
+    if args.dedup or args.plan:
+        try:
+            blob_properties = list_blob_properties(
+                storage, args.container_name, all_image_paths
+            )
+        except Exception as e:
+            print(f"Błąd podczas listowania kontenera: {e}", file=sys.stderr)
+            sys.exit(1)
+    if args.dedup:
+        print("\nDeduplikacja obrazów na podstawie Content-MD5...")
+        all_image_paths, duplicates, saved_bytes = group_duplicate_images(
+            all_image_paths, fingerprints_from_properties(blob_properties)
+        )
+        duplicate_count = sum(len(paths) for paths in duplicates.values())
+        print(
+            f"Deduplikacja: {len(all_image_paths)} unikalnych obrazów, pominięto {duplicate_count} duplikatów w {len(duplicates)} grupach (oszczędność: {saved_bytes / (1024 * 1024):.1f} MB)."
+        )
 
-    train_files, valid_files = split_data(all_image_paths, args.valid_split)
+    if args.split_mode == "stratified":
+        if not args.label_stats:
+            print(
+                "Błąd: Tryb --split-mode stratified wymaga podania --label-stats.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        label_stats = read_label_stats(args.label_stats)
+        train_files, valid_files = split_data_stratified(
+            all_image_paths, args.valid_split, label_stats
+        )
+    elif streaming:
+        # Dwa przebiegi po pliku (po jednym na zbiór) zamiast list ścieżek w pamięci
+        train_files = iter_split_paths(
+            args.input_file, "train", args.valid_split, args.random_seed
+        )
+        valid_files = iter_split_paths(
+            args.input_file, "valid", args.valid_split, args.random_seed
+        )
+    elif args.split_mode == "hash":
+        train_files = [
+            p
+            for p in all_image_paths
+            if assign_split(p, args.valid_split, args.random_seed) == "train"
+        ]
+        valid_files = [
+            p
+            for p in all_image_paths
+            if assign_split(p, args.valid_split, args.random_seed) == "valid"
+        ]
+        print(
+            f"Podział skrótem: {len(train_files)} obrazów treningowych, {len(valid_files)} obrazów walidacyjnych."
+        )
+    else:
+        train_files, valid_files = split_data(all_image_paths, args.valid_split)
+
+    if args.plan:
+        print_prepare_plan(
+            storage,
+            args.container_name,
+            args.dataset_name,
+            train_files,
+            valid_files,
+            blob_properties,
+            duplicates,
+            args.plan_bandwidth_mbps,
+            args.plan_sample_size,
+        )
+        return
 
     train_img_dir, valid_img_dir = create_yolo_dirs(args.dataset_name)
 
     # Pobieranie i zbieranie mapowań
     print("\nPobieranie obrazów treningowych (ze zmianą nazw)...")
     train_map, train_success = download_images(
-        connect_str, args.container_name, train_files, train_img_dir, "train"
+        storage, args.container_name, train_files, train_img_dir, "train"
     )
 
     print("\nPobieranie obrazów walidacyjnych (ze zmianą nazw)...")
     valid_map, valid_success = download_images(
-        connect_str, args.container_name, valid_files, valid_img_dir, "valid"
+        storage, args.container_name, valid_files, valid_img_dir, "valid"
     )
 
     # Połącz mapowania
     full_path_map = {**train_map, **valid_map}  # Łączenie słowników
+    if duplicates:
+        added_duplicates = expand_mapping_with_duplicates(full_path_map, duplicates)
+        print(
+            f"Dopisano do mapowania {added_duplicates} duplikatów (wskazują na pliki obrazów kanonicznych)."
+        )
 
     # Zapisz mapowanie do pliku JSON w folderze datasetu
     mapping_filepath = os.path.join(args.dataset_name, args.mapping_file)
@@ -268,6 +863,26 @@ def main():
             "OSTRZEŻENIE: Plik mapowania jest niezbędny do poprawnego dopasowania etykiet w następnym kroku!"
         )
 
+    # Zaktualizuj indeks datasetu (źródło dla train.txt / val.txt w organize_yolo_labels.py)
+    try:
+        current_entries = {
+            flat_filename: (split, False, STATUS_OK)
+            for split, split_map in (("train", train_map), ("valid", valid_map))
+            for flat_filename in split_map.values()
+        }
+        index_entries, changed_images = merge_index_entries(
+            read_dataset_index(args.dataset_name), current_entries
+        )
+        write_dataset_index(args.dataset_name, index_entries, changed_images)
+        print(
+            f"Zaktualizowano {INDEX_FILENAME}: {len(index_entries)} obrazów, zmienionych wpisów: {len(changed_images)}."
+        )
+    except Exception as e:
+        print(
+            f"\nBłąd podczas zapisywania indeksu datasetu '{INDEX_FILENAME}': {e}",
+            file=sys.stderr,
+        )
+
     # Podsumowanie
     print("\n--- Zakończono przygotowanie datasetu ze spłaszczonymi nazwami ---")
     if train_success and valid_success:
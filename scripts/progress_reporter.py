@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Raportowanie postępu długich operacji (pobieranie obrazów, organizowanie etykiet).
+
+Tryby (--progress):
+  tqdm - pasek tqdm (domyślnie), odświeżany co TQDM_REFRESH_INTERVAL s zamiast na każdy element,
+  json - zdarzenia JSON-lines (start, progress co --progress-interval s, end) na stderr lub
+         do --progress-file: elementy i bajty, tempo, błędy, ponowienia, ETA i czas od
+         ostatniego elementu (wykrywanie zawieszeń),
+  none - bez bieżącego postępu (zostają podsumowania skryptów).
+Niezależnie od trybu --metrics-port uruchamia lokalny endpoint HTTP (GET /metrics) z metrykami
+wszystkich zadań procesu w formacie tekstowym Prometheusa.
+ProgressReporter.update tylko sumuje liczniki; zdarzenia JSON wysyła jeden wątek w tle, a metryki
+są liczone przy odczycie, więc koszt na element nie zależy od trybu.
+"""
+
+import sys
+import json
+import time
+import threading
+from typing import Callable, Optional
+
+PROGRESS_TQDM = "tqdm"
+PROGRESS_JSON = "json"
+PROGRESS_NONE = "none"
+DEFAULT_PROGRESS_INTERVAL = 10.0
+DEFAULT_METRICS_HOST = "127.0.0.1"
+TQDM_REFRESH_INTERVAL = 0.2
+METRIC_PREFIX = "dataset_progress_"
+
+_settings = {
+    "mode": PROGRESS_TQDM,
+    "interval": DEFAULT_PROGRESS_INTERVAL,
+    "file": None,
+}
+_lock = threading.Lock()
+_live = {}  # zadanie -> aktywny ProgressReporter
+_last = {}  # zadanie -> ostatni (aktywny lub zakończony) ProgressReporter
+# zadanie -> [elementy, bajty, błędy, ponowienia] zakończonych instancji
+_finished_totals = {}
+_output = None
+_ticker = None
+
+
+def add_progress_arguments(parser):
+    """Dodaje do parsera wspólne opcje raportowania postępu."""
+    parser.add_argument(
+        "--progress",
+        choices=[PROGRESS_TQDM, PROGRESS_JSON, PROGRESS_NONE],
+        default=PROGRESS_TQDM,
+        help="Postęp: tqdm - pasek, json - zdarzenia JSON-lines, none - bez postępu (domyślnie: tqdm).",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=DEFAULT_PROGRESS_INTERVAL,
+        help=f"(--progress json) Odstęp między zdarzeniami w sekundach (domyślnie: {DEFAULT_PROGRESS_INTERVAL:g}).",
+    )
+    parser.add_argument(
+        "--progress-file",
+        help="(--progress json) Plik, do którego dopisywane są zdarzenia (domyślnie: stderr).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Port lokalnego endpointu z metrykami Prometheusa (GET /metrics). Domyślnie wyłączony.",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default=DEFAULT_METRICS_HOST,
+        help=f"Adres nasłuchu endpointu metryk (domyślnie: {DEFAULT_METRICS_HOST}).",
+    )
+
+
+def configure_progress(args):
+    """Ustawia raportowanie z opcji add_progress_arguments. ValueError/OSError przy błędnych opcjach."""
+    if args.progress_interval <= 0:
+        raise ValueError("--progress-interval musi być dodatnie")
+    _settings["mode"] = args.progress
+    _settings["interval"] = args.progress_interval
+    _settings["file"] = args.progress_file
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_host, args.metrics_port)
+
+
+class ProgressReporter:
+    """
+    Postęp jednego zadania (task - stały identyfikator w JSON i metrykach, desc - opis paska).
+    Element liczy się jako przetworzony także przy błędzie (errors to jego podzbiór). retry_counter
+    to opcjonalny licznik procesu (np. azure_clients.retryable_response_count); raportowany jest
+    przyrost od utworzenia reportera. Używać jako 'with'.
+    """
+
+    def __init__(
+        self,
+        task: str,
+        desc: str,
+        total: Optional[int] = None,
+        unit: str = "plik",
+        retry_counter: Optional[Callable[[], int]] = None,
+    ):
+        self.task = task
+        self.total = total
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self._retry_counter = retry_counter
+        self._retry_base = retry_counter() if retry_counter else 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.last_item_time = self.started
+        self._mode = _settings["mode"]
+        self._bar = None
+        self._bar_pending = 0
+        self._bar_refreshed = self.started
+        # (czas, elementy, bajty) ostatniego zdarzenia JSON
+        self._emitted = (self.started, 0, 0)
+
+        if self._mode == PROGRESS_TQDM:
+            from tqdm import tqdm
+
+            self._bar = tqdm(total=total, desc=desc, unit=unit)
+        with _lock:
+            _live[task] = self
+            _last[task] = self
+        if self._mode == PROGRESS_JSON:
+            self._emit("start")
+            _ensure_ticker()
+
+    @property
+    def retries(self) -> int:
+        return self._retry_counter() - self._retry_base if self._retry_counter else 0
+
+    def update(self, items: int = 1, nbytes: int = 0, errors: int = 0) -> None:
+        """Dolicza przetworzone elementy; wywoływane z jednego wątku (konsumenta wyników)."""
+        self.items += items
+        self.bytes += nbytes
+        self.errors += errors
+        now = time.monotonic()
+        self.last_item_time = now
+        if self._bar is not None:
+            self._bar_pending += items
+            if now - self._bar_refreshed >= TQDM_REFRESH_INTERVAL:
+                self._bar.update(self._bar_pending)
+                self._bar_pending = 0
+                self._bar_refreshed = now
+
+    def close(self) -> None:
+        if self.finished is not None:
+            return
+        self.finished = time.monotonic()
+        if self._bar is not None:
+            self._bar.update(self._bar_pending)
+            self._bar.close()
+        with _lock:
+            if _live.get(self.task) is self:
+                del _live[self.task]
+            totals = _finished_totals.setdefault(self.task, [0, 0, 0, 0])
+            for index, value in enumerate(
+                (self.items, self.bytes, self.errors, self.retries)
+            ):
+                totals[index] += value
+        if self._mode == PROGRESS_JSON:
+            self._emit("end")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return None
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        """Stan zadania: liczniki, tempo średnie, ETA (None bez total lub tempa) i bezczynność."""
+        now = self.finished or now or time.monotonic()
+        elapsed = max(now - self.started, 1e-9)
+        items = self.items
+        rate = items / elapsed
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(self.total - items, 0) / rate
+        return {
+            "task": self.task,
+            "elapsed_s": round(elapsed, 3),
+            "items": items,
+            "total": self.total,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_items_per_s": round(rate, 2),
+            "avg_bytes_per_s": round(self.bytes / elapsed, 1),
+            "eta_s": round(eta, 1) if eta is not None else None,
+            "idle_s": round(now - self.last_item_time, 3),
+        }
+
+    def _emit(self, event: str) -> None:
+        now = time.monotonic()
+        record = {
+            "event": event,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        record.update(self.snapshot(now))
+        if event == "progress":
+            # Tempo od poprzedniego zdarzenia (średnie z snapshot ukrywa spadki)
+            last_time, last_items, last_bytes = self._emitted
+            window = max(now - last_time, 1e-9)
+            record["items_per_s"] = round((record["items"] - last_items) / window, 2)
+            record["bytes_per_s"] = round((record["bytes"] - last_bytes) / window, 1)
+        self._emitted = (now, record["items"], record["bytes"])
+        _write_event(record)
+
+
+def _write_event(record: dict) -> None:
+    global _output
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _lock:
+        if _settings["file"] is None:
+            stream = sys.stderr
+        else:
+            if _output is None:
+                _output = open(_settings["file"], "a", encoding="utf-8")
+            stream = _output
+        stream.write(line)
+        stream.flush()
+
+
+def _ensure_ticker() -> None:
+    """Uruchamia (raz na proces) wątek wysyłający zdarzenia 'progress' aktywnych zadań."""
+    global _ticker
+
+    def tick():
+        while True:
+            time.sleep(_settings["interval"])
+            with _lock:
+                reporters = list(_live.values())
+            for reporter in reporters:
+                if reporter.finished is None:
+                    reporter._emit("progress")
+
+    with _lock:
+        if _ticker is None:
+            _ticker = threading.Thread(target=tick, name="progress-ticker", daemon=True)
+            _ticker.start()
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics() -> str:
+    """Metryki wszystkich zadań procesu w formacie tekstowym Prometheusa (0.0.4)."""
+    now = time.monotonic()
+    with _lock:
+        tasks = sorted(_last)
+        snapshots = {task: _last[task].snapshot(now) for task in tasks}
+        running = {task: task in _live for task in tasks}
+        finished = {task: _finished_totals.get(task, [0, 0, 0, 0]) for task in tasks}
+    metrics = [
+        ("items_total", "counter", "Przetworzone elementy (z błędami).", 0, "items"),
+        ("bytes_total", "counter", "Przesłane bajty.", 1, "bytes"),
+        ("errors_total", "counter", "Elementy zakończone błędem.", 2, "errors"),
+        (
+            "retries_total",
+            "counter",
+            "Odpowiedzi kwalifikujące się do ponowienia.",
+            3,
+            "retries",
+        ),
+        (
+            "expected_items",
+            "gauge",
+            "Liczba elementów bieżącego przebiegu.",
+            None,
+            "total",
+        ),
+        ("elapsed_seconds", "gauge", "Czas bieżącego przebiegu.", None, "elapsed_s"),
+        (
+            "eta_seconds",
+            "gauge",
+            "Szacowany czas do końca bieżącego przebiegu.",
+            None,
+            "eta_s",
+        ),
+        (
+            "idle_seconds",
+            "gauge",
+            "Czas od ostatniego przetworzonego elementu.",
+            None,
+            "idle_s",
+        ),
+    ]
+    lines = []
+    for name, metric_type, help_text, total_index, field in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+        for task in tasks:
+            snapshot = snapshots[task]
+            if total_index is not None:
+                # Liczniki sumują zakończone przebiegi i bieżący (monotoniczne w obrębie procesu)
+                value = finished[task][total_index] + (
+                    snapshot[field] if running[task] else 0
+                )
+            elif snapshot[field] is None:
+                continue
+            else:
+                value = snapshot[field]
+            lines.append(
+                f'{METRIC_PREFIX}{name}{{task="{_escape_label(task)}"}} {value}'
+            )
+    lines.append(f"# HELP {METRIC_PREFIX}running Czy zadanie jest w toku (1/0).")
+    lines.append(f"# TYPE {METRIC_PREFIX}running gauge")
+    for task in tasks:
+        lines.append(
+            f'{METRIC_PREFIX}running{{task="{_escape_label(task)}"}} {int(running[task])}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(host: str, port: int):
+    """Uruchamia w wątku w tle serwer HTTP z /metrics. Zwraca serwer (port 0 - wolny port)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Bez logu dostępu na stderr (psułby pasek tqdm)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    print(f"Metryki Prometheusa: http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+Źródła danych (backendy) dla skryptów: Azure Blob Storage lub lokalny katalog (np. mirror NFS).
+
+Skrypty nie używają SDK Azure bezpośrednio, tylko interfejsu StorageBackend, więc ten sam
+potok działa z oboma źródłami (opcja --source). Lokalny mirror ma układ
+<local-root>/<kontener>/<ścieżka_bloba>; obrazy są umieszczane w datasecie przez hardlink
+(bez kopiowania danych), a gdy to niemożliwe (inny system plików) - przez kopię jądra
+(sendfile / copy_file_range w shutil.copyfile). Obrazy z Azure są sprawdzane z Content-MD5 bloba
+w trakcie pobierania (ChecksumMismatchError przy niezgodności).
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+from typing import Iterator, NamedTuple, Optional
+
+from azure_clients import (
+    get_blob_service_client,
+    create_async_blob_service_client,
+    download_blob_to_file,
+    download_blob_to_bytes,
+    max_concurrency,
+)
+
+SOURCE_AZURE = "azure"
+SOURCE_LOCAL = "local"
+
+
+class BlobNotFoundError(Exception):
+    """Blob nie istnieje w źródle (niezależnie od backendu)."""
+
+
+class ChecksumMismatchError(Exception):
+    """MD5 pobranych danych nie zgadza się z Content-MD5 bloba (plik docelowy jest usuwany)."""
+
+
+class BlobProperties(NamedTuple):
+    name: str
+    size: int
+    etag: Optional[str]
+    content_md5: Optional[str]  # hex lub None, jeśli źródło go nie zna
+    last_modified: Optional[float] = None  # Czas modyfikacji (epoch, s)
+
+
+def write_file_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class _Md5Writer:
+    """
+    Opakowanie pliku liczące MD5 zapisywanych danych w trakcie strumieniowania. Przy pobieraniu
+    równoległym SDK może zapisywać fragmenty poza kolejnością (seek) - wtedy sequential=False
+    i sumę trzeba policzyć z gotowego pliku.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.md5 = hashlib.md5()
+        self.position = 0
+        self.sequential = True
+
+    def write(self, data) -> int:
+        if self.sequential:
+            self.md5.update(data)
+            self.position += len(data)
+        return self.file_obj.write(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        result = self.file_obj.seek(offset, whence)
+        if result != self.position:
+            self.sequential = False
+        return result
+
+    def tell(self) -> int:
+        return self.file_obj.tell()
+
+    def seekable(self) -> bool:
+        return self.file_obj.seekable()
+
+    def flush(self):
+        self.file_obj.flush()
+
+
+def file_md5(path: str) -> bytes:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.digest()
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _check_md5(blob_name: str, actual: bytes, expected: Optional[bytes]):
+    """Rzuca ChecksumMismatchError, jeśli blob ma Content-MD5 różne od policzonego."""
+    if expected is not None and actual != expected:
+        raise ChecksumMismatchError(
+            f"{blob_name}: MD5 pobranych danych {actual.hex()} != Content-MD5 {expected.hex()}"
+        )
+
+
+class StorageBackend:
+    """Interfejs źródła danych. Metody asynchroniczne domyślnie delegują do wątków."""
+
+    name = "?"
+
+    def describe(self, container_name: str) -> str:
+        raise NotImplementedError
+
+    def get_properties(self, container_name: str, blob_name: str) -> BlobProperties:
+        raise NotImplementedError
+
+    def read_bytes(self, container_name: str, blob_name: str) -> bytes:
+        raise NotImplementedError
+
+    def download_to_file(
+        self, container_name: str, blob_name: str, file_path: str
+    ) -> int:
+        raise NotImplementedError
+
+    def place_file(self, container_name: str, blob_name: str, file_path: str) -> int:
+        """Umieszcza blob pod file_path (domyślnie: pobranie). Zwraca liczbę przesłanych bajtów."""
+        return self.download_to_file(container_name, blob_name, file_path)
+
+    def list_blobs(
+        self, container_name: str, prefix: Optional[str] = None
+    ) -> Iterator[BlobProperties]:
+        raise NotImplementedError
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def read_bytes_async(self, container_name: str, blob_name: str) -> bytes:
+        import asyncio
+
+        return await asyncio.to_thread(self.read_bytes, container_name, blob_name)
+
+    async def place_file_async(
+        self, container_name: str, blob_name: str, file_path: str
+    ) -> int:
+        import asyncio
+
+        return await asyncio.to_thread(
+            self.place_file, container_name, blob_name, file_path
+        )
+
+
+def _azure_properties(blob_name: str, properties) -> BlobProperties:
+    content_md5 = properties.content_settings.content_md5
+    last_modified = getattr(properties, "last_modified", None)
+    return BlobProperties(
+        blob_name,
+        properties.size,
+        properties.etag,
+        bytes(content_md5).hex() if content_md5 else None,
+        last_modified.timestamp() if last_modified else None,
+    )
+
+
+class AzureBackend(StorageBackend):
+    """Azure Blob Storage przez współdzielonego klienta z azure_clients."""
+
+    name = SOURCE_AZURE
+
+    def __init__(self, connect_str: str, verify_md5: bool = True):
+        self.connect_str = connect_str
+        self.verify_md5 = verify_md5
+        self._async_client = None
+
+    def describe(self, container_name: str) -> str:
+        return f"Azure, kontener '{container_name}'"
+
+    def _blob_client(self, container_name: str, blob_name: str):
+        return get_blob_service_client(self.connect_str).get_blob_client(
+            container=container_name, blob=blob_name
+        )
+
+    def get_properties(self, container_name: str, blob_name: str) -> BlobProperties:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            properties = self._blob_client(
+                container_name, blob_name
+            ).get_blob_properties()
+        except ResourceNotFoundError as e:
+            raise BlobNotFoundError(blob_name) from e
+        return _azure_properties(blob_name, properties)
+
+    def read_bytes(self, container_name: str, blob_name: str) -> bytes:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return download_blob_to_bytes(self._blob_client(container_name, blob_name))
+        except ResourceNotFoundError as e:
+            raise BlobNotFoundError(blob_name) from e
+
+    def download_to_file(
+        self, container_name: str, blob_name: str, file_path: str
+    ) -> int:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            with open(file_path, "wb") as f:
+                writer = _Md5Writer(f) if self.verify_md5 else f
+                size, content_md5 = download_blob_to_file(
+                    self._blob_client(container_name, blob_name), writer
+                )
+        except ResourceNotFoundError as e:
+            raise BlobNotFoundError(blob_name) from e
+        if self.verify_md5 and content_md5 is not None:
+            actual = writer.md5.digest() if writer.sequential else file_md5(file_path)
+            try:
+                _check_md5(blob_name, actual, content_md5)
+            except ChecksumMismatchError:
+                _remove_quietly(file_path)
+                raise
+        return size
+
+    def list_blobs(
+        self, container_name: str, prefix: Optional[str] = None
+    ) -> Iterator[BlobProperties]:
+        container_client = get_blob_service_client(
+            self.connect_str
+        ).get_container_client(container_name)
+        for blob in container_client.list_blobs(name_starts_with=prefix or None):
+            yield _azure_properties(blob.name, blob)
+
+    async def __aenter__(self):
+        # Jeden klient asynchroniczny (wspólna pula połączeń) na czas działania potoku
+        self._async_client = create_async_blob_service_client(self.connect_str)
+        await self._async_client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        client, self._async_client = self._async_client, None
+        await client.__aexit__(*exc_info)
+
+    async def _download_async(
+        self, container_name: str, blob_name: str
+    ) -> tuple[bytes, Optional[bytes]]:
+        """Pobiera blob klientem asynchronicznym. Zwraca (dane, Content-MD5 lub None)."""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob_client = self._async_client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        try:
+            download_stream = await blob_client.download_blob(
+                max_concurrency=max_concurrency()
+            )
+            data = await download_stream.readall()
+        except ResourceNotFoundError as e:
+            raise BlobNotFoundError(blob_name) from e
+        content_md5 = download_stream.properties.content_settings.content_md5
+        return data, bytes(content_md5) if content_md5 else None
+
+    async def read_bytes_async(self, container_name: str, blob_name: str) -> bytes:
+        if self._async_client is None:
+            return await super().read_bytes_async(container_name, blob_name)
+        data, _ = await self._download_async(container_name, blob_name)
+        return data
+
+    async def place_file_async(
+        self, container_name: str, blob_name: str, file_path: str
+    ) -> int:
+        if self._async_client is None:
+            return await super().place_file_async(container_name, blob_name, file_path)
+        import asyncio
+
+        data, content_md5 = await self._download_async(container_name, blob_name)
+
+        def verify_and_write():
+            if self.verify_md5:
+                _check_md5(blob_name, hashlib.md5(data).digest(), content_md5)
+            write_file_atomic(file_path, data)
+
+        await asyncio.to_thread(verify_and_write)
+        return len(data)
+
+
+class LocalBackend(StorageBackend):
+    """Lokalny katalog z kopią kontenerów (<root>/<kontener>/<ścieżka_bloba>)."""
+
+    name = SOURCE_LOCAL
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def describe(self, container_name: str) -> str:
+        return f"lokalny mirror '{self._container_root(container_name)}'"
+
+    def _container_root(self, container_name: str) -> str:
+        return os.path.join(self.root, container_name)
+
+    def _path(self, container_name: str, blob_name: str) -> str:
+        # Nazwy blobów zawsze używają '/', niezależnie od systemu
+        parts = [part for part in blob_name.split("/") if part not in ("", ".")]
+        if ".." in parts:
+            raise BlobNotFoundError(blob_name)
+        return os.path.join(self._container_root(container_name), *parts)
+
+    @staticmethod
+    def _etag(stat: os.stat_result) -> str:
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def get_properties(self, container_name: str, blob_name: str) -> BlobProperties:
+        try:
+            stat = os.stat(self._path(container_name, blob_name))
+        except FileNotFoundError as e:
+            raise BlobNotFoundError(blob_name) from e
+        return BlobProperties(
+            blob_name, stat.st_size, self._etag(stat), None, stat.st_mtime
+        )
+
+    def read_bytes(self, container_name: str, blob_name: str) -> bytes:
+        try:
+            with open(self._path(container_name, blob_name), "rb") as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise BlobNotFoundError(blob_name) from e
+
+    def download_to_file(
+        self, container_name: str, blob_name: str, file_path: str
+    ) -> int:
+        try:
+            # shutil.copyfile używa sendfile/copy_file_range (kopia w jądrze, bez buforów Pythona)
+            shutil.copyfile(self._path(container_name, blob_name), file_path)
+        except FileNotFoundError as e:
+            if os.path.exists(self._path(container_name, blob_name)):
+                raise
+            raise BlobNotFoundError(blob_name) from e
+        return os.path.getsize(file_path)
+
+    def place_file(self, container_name: str, blob_name: str, file_path: str) -> int:
+        """Hardlink do pliku w mirrorze (zero kopiowania); przy innym systemie plików - kopia jądra."""
+        source_path = self._path(container_name, blob_name)
+        try:
+            os.link(source_path, file_path)
+            return 0
+        except FileNotFoundError as e:
+            if not os.path.exists(source_path):
+                raise BlobNotFoundError(blob_name) from e
+            raise
+        except OSError:
+            # EXDEV (inne urządzenie), EPERM (system plików bez hardlinków) itp.
+            return self.download_to_file(container_name, blob_name, file_path)
+
+    def list_blobs(
+        self, container_name: str, prefix: Optional[str] = None
+    ) -> Iterator[BlobProperties]:
+        container_root = self._container_root(container_name)
+        # Zaczynamy od najgłębszego katalogu zawartego w prefiksie
+        prefix = prefix or ""
+        start_dir = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        stack = [start_dir]
+        while stack:
+            relative_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(container_root, relative_dir)) as it:
+                    for entry in it:
+                        name = (
+                            f"{relative_dir}/{entry.name}"
+                            if relative_dir
+                            else entry.name
+                        )
+                        if entry.is_dir(follow_symlinks=False):
+                            if name.startswith(prefix) or prefix.startswith(name + "/"):
+                                stack.append(name)
+                        elif name.startswith(prefix):
+                            stat = entry.stat()
+                            yield BlobProperties(
+                                name,
+                                stat.st_size,
+                                self._etag(stat),
+                                None,
+                                stat.st_mtime,
+                            )
+            except FileNotFoundError:
+                continue
+
+
+def add_source_arguments(parser):
+    """Dodaje opcje wyboru źródła danych (--source, --local-root)."""
+    parser.add_argument(
+        "--source",
+        choices=[SOURCE_AZURE, SOURCE_LOCAL],
+        default=SOURCE_AZURE,
+        help="Źródło blobów: 'azure' (domyślnie) lub 'local' (mirror kontenerów w --local-root, bez Azure).",
+    )
+    parser.add_argument(
+        "--local-root",
+        help="(--source local) Katalog z mirrorem: <local-root>/<kontener>/<ścieżka_bloba>.",
+    )
+    parser.add_argument(
+        "--no-md5-check",
+        action="store_true",
+        help="(--source azure) Nie sprawdzaj Content-MD5 pobieranych obrazów (domyślnie sprawdzane w trakcie pobierania).",
+    )
+
+
+def create_storage_backend(args, connect_str: Optional[str]) -> StorageBackend:
+    """Tworzy backend według opcji add_source_arguments. Kończy program przy brakującej konfiguracji."""
+    if args.source == SOURCE_LOCAL:
+        if not args.local_root or not os.path.isdir(args.local_root):
+            print(
+                f"Błąd: --source local wymaga istniejącego katalogu --local-root (podano: {args.local_root}).",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        return LocalBackend(args.local_root)
+    if not connect_str:
+        print(
+            "Błąd: Ciąg połączenia Azure Storage nie został podany ani jako argument --connect-str, ani w pliku .env jako AZURE_STORAGE_CONNECTION_STRING.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    return AzureBackend(connect_str, verify_md5=not args.no_md5_check)
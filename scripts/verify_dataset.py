@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Weryfikuje kopię datasetu (np. po skopiowaniu na węzeł GPU) względem dataset_manifest.tsv.
+
+Tryby:
+  size   - tylko istnienie i rozmiar każdego pliku (sekundy nawet dla milionów plików),
+  sample - jak size + SHA-256 losowej próbki plików (--sample-fraction) i plików konfiguracyjnych,
+  full   - SHA-256 wszystkich plików.
+Zawsze sprawdzany jest podpis manifestu i pliki nadmiarowe (w images/, labels/, których nie ma
+w manifeście). Jeśli ustawiono DATASET_MANIFEST_KEY lub podano --require-signature, brak pliku
+.sig jest błędem (usunięcie podpisu nie omija weryfikacji). Sprawdzanie idzie w --workers
+wątkach; na końcu wypisywana jest przepustowość. Kod wyjścia: 0 - zgodny, 1 - niezgodny, 2 - błąd.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from dataset_manifest import (
+    MANIFEST_FILENAME,
+    MANIFEST_KEY_ENV,
+    SIGNATURE_SUFFIX,
+    SIGNATURE_VALID,
+    SIGNATURE_INVALID,
+    SIGNATURE_MISSING,
+    CONFIG_FILES,
+    DEFAULT_HASH_WORKERS,
+    ManifestEntry,
+    read_manifest,
+    manifest_key,
+    check_manifest_signature,
+    iter_dataset_files,
+    file_sha256,
+)
+from parallel import ordered_thread_map
+
+MODE_SIZE = "size"
+MODE_SAMPLE = "sample"
+MODE_FULL = "full"
+MAX_REPORTED_PROBLEMS = 20
+
+
+def check_entry(dataset_dir: str, entry: ManifestEntry, hash_file: bool) -> str:
+    """Zwraca 'ok', 'missing', 'size' lub 'hash'."""
+    path = os.path.join(dataset_dir, entry.path)
+    try:
+        if os.stat(path).st_size != entry.size:
+            return "size"
+        if hash_file and file_sha256(path) != entry.sha256:
+            return "hash"
+    except FileNotFoundError:
+        return "missing"
+    return "ok"
+
+
+def select_for_hashing(
+    entries: dict[str, ManifestEntry], mode: str, sample_fraction: float, seed: int
+) -> set[str]:
+    if mode == MODE_FULL:
+        return set(entries)
+    if mode == MODE_SIZE:
+        return set()
+    data_paths = sorted(path for path in entries if path not in CONFIG_FILES)
+    sample_size = min(len(data_paths), max(1, round(len(data_paths) * sample_fraction)))
+    selected = set(random.Random(seed).sample(data_paths, sample_size))
+    selected.update(path for path in CONFIG_FILES if path in entries)
+    return selected
+
+
+def check_signature(dataset_dir: str, require_signature: bool) -> bool:
+    """Sprawdza podpis manifestu i wypisuje wynik. Zwraca False, jeśli weryfikacja ma się nie powieść."""
+    status = check_manifest_signature(dataset_dir)
+    if status == SIGNATURE_VALID:
+        print("Podpis manifestu: poprawny.")
+        return True
+    if status == SIGNATURE_INVALID:
+        print("BŁĄD: Podpis manifestu jest niepoprawny.", file=sys.stderr)
+        return False
+    if status == SIGNATURE_MISSING:
+        if require_signature or manifest_key() is not None:
+            print(
+                f"BŁĄD: Brak podpisu manifestu ({MANIFEST_FILENAME}{SIGNATURE_SUFFIX}), a jest wymagany.",
+                file=sys.stderr,
+            )
+            return False
+        print(
+            f"Podpis manifestu: nie sprawdzono (brak pliku {SIGNATURE_SUFFIX} i zmiennej {MANIFEST_KEY_ENV})."
+        )
+        return True
+    if require_signature:
+        print(
+            f"BŁĄD: Nie można sprawdzić podpisu - brak zmiennej {MANIFEST_KEY_ENV}.",
+            file=sys.stderr,
+        )
+        return False
+    print(f"Podpis manifestu: nie sprawdzono (brak zmiennej {MANIFEST_KEY_ENV}).")
+    return True
+
+
+def verify_dataset(
+    dataset_dir: str,
+    mode: str,
+    sample_fraction: float,
+    seed: int,
+    workers: int,
+    require_signature: bool = False,
+) -> bool:
+    entries = read_manifest(dataset_dir)
+    if entries is None:
+        print(
+            f"Błąd: Brak {MANIFEST_FILENAME} w '{dataset_dir}'. Utwórz go organize_yolo_labels.py lub pipeline_async.py.",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    ok = check_signature(dataset_dir, require_signature)
+
+    to_hash = select_for_hashing(entries, mode, sample_fraction, seed)
+    print(
+        f"Weryfikacja {len(entries)} plików w trybie '{mode}' (SHA-256: {len(to_hash)}, wątki: {workers})..."
+    )
+
+    started = time.monotonic()
+    problems = {"missing": [], "size": [], "hash": []}
+    hashed_bytes = 0
+    ordered_entries = sorted(entries.values())
+    results = ordered_thread_map(
+        lambda entry: check_entry(dataset_dir, entry, entry.path in to_hash),
+        ordered_entries,
+        workers,
+    )
+    for entry, status in zip(ordered_entries, results):
+        if status != "ok":
+            problems[status].append(entry.path)
+        elif entry.path in to_hash:
+            hashed_bytes += entry.size
+    extra = sorted(
+        path for path, _ in iter_dataset_files(dataset_dir) if path not in entries
+    )
+    elapsed = max(time.monotonic() - started, 1e-9)
+
+    labels = {
+        "missing": "Brakujące pliki",
+        "size": "Niezgodny rozmiar",
+        "hash": "Niezgodna suma SHA-256",
+    }
+    for status, paths in problems.items():
+        if paths:
+            ok = False
+            print(f"{labels[status]}: {len(paths)}", file=sys.stderr)
+            for path in paths[:MAX_REPORTED_PROBLEMS]:
+                print(f"  {path}", file=sys.stderr)
+    if extra:
+        ok = False
+        print(f"Pliki spoza manifestu: {len(extra)}", file=sys.stderr)
+        for path in extra[:MAX_REPORTED_PROBLEMS]:
+            print(f"  {path}", file=sys.stderr)
+
+    print(
+        f"Czas: {elapsed:.2f} s, {len(entries) / elapsed:.0f} plików/s, "
+        f"haszowanie: {hashed_bytes / (1024 * 1024):.1f} MB ({hashed_bytes / (1024 * 1024) / elapsed:.1f} MB/s)"
+    )
+    print("Dataset ZGODNY z manifestem." if ok else "Dataset NIEZGODNY z manifestem.")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Weryfikuje kopię datasetu względem manifestu (rozmiary i SHA-256 plików, podpis HMAC)."
+    )
+    parser.add_argument(
+        "--dataset-dir", required=True, help="Folder datasetu do sprawdzenia."
+    )
+    parser.add_argument(
+        "--mode",
+        choices=[MODE_SIZE, MODE_SAMPLE, MODE_FULL],
+        default=MODE_SAMPLE,
+        help="size - rozmiary, sample - rozmiary + SHA-256 próbki, full - SHA-256 wszystkiego (domyślnie: sample).",
+    )
+    parser.add_argument(
+        "--sample-fraction",
+        type=float,
+        default=0.01,
+        help="(--mode sample) Ułamek plików sprawdzanych SHA-256 (domyślnie: 0.01).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="(--mode sample) Ziarno losowania próbki (domyślnie: losowe przy każdym uruchomieniu).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_HASH_WORKERS,
+        help=f"Liczba wątków sprawdzających (domyślnie: {DEFAULT_HASH_WORKERS}).",
+    )
+    parser.add_argument(
+        "--require-signature",
+        action="store_true",
+        help=f"Wymagaj poprawnego podpisu manifestu: brak pliku .sig lub zmiennej {MANIFEST_KEY_ENV} jest błędem.",
+    )
+    args = parser.parse_args()
+    error = None
+    if not 0.0 < args.sample_fraction <= 1.0:
+        error = "--sample-fraction musi być w przedziale (0, 1]."
+    elif args.workers < 1:
+        error = "--workers musi być dodatnie."
+    elif not os.path.isdir(args.dataset_dir):
+        error = f"Folder '{args.dataset_dir}' nie istnieje."
+    if error:
+        print(f"Błąd: {error}", file=sys.stderr)
+        sys.exit(2)
+
+    ok = verify_dataset(
+        args.dataset_dir,
+        args.mode,
+        args.sample_fraction,
+        args.seed,
+        args.workers,
+        args.require_signature,
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Tryb ciągły (watch): cyklicznie sprawdza listę archiwów w kontenerze i dołącza do datasetu tylko
+nowe lub zmienione eksporty CVAT.
+
+Eksporty są parowane po wspólnej części nazwy (cvat*.zip <-> yolo*.zip, np. cvat7.zip i yolo7.zip),
+a zmiana jest wykrywana po ETag. Para jest przetwarzana przez potok z pipeline_async.py
+(XML -> pobieranie obrazów -> etykiety), po czym train.txt, val.txt i dataset.yaml są podmieniane
+atomowo, więc trening może je czytać w trakcie działania. ETagi przetworzonych archiwów są
+zapisywane w <dataset>/watch_state.json (restart nie przetwarza ich ponownie), a metryki opóźnień
+(od modyfikacji bloba do gotowych list) są dopisywane do pliku JSON-lines.
+
+Do testów bez Azure: --source local --local-root <mirror>.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import NamedTuple, Optional
+
+from storage_backends import BlobProperties, StorageBackend
+from pipeline_async import add_pipeline_arguments, setup_pipeline, run_pipeline
+
+STATE_FILENAME = "watch_state.json"
+METRICS_FILENAME = "watch_metrics.jsonl"
+
+
+class ExportPair(NamedTuple):
+    key: str
+    xml_blob: BlobProperties
+    yolo_blob: BlobProperties
+
+    @property
+    def last_modified(self) -> Optional[float]:
+        times = [
+            blob.last_modified
+            for blob in (self.xml_blob, self.yolo_blob)
+            if blob.last_modified is not None
+        ]
+        return max(times) if times else None
+
+
+def split_pattern(pattern: str) -> tuple[str, str]:
+    """Rozdziela wzorzec z jedną '*' na (prefiks, sufiks). Rzuca ValueError."""
+    if pattern.count("*") != 1:
+        raise ValueError(f"wzorzec '{pattern}' musi zawierać dokładnie jedną '*'")
+    prefix, suffix = pattern.split("*")
+    return prefix, suffix
+
+
+def list_exports(
+    storage: StorageBackend, container_name: str, pattern: str
+) -> dict[str, BlobProperties]:
+    """Zwraca {klucz: właściwości} dla blobów pasujących do wzorca (klucz = część pod '*')."""
+    prefix, suffix = split_pattern(pattern)
+    exports = {}
+    # Listowanie tylko z prefiksem wzorca - nie przegląda obrazów w kontenerze
+    for blob in storage.list_blobs(container_name, prefix):
+        if blob.name.endswith(suffix) and len(blob.name) >= len(prefix) + len(suffix):
+            exports[blob.name[len(prefix) : len(blob.name) - len(suffix)]] = blob
+    return exports
+
+
+def find_changed_pairs(
+    storage: StorageBackend,
+    container_name: str,
+    xml_pattern: str,
+    yolo_pattern: str,
+    processed_etags: dict[str, str],
+) -> tuple[list[ExportPair], int]:
+    """
+    Zwraca (pary z nowym/zmienionym ETag, od najstarszej modyfikacji; liczba niekompletnych par).
+    Para bez drugiego archiwum czeka na kolejny cykl.
+    """
+    xml_exports = list_exports(storage, container_name, xml_pattern)
+    yolo_exports = list_exports(storage, container_name, yolo_pattern)
+    changed = []
+    for key in xml_exports.keys() & yolo_exports.keys():
+        pair = ExportPair(key, xml_exports[key], yolo_exports[key])
+        if any(
+            processed_etags.get(blob.name) != blob.etag
+            for blob in (pair.xml_blob, pair.yolo_blob)
+        ):
+            changed.append(pair)
+    changed.sort(key=lambda pair: (pair.last_modified or 0.0, pair.key))
+    incomplete = len(xml_exports.keys() ^ yolo_exports.keys())
+    return changed, incomplete
+
+
+def load_state(state_path: str) -> dict[str, str]:
+    """Wczytuje {nazwa_bloba: ETag} przetworzonych archiwów."""
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("processed_etags", {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(
+            f"Ostrzeżenie: Nie można odczytać '{state_path}' ({e}). Wszystkie archiwa zostaną przetworzone.",
+            file=sys.stderr,
+        )
+        return {}
+
+
+def save_state(state_path: str, processed_etags: dict[str, str]):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"processed_etags": processed_etags}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def append_metrics(metrics_path: str, record: dict):
+    with open(metrics_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def existing_class_names(dataset_dir: str) -> Optional[list[str]]:
+    """Klasy istniejącego datasetu, aby nowe archiwa były mapowane do tych samych id."""
+    yaml_path = os.path.join(dataset_dir, "dataset.yaml")
+    if not os.path.exists(yaml_path):
+        return None
+    from organize_yolo_labels import read_class_names_from_dataset_yaml
+
+    return read_class_names_from_dataset_yaml(yaml_path)
+
+
+def process_pairs(
+    args,
+    storage: StorageBackend,
+    pairs: list[ExportPair],
+    processed_etags: dict[str, str],
+    first_seen: dict[tuple[str, str], float],
+) -> int:
+    """Przetwarza pary jednym przebiegiem potoku; zapisuje stan i metryki. Zwraca liczbę nieudanych par."""
+    started = time.time()
+    pipeline_args = argparse.Namespace(
+        **vars(args),
+        xml_blobs=[pair.xml_blob.name for pair in pairs],
+        yolo_blobs=[pair.yolo_blob.name for pair in pairs],
+    )
+    stats = asyncio.run(
+        run_pipeline(pipeline_args, storage, existing_class_names(args.dataset_name))
+    )
+    finished = time.time()
+
+    failed = 0
+    for pair in pairs:
+        blobs = (pair.xml_blob, pair.yolo_blob)
+        pair_failed = any(blob.name in stats.failed_archives for blob in blobs)
+        if pair_failed:
+            failed += 1  # ETag nie jest zapisywany - ponowna próba w kolejnym cyklu
+        else:
+            for blob in blobs:
+                processed_etags[blob.name] = blob.etag
+        detected = min(
+            first_seen.get((blob.name, blob.etag), started) for blob in blobs
+        )
+        if not pair_failed:
+            for blob in blobs:
+                first_seen.pop((blob.name, blob.etag), None)
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pair": pair.key,
+            "xml_blob": pair.xml_blob.name,
+            "yolo_blob": pair.yolo_blob.name,
+            "ok": not pair_failed,
+            "detection_lag_s": None,
+            "processing_s": round(finished - started, 3),
+            "total_lag_s": None,
+            "batch_pairs": len(pairs),
+            "batch_images": stats.names_produced,
+            "batch_downloaded": stats.downloaded,
+        }
+        if pair.last_modified is not None:
+            record["detection_lag_s"] = round(
+                max(0.0, detected - pair.last_modified), 3
+            )
+            record["total_lag_s"] = round(max(0.0, finished - pair.last_modified), 3)
+        append_metrics(os.path.join(args.dataset_name, args.metrics_file), record)
+        lag_text = (
+            f"{record['total_lag_s']} s"
+            if record["total_lag_s"] is not None
+            else "nieznane"
+        )
+        print(
+            f"  Para '{pair.key}': {'OK' if not pair_failed else 'BŁĄD (ponowienie w kolejnym cyklu)'}, "
+            f"opóźnienie od modyfikacji: {lag_text}"
+        )
+
+    save_state(os.path.join(args.dataset_name, STATE_FILENAME), processed_etags)
+    return failed
+
+
+def run_cycle(
+    args,
+    storage: StorageBackend,
+    processed_etags: dict[str, str],
+    first_seen: dict[tuple[str, str], float],
+) -> int:
+    """Jeden cykl: listowanie, wybór zmienionych par (maks. --max-pairs-per-cycle) i przetworzenie. Zwraca liczbę błędów."""
+    changed, incomplete = find_changed_pairs(
+        storage,
+        args.container_name,
+        args.xml_pattern,
+        args.yolo_pattern,
+        processed_etags,
+    )
+    now = time.time()
+    for pair in changed:
+        for blob in (pair.xml_blob, pair.yolo_blob):
+            first_seen.setdefault((blob.name, blob.etag), now)
+    if incomplete:
+        print(f"Niekompletnych par (czekają na drugie archiwum): {incomplete}")
+    if not changed:
+        return 0
+
+    batch = changed[: args.max_pairs_per_cycle]
+    print(
+        f"\n=== {time.strftime('%H:%M:%S')} Nowe/zmienione pary: {len(changed)}, przetwarzanie {len(batch)}: "
+        + ", ".join(pair.key for pair in batch)
+    )
+    return process_pairs(args, storage, batch, processed_etags, first_seen)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tryb ciągły: dołącza nowe lub zmienione eksporty CVAT (pary XML/YOLO wykryte po ETag) do datasetu i atomowo podmienia train.txt, val.txt i dataset.yaml."
+    )
+    parser.add_argument(
+        "--xml-pattern",
+        default="cvat*.zip",
+        help="Wzorzec nazw archiwów CVAT XML z jedną '*' (domyślnie: cvat*.zip).",
+    )
+    parser.add_argument(
+        "--yolo-pattern",
+        default="yolo*.zip",
+        help="Wzorzec nazw archiwów YOLO z jedną '*'; para to archiwa o tej samej części pod '*' (domyślnie: yolo*.zip).",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60.0,
+        help="Odstęp między sprawdzeniami kontenera w sekundach (domyślnie: 60).",
+    )
+    parser.add_argument(
+        "--max-pairs-per-cycle",
+        type=int,
+        default=4,
+        help="Maksymalna liczba par przetwarzanych w jednym cyklu; reszta czeka na kolejne cykle (domyślnie: 4).",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=METRICS_FILENAME,
+        help=f"Plik JSON-lines z metrykami opóźnień (w folderze datasetu, domyślnie: {METRICS_FILENAME}).",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Wykonaj jeden cykl i zakończ (np. z crona lub w testach).",
+    )
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    try:
+        split_pattern(args.xml_pattern)
+        split_pattern(args.yolo_pattern)
+    except ValueError as e:
+        sys.exit(f"Błąd: {e}")
+    if args.poll_interval <= 0 or args.max_pairs_per_cycle < 1:
+        sys.exit("Błąd: --poll-interval i --max-pairs-per-cycle muszą być dodatnie.")
+    storage = setup_pipeline(args)
+
+    os.makedirs(args.dataset_name, exist_ok=True)
+    processed_etags = load_state(os.path.join(args.dataset_name, STATE_FILENAME))
+    first_seen = {}
+    print(
+        f"Obserwowanie: {storage.describe(args.container_name)}, wzorce '{args.xml_pattern}' / '{args.yolo_pattern}', "
+        f"przetworzonych archiwów: {len(processed_etags)}"
+    )
+
+    try:
+        while True:
+            cycle_started = time.monotonic()
+            try:
+                failed = run_cycle(args, storage, processed_etags, first_seen)
+            except Exception as e:
+                print(f"Błąd cyklu obserwowania: {e}", file=sys.stderr)
+                failed = 1
+            if args.once:
+                sys.exit(1 if failed else 0)
+            time.sleep(
+                max(0.0, args.poll_interval - (time.monotonic() - cycle_started))
+            )
+    except KeyboardInterrupt:
+        print("\nZatrzymano obserwowanie.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Skrypty importują się nawzajem po nazwie modułu (uruchamiane z folderu scripts/)."""
+
+import os
+import sys
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from annotation_cache import CachedRecordsWriter, iter_cached_records
+
+KEY = ("cvat", "kontener", "cvat1.zip", "etag-1")
+
+
+def write_entry(cache_dir, records, header=None):
+    writer = CachedRecordsWriter(str(cache_dir), *KEY, header or {"xml_name": "a.xml"})
+    for record in records:
+        writer.append(record)
+    assert writer.commit()
+    return writer.entry_path
+
+
+def test_records_roundtrip(tmp_path):
+    records = [[f"img{i}.jpeg", i, 0, {"r": i}, [0]] for i in range(5000)]
+    write_entry(tmp_path, records)
+    header, it = iter_cached_records(str(tmp_path), *KEY)
+    assert header == {"xml_name": "a.xml"}
+    assert list(it) == records
+
+
+def test_other_etag_misses(tmp_path):
+    write_entry(tmp_path, [["a.jpeg", 1, 0, {}, [0]]])
+    assert (
+        iter_cached_records(str(tmp_path), "cvat", "kontener", "cvat1.zip", "x") is None
+    )
+
+
+def test_abort_leaves_no_entry(tmp_path):
+    writer = CachedRecordsWriter(str(tmp_path), *KEY, {"xml_name": "a.xml"})
+    writer.append(["a.jpeg", 1, 0, {}, [0]])
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+    assert iter_cached_records(str(tmp_path), *KEY) is None
+
+
+def test_truncated_entry_is_removed(tmp_path):
+    records = [[f"img{i}.jpeg", i, 0, {}, [0]] for i in range(20000)]
+    path = write_entry(tmp_path, records)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+    header, it = iter_cached_records(str(tmp_path), *KEY)
+    with pytest.raises(ValueError):
+        list(it)
+    assert not os.path.exists(path)
+
+
+def test_corrupt_header_is_removed(tmp_path):
+    path = write_entry(tmp_path, [])
+    with open(path, "wb") as f:
+        f.write(b"to nie jest zlib")
+    assert iter_cached_records(str(tmp_path), *KEY) is None
+    assert not os.path.exists(path)
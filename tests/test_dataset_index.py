@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from dataset_index import (
+    STATUS_OK,
+    STATUS_QUARANTINED,
+    merge_index_entries,
+    read_dataset_index,
+    write_dataset_index,
+    write_split_lists,
+)
+
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_merge_keeps_entries_missing_from_current():
+    previous = {
+        "a.jpeg": ("train", True, STATUS_OK),
+        "b.jpeg": ("valid", False, STATUS_OK),
+    }
+    merged, changed = merge_index_entries(
+        previous, {"c.jpeg": ("train", False, STATUS_OK)}
+    )
+    assert merged == {**previous, "c.jpeg": ("train", False, STATUS_OK)}
+    assert changed == {"c.jpeg"}
+
+
+def test_merge_preserves_status_and_label_flag():
+    previous = {
+        "a.jpeg": ("train", True, STATUS_OK),
+        "q.jpeg": ("train", False, STATUS_QUARANTINED),
+        "moved.jpeg": ("train", True, STATUS_OK),
+    }
+    merged, changed = merge_index_entries(
+        previous,
+        {
+            "a.jpeg": ("train", False, STATUS_OK),
+            "q.jpeg": ("train", False, STATUS_OK),
+            "moved.jpeg": ("valid", False, STATUS_OK),
+        },
+    )
+    assert merged["a.jpeg"] == ("train", True, STATUS_OK)
+    assert merged["q.jpeg"] == ("train", False, STATUS_QUARANTINED)
+    # Zmiana zbioru: etykieta z poprzedniego zbioru nie obowiązuje
+    assert merged["moved.jpeg"] == ("valid", False, STATUS_OK)
+    assert changed == {"moved.jpeg"}
+
+
+def test_merge_without_previous_index():
+    current = {"a.jpeg": ("train", False, STATUS_OK)}
+    merged, changed = merge_index_entries(None, current)
+    assert merged == current
+    assert changed == {"a.jpeg"}
+
+
+def test_incremental_lists_after_partial_merges(tmp_path):
+    dataset_dir = str(tmp_path)
+    for batch in (
+        {
+            "a1.jpeg": ("train", False, STATUS_OK),
+            "a2.jpeg": ("valid", False, STATUS_OK),
+        },
+        {"b1.jpeg": ("train", False, STATUS_OK)},
+    ):
+        entries, changed = merge_index_entries(read_dataset_index(dataset_dir), batch)
+        write_dataset_index(dataset_dir, entries, changed)
+        write_split_lists(dataset_dir, entries)
+
+    assert read_lines(tmp_path / "train.txt") == [
+        "images/train/a1.jpeg",
+        "images/train/b1.jpeg",
+    ]
+    assert read_lines(tmp_path / "val.txt") == ["images/valid/a2.jpeg"]
+    assert set(read_dataset_index(dataset_dir)) == {"a1.jpeg", "a2.jpeg", "b1.jpeg"}
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from dataset_manifest import (
+    MANIFEST_FILENAME,
+    MANIFEST_KEY_ENV,
+    SIGNATURE_INVALID,
+    SIGNATURE_MISSING,
+    SIGNATURE_NO_KEY,
+    SIGNATURE_SUFFIX,
+    SIGNATURE_VALID,
+    check_manifest_signature,
+    read_manifest,
+    write_dataset_manifest,
+)
+from verify_dataset import MODE_FULL, verify_dataset
+
+
+@pytest.fixture
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(MANIFEST_KEY_ENV, "sekret")
+    for kind, split, name, content in (
+        ("images", "train", "a.jpeg", b"obraz a"),
+        ("images", "valid", "b.jpeg", b"obraz b"),
+        ("labels", "train", "a.txt", b"0 0.5 0.5 0.1 0.1\n"),
+    ):
+        os.makedirs(tmp_path / kind / split, exist_ok=True)
+        (tmp_path / kind / split / name).write_bytes(content)
+    (tmp_path / "train.txt").write_text("images/train/a.jpeg\n")
+    assert write_dataset_manifest(str(tmp_path), workers=2)
+    return tmp_path
+
+
+def verify(dataset_dir, require_signature=False) -> bool:
+    return verify_dataset(str(dataset_dir), MODE_FULL, 1.0, 0, 2, require_signature)
+
+
+def signature_path(dataset_dir):
+    return dataset_dir / (MANIFEST_FILENAME + SIGNATURE_SUFFIX)
+
+
+def test_signed_manifest_verifies(dataset_dir):
+    assert set(read_manifest(str(dataset_dir))) == {
+        "images/train/a.jpeg",
+        "images/valid/b.jpeg",
+        "labels/train/a.txt",
+        "train.txt",
+    }
+    assert check_manifest_signature(str(dataset_dir)) == SIGNATURE_VALID
+    assert verify(dataset_dir, require_signature=True)
+
+
+def test_modified_file_fails(dataset_dir):
+    (dataset_dir / "labels" / "train" / "a.txt").write_bytes(b"1 0.5 0.5 0.1 0.1\n")
+    assert not verify(dataset_dir)
+
+
+def test_extra_file_fails(dataset_dir):
+    (dataset_dir / "images" / "train" / "extra.jpeg").write_bytes(b"x")
+    assert not verify(dataset_dir)
+
+
+def test_wrong_key_fails(dataset_dir, monkeypatch):
+    monkeypatch.setenv(MANIFEST_KEY_ENV, "inny")
+    assert check_manifest_signature(str(dataset_dir)) == SIGNATURE_INVALID
+    assert not verify(dataset_dir)
+
+
+def test_deleted_signature_fails_when_key_is_set(dataset_dir):
+    os.remove(signature_path(dataset_dir))
+    assert check_manifest_signature(str(dataset_dir)) == SIGNATURE_MISSING
+    assert not verify(dataset_dir)
+
+
+def test_missing_key_passes_only_without_require_signature(dataset_dir, monkeypatch):
+    monkeypatch.setenv(MANIFEST_KEY_ENV, "")
+    assert check_manifest_signature(str(dataset_dir)) == SIGNATURE_NO_KEY
+    assert verify(dataset_dir)
+    assert not verify(dataset_dir, require_signature=True)
+
+
+def test_incremental_manifest_rehashes_changed_files(dataset_dir, monkeypatch):
+    label_path = dataset_dir / "labels" / "train" / "a.txt"
+    label_path.write_bytes(b"0 0.1 0.1 0.1 0.1\n0 0.2 0.2 0.1 0.1\n")
+    hashed = []
+    import dataset_manifest
+
+    original = dataset_manifest.file_sha256
+    monkeypatch.setattr(
+        dataset_manifest,
+        "file_sha256",
+        lambda path: hashed.append(path) or original(path),
+    )
+    assert write_dataset_manifest(str(dataset_dir), workers=1)
+    assert hashed == [str(label_path)]
+    assert verify(dataset_dir, require_signature=True)
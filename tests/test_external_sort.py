@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+
+import external_sort
+from external_sort import ExternalSortWriter
+
+
+def read_lines(path) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def random_names(count: int) -> list[str]:
+    rng = random.Random(count)
+    return [
+        f"cam{rng.randrange(20)}/ż{rng.randrange(count // 2)}.jpeg"
+        for _ in range(count)
+    ]
+
+
+def test_in_memory_result_matches_sorted_set(tmp_path):
+    names = random_names(500)
+    writer = ExternalSortWriter(tmp_dir=str(tmp_path))
+    writer.extend(names)
+    output_path = str(tmp_path / "out.txt")
+
+    assert writer.finish(output_path) == len(set(names))
+    assert not writer.runs
+    assert read_lines(output_path) == sorted(set(names))
+
+
+def test_spilled_runs_merge_to_sorted_set(tmp_path):
+    names = random_names(3000)
+    writer = ExternalSortWriter(memory_budget_mb=0.01, tmp_dir=str(tmp_path))
+    writer.extend(names)
+    assert len(writer.runs) > 1
+    output_path = str(tmp_path / "out.txt")
+
+    assert writer.finish(output_path) == len(set(names))
+    assert read_lines(output_path) == sorted(set(names))
+
+
+def test_multi_pass_merge_above_fan_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(external_sort, "MAX_MERGE_FAN_IN", 3)
+    names = random_names(3000)
+    writer = ExternalSortWriter(memory_budget_mb=0.005, tmp_dir=str(tmp_path))
+    writer.extend(names)
+    assert len(writer.runs) > 9  # Co najmniej dwa poziomy scalania
+    output_path = str(tmp_path / "out.txt")
+
+    assert writer.finish(output_path) == len(set(names))
+    assert writer.merge_count > 3
+    assert read_lines(output_path) == sorted(set(names))
+
+
+def test_finish_removes_work_dir_and_temporary_output(tmp_path):
+    writer = ExternalSortWriter(memory_budget_mb=0.001, tmp_dir=str(tmp_path))
+    writer.extend(random_names(200))
+    output_path = str(tmp_path / "out.txt")
+    writer.finish(output_path)
+
+    assert not os.path.exists(writer.work_dir)
+    assert sorted(os.listdir(tmp_path)) == ["out.txt"]
+
+
+def test_empty_input_writes_empty_file(tmp_path):
+    output_path = str(tmp_path / "out.txt")
+    assert ExternalSortWriter(tmp_dir=str(tmp_path)).finish(output_path) == 0
+    assert read_lines(output_path) == []
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import io
+
+from find_images_to_train import StagedSelection, extract_training_images_from_xml
+
+XML = """<annotations>
+  <image id="0" name="a.jpeg"><box label="samochód"/><box label="samochód"/></image>
+  <image id="1" name="b.jpeg"></image>
+  <image id="2" name="c.jpeg"><tag label="brak reklam"/></image>
+  <image id="3" name="d.jpeg"><box label="rower"/></image>
+</annotations>
+"""
+
+
+def test_selected_images_are_streamed_to_callback(tmp_path):
+    xml_path = tmp_path / "annotations.xml"
+    xml_path.write_text(XML, encoding="utf-8")
+    kept = []
+    count = extract_training_images_from_xml(
+        str(xml_path), lambda name, matched: kept.append((name, matched))
+    )
+    assert count == 3
+    assert [name for name, _ in kept] == ["a.jpeg", "c.jpeg", "d.jpeg"]
+    assert all(matched for _, matched in kept)
+
+
+def test_records_are_built_only_on_request(tmp_path):
+    xml_path = tmp_path / "annotations.xml"
+    xml_path.write_text(XML, encoding="utf-8")
+    records = []
+    extract_training_images_from_xml(
+        str(xml_path), lambda name, matched: None, image_records=records
+    )
+    assert records[0][:4] == ["a.jpeg", 2, 0, {"samochód": 2}]
+    assert records[1][:3] == ["c.jpeg", 0, 1]
+
+
+def test_parse_error_returns_none_and_keeps_earlier_images(tmp_path):
+    xml_path = tmp_path / "annotations.xml"
+    xml_path.write_text(XML.replace("</annotations>", "<image"), encoding="utf-8")
+    kept = []
+    assert (
+        extract_training_images_from_xml(
+            str(xml_path), lambda name, matched: kept.append(name)
+        )
+        is None
+    )
+    assert kept == ["a.jpeg", "c.jpeg", "d.jpeg"]
+
+
+def test_staged_selection_reaches_output_only_on_commit(tmp_path):
+    staged = StagedSelection(str(tmp_path), with_label_stats=True)
+    staged.add("stare.jpeg", [0])
+    staged.label_stats_file.write("stare.jpeg\tr=1\n")
+    staged.clear()  # np. uszkodzony cache - archiwum przetwarzane od nowa
+    staged.add("cam/a\tb.jpeg", [0, 2])
+    staged.label_stats_file.write("cam/a\tb.jpeg\tr=2\n")
+    assert staged.count == 1
+
+    kept = []
+    label_stats_file = io.StringIO()
+    staged.commit(lambda name, matched: kept.append((name, matched)), label_stats_file)
+    staged.close()
+    assert kept == [("cam/a\tb.jpeg", [0, 2])]
+    assert label_stats_file.getvalue() == "cam/a\tb.jpeg\tr=2\n"
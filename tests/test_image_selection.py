@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from image_selection import (
+    WeightedSampler,
+    compile_rules,
+    compile_selection,
+    load_rules,
+    match_rules,
+    rules_cache_stage,
+)
+
+IMAGE = ET.fromstring(
+    '<image name="cam/a.jpeg" width="100" height="50">'
+    '<box label="car" xtl="0" ytl="0" xbr="20" ybr="20" occluded="0"/>'
+    '<box label="car" xtl="0" ytl="0" xbr="10" ybr="10" occluded="1"/>'
+    '<box label="bus" xtl="0" ytl="0" xbr="5" ybr="5" occluded="0"/>'
+    '<tag label="noc"/>'
+    "</image>"
+)
+
+
+def matches(expression: str) -> bool:
+    return match_rules(compile_rules([("r", 1.0, expression)]), IMAGE) == [0]
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "n_boxes == 3 and n_tags == 1 and n_occluded == 1",
+        'boxes("car", min_area=400) == 1',
+        'boxes(("car", "bus"), occluded=False) == 2',
+        'has_label("bus") and not has_label("truck")',
+        'has_tag("noc") and has_tag(["dzien", "noc"])',
+        'max_box_area("car") == 400.0',
+        'name_like("cam/*.jpeg") and name in ["cam/a.jpeg"]',
+        "width / height == 2 and -width < 0",
+    ],
+)
+def test_allowed_expressions_are_evaluated(expression):
+    assert matches(expression)
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "name.__class__",
+        "name.upper() == 'A'",
+        "name[0] == 'c'",
+        "(lambda: 1)()",
+        "[x for x in name]",
+        '__import__("os")',
+        'open("/etc/passwd")',
+        "boxes",
+        "unknown > 0",
+        "n_boxes > 0 if name else 0",
+        "(n := 1)",
+        "{'a': 1}",
+        "f'{name}'",
+        "b'x' in name",
+        "... == n_boxes",
+        "boxes(**{'label': 'car'})",
+        "boxes(**name) > 0",
+        "boxes(foo=1) > 0",
+        "boxes('a', 'b', 'c') > 0",
+        "boxes('car', 1, 2, True, 5) > 0",
+        "boxes(['car', 1]) > 0",
+        "has_tag()",
+        "sample('x')",
+        "n_boxes / 0 > 1",
+        "n_boxes >",
+    ],
+)
+def test_disallowed_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        compile_selection(expression)
+
+
+def test_evaluation_error_fails_only_its_rule(capsys):
+    flat = ET.fromstring('<image name="cam/b.jpeg" width="10" height="0"/>')
+    rules = compile_rules(
+        [("ratio", 1.0, "width / height > 1"), ("all", 1.0, "n_boxes == 0")]
+    )
+    rule_errors = [0, 0]
+
+    assert match_rules(rules, flat, rule_errors) == [1]
+    assert match_rules(rules, flat, rule_errors) == [1]
+    assert rule_errors == [2, 0]
+    assert capsys.readouterr().err.count("ZeroDivisionError") == 1
+
+
+def test_n_tags_counts_distinct_tag_labels_like_cache_records(tmp_path):
+    from find_images_to_train import extract_training_images_from_xml
+
+    xml_path = tmp_path / "annotations.xml"
+    xml_path.write_text(
+        '<annotations><image name="a.jpeg"><tag label="noc"/><tag label="noc"/>'
+        '<tag label="deszcz"/></image></annotations>',
+        encoding="utf-8",
+    )
+    rules = compile_rules([("r", 1.0, "n_tags == 2")])
+    records = []
+    extract_training_images_from_xml(
+        str(xml_path), lambda name, matched: None, image_records=records, rules=rules
+    )
+    assert records[0][2] == 2
+
+
+def test_sample_is_deterministic_per_name():
+    assert matches("sample(1.0)") and not matches("sample(0.0)")
+    rule = compile_rules([("r", 1.0, "sample(0.5)")])
+    assert len({tuple(match_rules(rule, IMAGE)) for _ in range(5)}) == 1
+
+
+def test_load_rules_reads_file_and_select_specs(tmp_path):
+    rules_file = tmp_path / "rules.tsv"
+    rules_file.write_text(
+        "# komentarz\nauta\t2.5\tboxes('car') > 0\nnoc\thas_tag('noc')\n",
+        encoding="utf-8",
+    )
+    rules = load_rules(["busy=has_label('bus')", "n_boxes == 0"], str(rules_file))
+
+    assert [(rule.name, rule.weight) for rule in rules] == [
+        ("auta", 2.5),
+        ("noc", 1.0),
+        ("busy", 1.0),
+        ("regula4", 1.0),
+    ]
+    assert match_rules(rules, IMAGE) == [0, 1, 2]
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["a\tx\tn_boxes > 0\n", "a\n", "a\t1\tn_boxes > 0\textra\n"],
+)
+def test_malformed_rules_file_is_rejected(tmp_path, content):
+    rules_file = tmp_path / "rules.tsv"
+    rules_file.write_text(content, encoding="utf-8")
+    with pytest.raises(ValueError):
+        load_rules(None, str(rules_file))
+
+
+def test_duplicate_names_and_negative_weights_are_rejected():
+    with pytest.raises(ValueError):
+        load_rules(["a=n_boxes > 0", "a=n_tags > 0"], None)
+    with pytest.raises(ValueError):
+        compile_rules([("a", -1.0, "n_boxes > 0")])
+
+
+def test_default_rule_keeps_plain_cache_stage():
+    assert rules_cache_stage(load_rules(None, None)) == "cvat"
+    assert rules_cache_stage(load_rules(["n_boxes > 1"], None)).startswith("cvat-")
+
+
+def test_weighted_sampler_keeps_unique_items_up_to_sample_size():
+    sampler = WeightedSampler(3, seed=1)
+    for item in ["a", "b", "a", "c", "d", "e"]:
+        sampler.add(item, 1.0)
+    sampler.add("f", 0.0)
+    result = sampler.result()
+    assert len(result) == 3 and len(set(result)) == 3 and "f" not in result
+    assert result == sorted(result)
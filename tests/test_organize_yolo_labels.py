@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import random
+
+import pytest
+
+from annotation_cache import load_cached_annotations, store_cached_annotations
+from organize_yolo_labels import (
+    LabelClaims,
+    WrittenLabelStats,
+    decode_cached_labels,
+    encode_cached_labels,
+    organize_labels,
+    remap_label_content,
+    remap_label_contents,
+)
+from prepare_yolo_dataset import read_label_stats
+
+IRREGULAR = [
+    b"",
+    b"1 0.5 0.5 0.1 0.1",
+    b"\n1 a\r\n 2 b \n\n",
+    b"5 0.5 0.5 0.1 0.1\n0 0.5 0.5 0.1 0.1\n",
+    b"x y\n1 z\n",
+    b"01 0.5\n",
+    b"0\n",
+    b"1  0.5\n",
+    b"2\t0.5\n",
+    b"-1 0.5\n",
+    b"1 0.5\x00\n",
+]
+
+
+def random_labels(rng: random.Random, num_classes: int, count: int) -> list[bytes]:
+    return [
+        b"".join(
+            b"%d %.6f %.6f %.6f %.6f\n"
+            % (rng.randrange(num_classes), *(rng.random() for _ in range(4)))
+            for _ in range(rng.randrange(6))
+        )
+        for _ in range(count)
+    ]
+
+
+def per_file(contents: list[bytes], class_remap: list[int]):
+    results = [remap_label_content(content, class_remap) for content in contents]
+    return [content for content, _ in results], sum(lines for _, lines in results)
+
+
+@pytest.mark.parametrize(
+    "class_remap",
+    [
+        [2, 0, 1],
+        [0, 12, 5],  # Szersze id po przemapowaniu
+        list(range(11, -1, -1)),  # Węższe i szersze id
+        [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 10],
+    ],
+)
+def test_bulk_remap_matches_per_line_remap(class_remap):
+    rng = random.Random(len(class_remap))
+    contents = random_labels(rng, len(class_remap), 300) + IRREGULAR
+    rng.shuffle(contents)
+    assert remap_label_contents(contents, class_remap) == per_file(
+        contents, class_remap
+    )
+
+
+def test_invalid_class_lines_are_dropped_and_counted():
+    contents = [b"0 0.1\n3 0.2\n1 0.3\n", b"1 0.4\n"]
+    assert remap_label_contents(contents, [1, 0]) == (
+        [b"1 0.1\n0 0.3\n", b"0 0.4\n"],
+        1,
+    )
+
+
+def test_bulk_remap_spans_several_chunks(monkeypatch):
+    import organize_yolo_labels
+
+    monkeypatch.setattr(organize_yolo_labels, "LABEL_REMAP_BATCH", 7)
+    contents = random_labels(random.Random(1), 11, 50)
+    assert remap_label_contents(contents, list(range(10, -1, -1))) == per_file(
+        contents, list(range(10, -1, -1))
+    )
+
+
+@pytest.fixture
+def no_progress(monkeypatch):
+    import progress_reporter
+
+    monkeypatch.setitem(
+        progress_reporter._settings, "mode", progress_reporter.PROGRESS_NONE
+    )
+
+
+def dataset_with_images(tmp_path, images: dict[str, str]) -> str:
+    for split, image in images.items():
+        os.makedirs(tmp_path / "images" / split, exist_ok=True)
+        (tmp_path / "images" / split / image).write_bytes(b"")
+    return str(tmp_path)
+
+
+def test_label_stats_come_from_written_labels(tmp_path, no_progress):
+    dataset_dir = dataset_with_images(
+        tmp_path, {"train": "cam_a.jpeg", "valid": "cam_b.jpeg"}
+    )
+    xml_stats_path = tmp_path / "xml_stats.tsv"
+    xml_stats_path.write_text("cam/a.jpeg\tcar=1\tbus=1\ncam/b.jpeg\tcar=1\n")
+    stats_file = io.StringIO()
+    label_stats = WrittenLabelStats(
+        ["bus", "car"], stats_file, read_label_stats(str(xml_stats_path))
+    )
+    # Archiwum ma klasy [car, bus]; linia z id 2 jest usuwana przy przepisywaniu id
+    organize_labels(
+        [],
+        "",
+        dataset_dir,
+        {"cam/a": "cam_a.jpeg", "cam/b": "cam_b.jpeg"},
+        "obj_train_data",
+        [1, 0],
+        {
+            "obj_train_data/cam/a.txt": b"0 0.5 0.5 0.1 0.1\n1 0.5 0.5 0.1 0.1\n",
+            "obj_train_data/cam/b.txt": b"0 0.5 0.5 0.1 0.1\n2 0.5 0.5 0.1 0.1\n",
+        },
+        workers=1,
+        label_stats=label_stats,
+    )
+
+    assert sorted(stats_file.getvalue().splitlines()) == [
+        "cam/a.jpeg\tbus=1\tcar=1",
+        "cam/b.jpeg\tcar=1",
+    ]
+    assert label_stats.split_counts == {True: {0: 1, 1: 1}, False: {1: 1}}
+    assert label_stats.compared_images == 2
+    assert label_stats.mismatched_images == 0
+
+
+def test_label_stats_report_differences_from_xml(tmp_path, capsys, no_progress):
+    dataset_dir = dataset_with_images(tmp_path, {"train": "cam_a.jpeg"})
+    xml_stats_path = tmp_path / "xml_stats.tsv"
+    xml_stats_path.write_text("cam/a.jpeg\tcar=2\n")
+    label_stats = WrittenLabelStats(
+        ["car"], xml_stats=read_label_stats(str(xml_stats_path))
+    )
+    organize_labels(
+        [],
+        "",
+        dataset_dir,
+        {"cam/a": "cam_a.jpeg"},
+        "obj_train_data",
+        [0],
+        {"obj_train_data/cam/a.txt": b"0 0.5 0.5 0.1 0.1\n1 0.5 0.5 0.1 0.1\n"},
+        workers=1,
+        label_stats=label_stats,
+    )
+    label_stats.report()
+
+    assert label_stats.mismatched_images == 1
+    assert "car: XML=2, etykiety=1 (-1)" in capsys.readouterr().err
+
+
+def test_duplicate_labels_keep_first_archive_and_canonical_image(
+    tmp_path, capsys, no_progress
+):
+    dataset_dir = dataset_with_images(tmp_path, {"train": "cam-a.jpeg"})
+    # Mapowanie po --dedup: duplikat cam/copy.jpeg wskazuje na obraz kanoniczny cam/a.jpeg
+    stem_index = {"cam/a": "cam-a.jpeg", "cam/copy": "cam-a.jpeg"}
+    label_claims = LabelClaims(stem_index)
+    label_path = os.path.join(dataset_dir, "labels", "train", "cam-a.txt")
+
+    def organize(archive_label, labels):
+        return organize_labels(
+            [],
+            "",
+            dataset_dir,
+            stem_index,
+            "obj_train_data",
+            label_contents=labels,
+            workers=1,
+            label_claims=label_claims,
+            archive_label=archive_label,
+        )
+
+    assert organize(
+        "first.zip",
+        {
+            "obj_train_data/cam/copy.txt": b"0 0.1 0.1 0.1 0.1\n",
+            "obj_train_data/cam/a.txt": b"0 0.2 0.2 0.2 0.2\n",
+        },
+    ) == (1, 0, 1, 0)
+    assert organize(
+        "second.zip", {"obj_train_data/cam/a.txt": b"0 0.3 0.3 0.3 0.3\n"}
+    ) == (0, 0, 1, 0)
+    with open(label_path, "rb") as f:
+        assert f.read() == b"0 0.2 0.2 0.2 0.2\n"
+
+    label_claims.report()
+    assert (
+        "cam-a.jpeg: z first.zip, pominięte: first.zip: cam/copy, second.zip: cam/a"
+        in capsys.readouterr().err
+    )
+
+
+def test_cached_labels_roundtrip_bytes_that_are_not_utf8(tmp_path):
+    labels = {
+        "obj_train_data/a.txt": b"0 0.5 0.5 0.1 0.1 # opis z\xb3y\n",
+        "obj_train_data/b.txt": "1 0.5 0.5 0.1 0.1 # żółw\n".encode("utf-8"),
+    }
+    store_cached_annotations(
+        str(tmp_path),
+        "yolo",
+        "c",
+        "a.zip",
+        "e1",
+        encode_cached_labels(["r"], labels),
+        1 << 20,
+    )
+    cached = load_cached_annotations(str(tmp_path), "yolo", "c", "a.zip", "e1")
+    assert cached["class_names"] == ["r"]
+    assert decode_cached_labels(cached) == labels
+
+
+def test_cached_labels_from_older_utf8_entries_are_read():
+    cached = {"class_names": ["r"], "labels": {"a.txt": "0 # żółw\n"}}
+    assert decode_cached_labels(cached) == {"a.txt": "0 # żółw\n".encode("utf-8")}
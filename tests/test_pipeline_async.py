@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import asyncio
+
+from pipeline_async import LabelStore, run_pipeline
+from prepare_yolo_dataset import flatten_azure_path
+from storage_backends import LocalBackend
+from tests.test_watch_container import (
+    CONTAINER,
+    add_export,
+    flattened,
+    watch_args,
+    write_zip,
+)
+
+
+def test_label_store_spills_over_budget(tmp_path):
+    store = LabelStore(10, str(tmp_path))
+    store.put("a", b"0 0.5 0.5\n")
+    store.put("b", b"1 0.5 0.5\n")
+    store.put("c", b"2 0.5 0.5\n")
+    assert store.memory_bytes <= 10
+    assert store.spilled_count == 2
+    store.put("b", b"3 0.5 0.5\n")
+    assert len(store) == 3
+    assert store.pop("b") == b"3 0.5 0.5\n"
+    assert store.pop("c") == b"2 0.5 0.5\n"
+    assert store.pop("a") == b"0 0.5 0.5\n"
+    assert store.pop("a") is None
+    assert len(store) == 0
+    store.close()
+
+
+class GatedBackend(LocalBackend):
+    """Wstrzymuje odczyt wybranego archiwum do czasu otwarcia bramki."""
+
+    def __init__(self, root, gated_blob):
+        super().__init__(root)
+        self.gated_blob = gated_blob
+        self.gate = None
+
+    async def read_bytes_async(self, container_name, blob_name):
+        if blob_name == self.gated_blob:
+            await self.gate.wait()
+        return await super().read_bytes_async(container_name, blob_name)
+
+
+def label_files(dataset_dir) -> set[str]:
+    names = set()
+    for split in ("train", "valid"):
+        labels_dir = os.path.join(dataset_dir, "labels", split)
+        if os.path.isdir(labels_dir):
+            names.update(os.listdir(labels_dir))
+    return names
+
+
+def test_labels_are_placed_before_later_archives_load(tmp_path):
+    mirror_root = str(tmp_path / "mirror")
+    dataset_dir = str(tmp_path / "dataset")
+    first = [f"a{i}" for i in range(1, 6)]
+    second = [f"b{i}" for i in range(1, 4)]
+    add_export(mirror_root, "1", first)
+    add_export(mirror_root, "2", second)
+    args = watch_args(dataset_dir, mirror_root)
+    args.xml_blobs = ["cvat1.zip", "cvat2.zip"]
+    args.yolo_blobs = ["yolo1.zip", "yolo2.zip"]
+    args.label_memory_mb = (
+        0  # Wszystkie oczekujące etykiety trafiają do pliku tymczasowego
+    )
+    storage = GatedBackend(mirror_root, "yolo2.zip")
+    expected_first = {os.path.splitext(name)[0] + ".txt" for name in flattened(first)}
+
+    async def run():
+        storage.gate = asyncio.Event()
+        pipeline = asyncio.create_task(run_pipeline(args, storage))
+        deadline = asyncio.get_running_loop().time() + 10
+        while not expected_first <= label_files(dataset_dir):
+            assert asyncio.get_running_loop().time() < deadline
+            await asyncio.sleep(0.01)
+        storage.gate.set()
+        return await pipeline
+
+    stats = asyncio.run(run())
+    assert stats.placed_with_label == len(first) + len(second)
+    assert stats.placed_without_label == 0
+    assert len(label_files(dataset_dir)) == len(first) + len(second)
+
+
+def test_first_archive_label_wins_for_repeated_image(tmp_path):
+    mirror_root = str(tmp_path / "mirror")
+    dataset_dir = str(tmp_path / "dataset")
+    add_export(mirror_root, "1", ["a1", "a2"])
+    add_export(mirror_root, "2", ["a3"])
+    # Drugie archiwum zawiera też inną etykietę obrazu a1
+    write_zip(
+        os.path.join(mirror_root, CONTAINER, "yolo2.zip"),
+        {
+            "obj.names": "r\n",
+            "obj_train_data/cam/a1.txt": "0 0.2 0.2 0.2 0.2\n",
+            "obj_train_data/cam/a3.txt": "0 0.5 0.5 0.1 0.1\n",
+        },
+    )
+    args = watch_args(dataset_dir, mirror_root)
+    args.xml_blobs = ["cvat1.zip", "cvat2.zip"]
+    args.yolo_blobs = ["yolo1.zip", "yolo2.zip"]
+
+    stats = asyncio.run(run_pipeline(args, LocalBackend(mirror_root)))
+    assert stats.label_conflicts == 1
+    assert stats.label_conflict_examples == [("yolo2.zip", "cam/a1")]
+    (a1_label,) = [
+        os.path.join(dataset_dir, "labels", split, name)
+        for split in ("train", "valid")
+        if os.path.isdir(os.path.join(dataset_dir, "labels", split))
+        for name in os.listdir(os.path.join(dataset_dir, "labels", split))
+        if name.startswith(os.path.splitext(flatten_azure_path("cam/a1.jpeg"))[0])
+    ]
+    with open(a1_label, "r", encoding="utf-8") as f:
+        assert f.read() == "0 0.5 0.5 0.1 0.1\n"
+
+
+def test_invalid_class_lines_are_dropped_with_unchanged_class_order(tmp_path):
+    mirror_root = str(tmp_path / "mirror")
+    dataset_dir = str(tmp_path / "dataset")
+    add_export(mirror_root, "1", ["a1"])
+    write_zip(
+        os.path.join(mirror_root, CONTAINER, "yolo1.zip"),
+        {
+            "obj.names": "r\n",
+            "obj_train_data/cam/a1.txt": "0 0.5 0.5 0.1 0.1\n3 0.5 0.5 0.1 0.1\n",
+        },
+    )
+    args = watch_args(dataset_dir, mirror_root)
+    args.xml_blobs = ["cvat1.zip"]
+    args.yolo_blobs = ["yolo1.zip"]
+
+    stats = asyncio.run(run_pipeline(args, LocalBackend(mirror_root)))
+    assert stats.invalid_label_lines == 1
+    (label_path,) = glob.glob(os.path.join(dataset_dir, "labels", "*", "*.txt"))
+    with open(label_path, "rb") as f:
+        assert f.read() == b"0 0.5 0.5 0.1 0.1\n"
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import zipfile
+import argparse
+
+from image_selection import load_rules
+from pipeline_async import add_pipeline_arguments
+from prepare_yolo_dataset import flatten_azure_path
+from storage_backends import LocalBackend
+from watch_container import STATE_FILENAME, load_state, run_cycle
+
+CONTAINER = "c"
+
+
+def write_zip(path, members: dict[str, str]):
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        for name, content in members.items():
+            zip_ref.writestr(name, content)
+
+
+def add_export(mirror_root, key: str, stems: list[str]):
+    """Dodaje do mirrora obrazy cam/<stem>.jpeg oraz parę cvat<key>.zip / yolo<key>.zip."""
+    container_dir = os.path.join(mirror_root, CONTAINER)
+    os.makedirs(os.path.join(container_dir, "cam"), exist_ok=True)
+    for stem in stems:
+        with open(os.path.join(container_dir, "cam", f"{stem}.jpeg"), "wb") as f:
+            f.write(stem.encode("utf-8") * 10)
+    xml = (
+        "<annotations>"
+        + "".join(
+            f'<image name="cam/{stem}.jpeg"><box label="r"/></image>' for stem in stems
+        )
+        + "</annotations>"
+    )
+    write_zip(os.path.join(container_dir, f"cvat{key}.zip"), {"annotations.xml": xml})
+    labels = {f"obj_train_data/cam/{stem}.txt": "0 0.5 0.5 0.1 0.1\n" for stem in stems}
+    write_zip(
+        os.path.join(container_dir, f"yolo{key}.zip"), {"obj.names": "r\n", **labels}
+    )
+
+
+def watch_args(dataset_dir, mirror_root):
+    parser = argparse.ArgumentParser()
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(
+        [
+            "--container-name",
+            CONTAINER,
+            "--dataset-name",
+            dataset_dir,
+            "--source",
+            "local",
+            "--local-root",
+            mirror_root,
+            "--download-workers",
+            "2",
+        ]
+    )
+    args.xml_pattern = "cvat*.zip"
+    args.yolo_pattern = "yolo*.zip"
+    args.max_pairs_per_cycle = 4
+    args.metrics_file = "watch_metrics.jsonl"
+    args.rules = load_rules(None, None)
+    return args
+
+
+def listed_images(dataset_dir) -> set[str]:
+    images = set()
+    for list_name in ("train.txt", "val.txt"):
+        with open(os.path.join(dataset_dir, list_name), "r", encoding="utf-8") as f:
+            images.update(os.path.basename(line.strip()) for line in f if line.strip())
+    return images
+
+
+def flattened(stems: list[str]) -> set[str]:
+    return {flatten_azure_path(f"cam/{stem}.jpeg") for stem in stems}
+
+
+def test_second_cycle_keeps_images_from_first_pair(tmp_path):
+    mirror_root = str(tmp_path / "mirror")
+    dataset_dir = str(tmp_path / "dataset")
+    args = watch_args(dataset_dir, mirror_root)
+    storage = LocalBackend(mirror_root)
+    processed_etags, first_seen = {}, {}
+    first = [f"a{i}" for i in range(1, 7)]
+    second = [f"b{i}" for i in range(1, 4)]
+
+    add_export(mirror_root, "1", first)
+    assert run_cycle(args, storage, processed_etags, first_seen) == 0
+    assert listed_images(dataset_dir) == flattened(first)
+
+    add_export(mirror_root, "2", second)
+    assert run_cycle(args, storage, processed_etags, first_seen) == 0
+    assert listed_images(dataset_dir) == flattened(first + second)
+    assert set(load_state(os.path.join(dataset_dir, STATE_FILENAME))) == {
+        "cvat1.zip",
+        "yolo1.zip",
+        "cvat2.zip",
+        "yolo2.zip",
+    }
+
+    # Brak nowych par - kolejny cykl niczego nie zmienia
+    assert run_cycle(args, storage, processed_etags, first_seen) == 0
+    assert len(listed_images(dataset_dir)) == len(first) + len(second)